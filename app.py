@@ -1,59 +1,204 @@
 import csv
+import os
 import sys
 
-def load_recipes():
+# RECIPE_DEBUG=1이면 검색 과정을 출력한다. 꺼져 있으면 디버그 문자열을 만들지도 않는다.
+DEBUG = os.getenv('RECIPE_DEBUG') == '1'
+# 재료 이름을 색인할 n-gram 최대 길이
+MAX_GRAM = 3
+
+def load_recipes(path='recipes.csv'):
+    """요리 목록을 읽고 요리마다 정규화된 재료와 중복 여부를 미리 계산하는 함수
+
+    'normalized'는 소문자로 바꿔 정렬한 재료 튜플(중복 판정 키)이고,
+    'duplicate'는 앞선 요리와 재료 구성이 같은지 여부다.
+    """
     recipes = []
+    seen_ingredients = set()  # Track unique ingredient combinations
     try:
-        with open('recipes.csv', 'r', encoding='utf-8') as file:
+        with open(path, 'r', encoding='utf-8') as file:
             reader = csv.reader(file)
             next(reader)  # Skip header
             for row in reader:
                 if len(row) >= 8:  # Ensure row has enough columns
+                    normalized = tuple(sorted(ing.lower() for ing in row[2:8] if ing))
                     recipes.append({
                         'name': row[0],
                         'type': row[1],
-                        'ingredients': row[2:8]
+                        'ingredients': row[2:8],
+                        'normalized': normalized,
+                        'duplicate': normalized in seen_ingredients
                     })
+                    seen_ingredients.add(normalized)
     except FileNotFoundError:
-        print("Error: recipes.csv 파일을 찾을 수 없습니다.")
+        print(f"Error: {path} 파일을 찾을 수 없습니다.")
         sys.exit(1)
     return recipes
 
-def find_recipes_by_ingredient(recipes, ingredient):
-    """특정 재료가 포함된 요리를 찾는 함수"""
-    matching_recipes = []
-    seen_ingredients = set()  # Track unique ingredient combinations
-    ingredient = ingredient.lower()
-    
-    print(f"\n[DEBUG] Searching for ingredient: {ingredient}")
-    
-    for recipe in recipes:
-        # Convert all ingredients to lowercase and sort them
-        recipe_ingredients = [ing.lower() for ing in recipe['ingredients'] if ing]
-        recipe_ingredients.sort()
-        ingredients_tuple = tuple(recipe_ingredients)
-        
-        print(f"\n[DEBUG] Processing recipe: {recipe['name']}")
-        print(f"[DEBUG] Ingredients: {recipe_ingredients}")
-        
-        # Check if the ingredient is in any of the recipe's ingredients
-        if any(ingredient in ing.lower() for ing in recipe['ingredients'] if ing):
-            print(f"[DEBUG] Found matching ingredient in {recipe['name']}")
-            # Only add if we haven't seen this combination of ingredients before
-            if ingredients_tuple not in seen_ingredients:
-                print(f"[DEBUG] Adding new unique recipe: {recipe['name']}")
-                matching_recipes.append(recipe)
-                seen_ingredients.add(ingredients_tuple)
-            else:
-                print(f"[DEBUG] Skipping duplicate recipe: {recipe['name']}")
-    
-    print(f"\n[DEBUG] Total unique recipes found: {len(matching_recipes)}")
+class IngredientIndex:
+    """재료 이름 부분 문자열 검색용 색인
+
+    서로 다른 재료 이름(어휘)마다 그 재료가 들어간 요리 번호를 모아 두고,
+    재료 이름의 1~3글자 n-gram으로 어휘를 찾는다. 중복 요리는 색인하지 않는다.
+    """
+
+    def __init__(self, recipes):
+        self.recipes = recipes
+        self.vocabulary = []
+        self._recipe_ids = []
+        self._postings = {}
+        unique_ids = []
+        count_ids = {}
+        vocab_ids = {}
+        for recipe_id, recipe in enumerate(recipes):
+            if recipe['duplicate']:
+                continue
+            distinct = set(recipe['normalized'])
+            unique_ids.append(recipe_id)
+            count_ids.setdefault(len(distinct), []).append(recipe_id)
+            for ingredient in distinct:
+                vocab_id = vocab_ids.get(ingredient)
+                if vocab_id is None:
+                    vocab_id = vocab_ids[ingredient] = len(self.vocabulary)
+                    self.vocabulary.append(ingredient)
+                    self._recipe_ids.append([])
+                    for n in range(1, MAX_GRAM + 1):
+                        for gram in {ingredient[i:i + n] for i in range(len(ingredient) - n + 1)}:
+                            self._postings.setdefault(gram, []).append(vocab_id)
+                self._recipe_ids[vocab_id].append(recipe_id)
+
+        # 비트 i가 요리 번호 i를 뜻하는 정수 비트셋: 전체 요리, 어휘별 요리, 재료 수별 요리
+        self.all_bits = self._to_bits(unique_ids)
+        self._bits = [self._to_bits(ids) for ids in self._recipe_ids]
+        self._count_bits = {count: self._to_bits(ids) for count, ids in count_ids.items()}
+
+    def _to_bits(self, recipe_ids):
+        """요리 번호 목록을 비트셋 정수로 바꾸는 함수 (큰 정수를 반복해서 복사하지 않음)"""
+        buffer = bytearray((len(self.recipes) + 7) // 8)
+        for recipe_id in recipe_ids:
+            buffer[recipe_id >> 3] |= 1 << (recipe_id & 7)
+        return int.from_bytes(buffer, 'little')
+
+    def matching_ingredients(self, ingredient):
+        """검색어를 부분 문자열로 포함하는 어휘 번호를 반환하는 함수"""
+        if not ingredient:
+            return range(len(self.vocabulary))
+        if len(ingredient) <= MAX_GRAM:
+            return self._postings.get(ingredient, [])
+        postings = []
+        for gram in {ingredient[i:i + MAX_GRAM] for i in range(len(ingredient) - MAX_GRAM + 1)}:
+            posting = self._postings.get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return [v for v in candidates if ingredient in self.vocabulary[v]]
+
+    def search(self, ingredient):
+        ingredient = ingredient.lower()
+        recipe_ids = set()
+        for vocab_id in self.matching_ingredients(ingredient):
+            if DEBUG:
+                print(f"[DEBUG] Matched ingredient: {self.vocabulary[vocab_id]}")
+            recipe_ids.update(self._recipe_ids[vocab_id])
+        return [self.recipes[i] for i in sorted(recipe_ids)]
+
+    def term_bits(self, term):
+        """재료 이름에 검색어가 들어간 요리들의 비트셋"""
+        bits = 0
+        for vocab_id in self.matching_ingredients(term.lower()):
+            bits |= self._bits[vocab_id]
+        return bits
+
+    def pantry(self, pantry, exclude=(), require=(), max_missing=0):
+        """가진 재료로 만들 수 있는 요리를 (부족한 재료 수, 덜 갖춘 순)으로 반환하는 함수
+
+        pantry의 재료가 요리 재료 이름의 부분 문자열이면 그 재료를 가진 것으로 본다.
+        require는 모두 들어가야 하는 재료(AND), exclude는 들어가면 안 되는 재료(NOT)이고,
+        부족한 재료가 max_missing개 이하인 요리만 남긴다.
+        가진 재료 수는 어휘 비트셋을 비트 슬라이스 계수기(at_least[j] = j개 이상 가진 요리)에
+        더해 세므로 요리를 하나씩 확인하지 않는다.
+        """
+        allowed = self.all_bits
+        for term in require:
+            allowed &= self.term_bits(term)
+        for term in exclude:
+            allowed &= ~self.term_bits(term)
+        if not allowed:
+            return []
+
+        covered = set()
+        for term in pantry:
+            covered.update(self.matching_ingredients(term.lower()))
+
+        max_count = max(self._count_bits, default=0)
+        at_least = [self.all_bits] + [0] * (max_count + 1)
+        for vocab_id in covered:
+            bits = self._bits[vocab_id] & allowed
+            for j in range(max_count, 0, -1):
+                at_least[j] |= at_least[j - 1] & bits
+        exactly = [at_least[j] & ~at_least[j + 1] for j in range(max_count + 1)]
+
+        results = []
+        for missing in range(max_missing + 1):
+            for count in sorted(self._count_bits, reverse=True):
+                if count < missing:
+                    continue
+                bits = self._count_bits[count] & exactly[count - missing] & allowed
+                if not bits:
+                    continue
+                while bits:
+                    low = bits & -bits
+                    bits ^= low
+                    results.append(self.recipes[low.bit_length() - 1])
+        return results
+
+def build_ingredient_index(recipes):
+    """load_recipes() 결과로 재료 검색 색인을 만드는 함수"""
+    return IngredientIndex(recipes)
+
+def find_recipes_by_ingredient(recipes, ingredient, index=None):
+    """특정 재료가 포함된 요리를 찾는 함수
+
+    index가 주어지면 재료 색인으로 일치하는 요리만 확인하고,
+    없으면 모든 요리를 순서대로 확인한다. 재료 구성이 같은 요리는 처음 것만 반환한다.
+    """
+    if DEBUG:
+        print(f"\n[DEBUG] Searching for ingredient: {ingredient.lower()}")
+    if index is not None:
+        matching_recipes = index.search(ingredient)
+    else:
+        ingredient = ingredient.lower()
+        matching_recipes = [recipe for recipe in recipes
+                            if not recipe['duplicate']
+                            and any(ingredient in ing for ing in recipe['normalized'])]
+    if DEBUG:
+        print(f"\n[DEBUG] Total unique recipes found: {len(matching_recipes)}")
     return matching_recipes
 
+def find_recipes_by_pantry(recipes, pantry, exclude=(), require=(), max_missing=0, index=None):
+    """가진 재료 목록으로 만들 수 있는 요리와 부족한 재료를 찾는 함수
+
+    (요리, 부족한 재료 목록) 튜플을 부족한 재료가 적은 순으로 반환한다.
+    """
+    if index is None:
+        index = build_ingredient_index(recipes)
+    pantry = [term.lower() for term in pantry if term]
+    results = []
+    for recipe in index.pantry(pantry, exclude, require, max_missing):
+        missing = sorted(ing for ing in set(recipe['normalized'])
+                         if not any(term in ing for term in pantry))
+        results.append((recipe, missing))
+    return results
+
 def main():
     recipes = load_recipes()
+    index = build_ingredient_index(recipes)
     
     print("\n=== 요리 검색 프로그램 ===")
+    print("재료를 쉼표로 여러 개 입력하면 가진 재료로 만들 수 있는 요리를 찾습니다.")
+    print("(제외할 재료는 앞에 '-'를 붙이세요. 예: 김치, 두부, 대파, -돼지고기)")
     print("종료하려면 'q' 또는 'quit'를 입력하세요.")
     
     while True:
@@ -68,7 +213,28 @@ def main():
             print("재료를 입력해주세요.")
             continue
         
-        matching_recipes = find_recipes_by_ingredient(recipes, user_input)
+        if ',' in user_input:
+            terms = [term.strip() for term in user_input.split(',') if term.strip()]
+            pantry = [term for term in terms if not term.startswith('-')]
+            exclude = [term[1:].strip() for term in terms if term.startswith('-') and term[1:].strip()]
+            print("부족해도 되는 재료 수를 입력하세요 (기본 0): ", end='')
+            max_missing = input().strip()
+            max_missing = int(max_missing) if max_missing.isdigit() else 0
+
+            results = find_recipes_by_pantry(recipes, pantry, exclude, max_missing=max_missing, index=index)
+            if results:
+                print("\n가진 재료로 만들 수 있는 요리 목록:")
+                for recipe, missing in results:
+                    print(f"\n요리명: {recipe['name']}")
+                    print(f"종류: {recipe['type']}")
+                    print("재료:", ", ".join(recipe['ingredients']))
+                    if missing:
+                        print("부족한 재료:", ", ".join(missing))
+            else:
+                print("\n가진 재료로 만들 수 있는 요리를 찾을 수 없습니다.")
+            continue
+
+        matching_recipes = find_recipes_by_ingredient(recipes, user_input, index)
         
         if matching_recipes:
             print(f"\n'{user_input}'이(가) 포함된 요리 목록:")
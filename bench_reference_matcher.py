@@ -0,0 +1,50 @@
+import time
+from typing import List, Dict
+
+from bible_reference import BOOKS, build_reference_matcher
+
+# 성경 전체 규모(약 31,000절)의 합성 코퍼스: 책마다 장 수와 장별 절 수를 고정한다
+CHAPTERS_PER_BOOK = 18
+VERSES_PER_CHAPTER = 26
+REPEAT = 200
+
+
+def synthetic_corpus() -> List[Dict]:
+    return [{'reference': f'{names[0]} {chapter}:{verse}', 'content': ''}
+            for names in BOOKS
+            for chapter in range(1, CHAPTERS_PER_BOOK + 1)
+            for verse in range(1, VERSES_PER_CHAPTER + 1)]
+
+
+def substring_loop(verses: List[Dict], text: str) -> List[Dict]:
+    """기존 방식: 구절마다 응답 전체에서 참조 문자열을 찾는다"""
+    return [verse for verse in verses if verse['reference'] in text]
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn(*args)
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main():
+    verses = synthetic_corpus()
+    response = ("질문과 가장 관련이 있는 구절은 다음과 같습니다.\n"
+                "1. 요한복음 3:16 - 하나님이 세상을 이처럼 사랑하사\n"
+                "2. 로마서 5:8\n3. John 1:12\n4. 요한일서 4:9\n5. 시편 18:2")
+
+    start = time.perf_counter()
+    matcher = build_reference_matcher(verses)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    loop_ms = timed(substring_loop, verses, response)
+    matcher_ms = timed(matcher.match, response)
+    print(f"구절 {len(verses)}개, 응답 {len(response)}자")
+    print(f"매처 생성: {build_ms:.1f}ms (코퍼스 버전마다 한 번)")
+    print(f"부분 문자열 반복: {loop_ms:.3f}ms/응답 → {[v['reference'] for v in substring_loop(verses, response)]}")
+    print(f"Aho–Corasick: {matcher_ms:.3f}ms/응답 → {[v['reference'] for v in matcher.match(response)]}")
+    print(f"속도 향상: {loop_ms / matcher_ms:.0f}배")
+
+if __name__ == "__main__":
+    main()
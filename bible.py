@@ -1,7 +1,42 @@
 import os
+import time
 import google.generativeai as genai
 from dotenv import load_dotenv
 
+from bible_tokens import estimate_tokens
+
+# 대화 기록에 남길 대략적인 토큰 예산. 넘으면 오래된 대화부터 잘라낸다.
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '4000'))
+
+def trim_history(history, budget=HISTORY_TOKEN_BUDGET):
+    """토큰 예산을 넘지 않도록 오래된 (사용자, 모델) 대화 쌍부터 버리는 함수
+
+    마지막 사용자 메시지는 예산을 넘더라도 항상 남긴다.
+    """
+    total = sum(estimate_tokens(part) for message in history for part in message['parts'])
+    while total > budget and len(history) > 1:
+        dropped = history[:2] if history[0]['role'] == 'user' and len(history) > 2 else history[:1]
+        del history[:len(dropped)]
+        total -= sum(estimate_tokens(part) for message in dropped for part in message['parts'])
+    return history
+
+def stream_reply(model, history):
+    """응답을 스트리밍으로 받아 도착하는 대로 출력하고 (응답, 첫 토큰 시간, 전체 시간)을 반환하는 함수"""
+    start = time.perf_counter()
+    first_token = None
+    chunks = []
+    for chunk in model.generate_content(history, stream=True):
+        text = chunk.text
+        if not text:
+            continue
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        chunks.append(text)
+        print(text, end='', flush=True)
+    print()
+    total = time.perf_counter() - start
+    return ''.join(chunks), first_token if first_token is not None else total, total
+
 def initialize_gemini():
     """Initialize the Gemini model with API key."""
     load_dotenv()
@@ -42,7 +77,7 @@ def initialize_gemini():
     except Exception as e:
         raise Exception(f"Error initializing Gemini: {str(e)}")
 
-def chat_with_bible_character(model, character_name):
+def chat_with_bible_character(model, character_name, history_budget=HISTORY_TOKEN_BUDGET):
     """Start a chat session with the selected biblical character."""
     # Create character prompt
     character_prompts = {
@@ -56,9 +91,13 @@ def chat_with_bible_character(model, character_name):
         print(f"사용 가능한 캐릭터: {', '.join(character_prompts.keys())}")
         return
 
-    # Start chat
-    chat = model.start_chat(history=[])
+    # 캐릭터 설정은 매 메시지에 붙이지 않고 시스템 지시로 한 번만 보낸다
     character_prompt = character_prompts[character_name]
+    persona_model = genai.GenerativeModel(
+        model_name=model.model_name,
+        system_instruction=f"{character_prompt}\n사용자의 메시지에 캐릭터의 관점에서 답변해주세요."
+    )
+    history = []
     
     print(f"\n{character_name}과의 대화를 시작합니다. (종료하려면 'quit' 또는 'exit'를 입력하세요)")
     print("-" * 50)
@@ -75,15 +114,17 @@ def chat_with_bible_character(model, character_name):
         if not user_input:
             continue
 
+        history.append({'role': 'user', 'parts': [user_input]})
+        trim_history(history, history_budget)
         try:
-            # Prepare the prompt with character context
-            full_prompt = f"{character_prompt}\n\n사용자: {user_input}\n\n위의 메시지에 캐릭터의 관점에서 답변해주세요."
-            
-            # Get response from Gemini
-            response = chat.send_message(full_prompt)
-            print(f"\n{character_name}: {response.text}")
+            # Get streamed response from Gemini
+            print(f"\n{character_name}: ", end='', flush=True)
+            reply, first_token, total = stream_reply(persona_model, history)
+            history.append({'role': 'model', 'parts': [reply]})
+            print(f"(첫 토큰 {first_token:.2f}초, 전체 {total:.2f}초)")
             
         except Exception as e:
+            history.pop()
             print(f"\n오류가 발생했습니다: {str(e)}")
 
 def main():
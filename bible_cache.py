@@ -0,0 +1,174 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Optional, Any
+
+SEMANTIC_CACHE_DB = 'semantic_cache.db'
+
+
+def normalize_query(query: str) -> str:
+    """공백·대소문자·유니코드 조합 차이만 있는 질의를 같은 문자열로 바꾸는 함수"""
+    return ' '.join(unicodedata.normalize('NFC', query).lower().split())
+
+
+def corpus_fingerprint(verses: List[Dict]) -> str:
+    """코퍼스 내용으로 만든 버전 문자열 (프로세스를 다시 시작해도 같음)"""
+    digest = hashlib.sha256()
+    for verse in verses:
+        digest.update(verse['reference'].encode('utf-8'))
+        digest.update(b'\x1f')
+        digest.update(verse['content'].encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+def cache_key(query: str, corpus_version: str, model_name: str, config: Dict[str, Any]) -> str:
+    """(정규화된 질의, 코퍼스 버전, 모델 이름, 생성 설정)으로 캐시 키를 만드는 함수"""
+    payload = json.dumps([normalize_query(query), corpus_version, model_name, config],
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SemanticResultCache:
+    """의미론적 검색 결과 캐시
+
+    메모리 LRU 계층과 SQLite 디스크 계층으로 이루어진다. 디스크 계층은
+    ttl초가 지난 항목을 버리고, max_entries를 넘으면 가장 오래 쓰이지 않은
+    항목부터 지운다. path가 None이면 메모리 계층만 쓴다.
+    """
+
+    def __init__(self, path: Optional[str] = SEMANTIC_CACHE_DB, memory_size: int = 256,
+                 max_entries: int = 10000, ttl: float = 7 * 24 * 3600):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if self.path is None:
+            return None
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS semantic_results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL)''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS semantic_results_accessed ON semantic_results (accessed)')
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key: str, value: List[Dict]):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        """캐시된 결과를 반환하는 함수 (없으면 None)"""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+
+            conn = self._db()
+            if conn is not None:
+                now = time.time()
+                row = conn.execute('SELECT value, created FROM semantic_results WHERE key = ?', (key,)).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    conn.execute('UPDATE semantic_results SET accessed = ? WHERE key = ?', (now, key))
+                    conn.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.disk_hits += 1
+                    return value
+                if row:
+                    conn.execute('DELETE FROM semantic_results WHERE key = ?', (key,))
+                    conn.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: List[Dict]):
+        """결과를 두 계층 모두에 저장하는 함수"""
+        value = [{'reference': v['reference'], 'content': v['content']} for v in value]
+        with self._lock:
+            self._remember(key, value)
+            conn = self._db()
+            if conn is None:
+                return
+            now = time.time()
+            conn.execute('INSERT OR REPLACE INTO semantic_results (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                         (key, json.dumps(value, ensure_ascii=False), now, now))
+            conn.execute('DELETE FROM semantic_results WHERE created < ?', (now - self.ttl,))
+            overflow = conn.execute('SELECT COUNT(*) FROM semantic_results').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute('''DELETE FROM semantic_results WHERE key IN (
+                    SELECT key FROM semantic_results ORDER BY accessed, rowid LIMIT ?)''', (overflow,))
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            conn = self._db()
+            if conn is not None:
+                conn.execute('DELETE FROM semantic_results')
+                conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'memory_entries': len(self._memory),
+        }
+
+
+class FragmentCache:
+    """렌더링한 HTML 조각을 키(보통 ETag)별로 보관하는 메모리 LRU 캐시
+
+    키에 코퍼스 버전이 들어가므로 따로 무효화하지 않고, 오래된 조각은 LRU로 밀려난다.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
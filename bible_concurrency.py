@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class ModelBusyError(RuntimeError):
+    """대기열이 가득 찼거나 대기 시간이 지나 모델 호출을 시작하지 못했을 때 발생하는 예외"""
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """같은 키로 동시에 들어온 호출을 하나로 합치는 도우미
+
+    먼저 들어온 호출만 fn을 실행하고, 실행 중에 같은 키로 들어온 호출은
+    그 결과(또는 예외)를 함께 받는다.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+        else:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+
+class CallLimiter:
+    """동시에 실행되는 외부 호출 수를 제한하고, 속도 제한 오류는 지수 백오프로 재시도하는 도우미
+
+    max_concurrent개까지 동시에 실행하고, 최대 max_queue개까지 대기시킨다.
+    대기열이 가득 차거나 queue_timeout초 안에 차례가 오지 않으면 ModelBusyError를 낸다.
+    is_retryable(e)가 참인 예외는 최대 retries번, 매번 [0, min(max_backoff, base_backoff * 2^시도)]
+    범위에서 무작위로 고른 시간만큼 기다린 뒤 다시 시도한다.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 32, queue_timeout: float = 30,
+                 retries: int = 3, base_backoff: float = 1.0, max_backoff: float = 16.0,
+                 is_retryable: Callable[[BaseException], bool] = lambda e: False,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retries = retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.is_retryable = is_retryable
+        self._sleep = sleep
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.waiting = 0
+
+    def backoff(self, attempt: int) -> float:
+        """attempt번째 재시도 전에 기다릴 시간 (full jitter)"""
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def _acquire(self):
+        if self._slots.acquire(blocking=False):
+            return
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                raise ModelBusyError("모델 호출 대기열이 가득 찼습니다.")
+            self.waiting += 1
+        try:
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                raise ModelBusyError("모델 호출 대기 시간이 초과되었습니다.")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                return fn()
+            except Exception as e:
+                if attempt >= self.retries or not self.is_retryable(e):
+                    raise
+            finally:
+                self._slots.release()
+            # 재시도 대기 중에는 슬롯을 다른 호출에 양보한다
+            self._sleep(self.backoff(attempt))
+            attempt += 1
@@ -0,0 +1,319 @@
+import csv
+import io
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import List, Dict, Iterable, Tuple, Iterator, Optional, TextIO
+
+VERSE_KEYS = ('reference', 'content')
+
+
+def split_reference(reference: str) -> Tuple[str, str]:
+    """'요한복음 1:1'을 ('요한복음', '1:1')로 나누는 함수 (책 이름이 없으면 '')"""
+    book, _, rest = reference.rpartition(' ')
+    return (book, rest) if book else ('', reference)
+
+
+class VerseRow(Mapping):
+    """VerseCorpus의 한 구절을 {'reference', 'content'} 딕셔너리처럼 보여 주는 지연 뷰
+
+    값은 접근할 때 버퍼에서 디코딩한다. dict와 비교하면 내용이 같을 때 같다.
+    """
+
+    __slots__ = ('_corpus', '_index')
+
+    def __init__(self, corpus: 'VerseCorpus', index: int):
+        self._corpus = corpus
+        self._index = index
+
+    def __getitem__(self, key: str) -> str:
+        if key == 'reference':
+            return self._corpus.reference(self._index)
+        if key == 'content':
+            return self._corpus.content(self._index)
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(VERSE_KEYS)
+
+    def __len__(self) -> int:
+        return len(VERSE_KEYS)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class VerseCorpus(Sequence):
+    """구절을 연속된 버퍼에 담는 코퍼스
+
+    내용은 UTF-8 바이트열 하나와 오프셋 배열로, 참조는 중복을 없앤 책 이름 목록과
+    구절마다의 책 번호, 그리고 '장:절' 부분의 바이트열·오프셋 배열로 저장한다.
+    구절 하나마다 딕셔너리와 문자열 객체를 두는 load_verses() 결과보다 메모리를 훨씬 적게 쓴다.
+    인덱싱하면 VerseRow 뷰를 돌려주므로 기존의 verse['reference'] 접근이 그대로 동작한다.
+    버퍼는 bytes/array 대신 mmap 위의 memoryview여도 된다(open_compiled_corpus 참고).
+    """
+
+    def __init__(self, books: List[str], book_ids: array, locators: bytes, locator_offsets: array,
+                 contents: bytes, content_offsets: array):
+        self.books = books
+        self._book_ids = book_ids
+        self._locators = locators
+        self._locator_offsets = locator_offsets
+        self._contents = contents
+        self._content_offsets = content_offsets
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str]]) -> 'VerseCorpus':
+        """(reference, content) 쌍들로 코퍼스를 만드는 함수"""
+        books: List[str] = []
+        book_lookup: Dict[str, int] = {}
+        book_ids = array('I')
+        locators, contents = bytearray(), bytearray()
+        locator_offsets, content_offsets = array('Q', [0]), array('Q', [0])
+        for reference, content in rows:
+            book, locator = split_reference(reference)
+            book_id = book_lookup.get(book)
+            if book_id is None:
+                book_id = book_lookup[book] = len(books)
+                books.append(book)
+            book_ids.append(book_id)
+            locators += locator.encode('utf-8')
+            locator_offsets.append(len(locators))
+            contents += content.encode('utf-8')
+            content_offsets.append(len(contents))
+        return cls(books, book_ids, bytes(locators), locator_offsets, bytes(contents), content_offsets)
+
+    @classmethod
+    def from_verses(cls, verses: Iterable[Dict]) -> 'VerseCorpus':
+        return cls.from_rows((v['reference'], v['content']) for v in verses)
+
+    def __len__(self) -> int:
+        return len(self._book_ids)
+
+    def __iter__(self) -> Iterator[VerseRow]:
+        return (VerseRow(self, i) for i in range(len(self)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [VerseRow(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('verse index out of range')
+        return VerseRow(self, index)
+
+    def reference(self, index: int) -> str:
+        book = self.books[self._book_ids[index]]
+        locator = str(self._locators[self._locator_offsets[index]:self._locator_offsets[index + 1]], 'utf-8')
+        return f'{book} {locator}' if book else locator
+
+    def content(self, index: int) -> str:
+        return str(self._contents[self._content_offsets[index]:self._content_offsets[index + 1]], 'utf-8')
+
+    def nbytes(self) -> int:
+        """버퍼와 배열이 차지하는 대략적인 바이트 수"""
+        return (len(self._contents) + len(self._locators) + sum(len(b.encode('utf-8')) for b in self.books)
+                + self._book_ids.itemsize * len(self._book_ids)
+                + self._locator_offsets.itemsize * len(self._locator_offsets)
+                + self._content_offsets.itemsize * len(self._content_offsets))
+
+
+def read_csv_rows(path: str) -> Iterator[Tuple[str, str]]:
+    """load_verses와 같은 형식의 CSV에서 (reference, content)를 읽는 함수"""
+    with open(path, 'r', encoding='utf-8') as file:
+        yield from iter_csv_rows(file)
+
+
+def iter_csv_rows(file: TextIO) -> Iterator[Tuple[str, str]]:
+    """열린 CSV 파일에서 (reference, content)를 한 줄씩 읽는 함수 (첫 줄은 머리글)"""
+    reader = csv.reader(file)
+    next(reader, None)  # Skip header
+    for row in reader:
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def iter_jsonl_rows(file: TextIO) -> Iterator[Tuple[str, str]]:
+    """{"reference": ..., "content": ...}가 한 줄에 하나씩 있는 JSONL 파일을 읽는 함수
+
+    빈 줄은 건너뛰고, 형식이 맞지 않는 줄은 ValueError를 낸다.
+    """
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            yield str(row['reference']), str(row['content'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"{number}번째 줄을 읽을 수 없습니다: {str(e)}") from e
+
+
+# 가져오기·내보내기에서 쓰는 형식 이름
+ROW_FORMATS = ('csv', 'jsonl')
+
+
+def format_for_path(path: str) -> str:
+    """파일 확장자로 형식을 정하는 함수 (.jsonl/.ndjson이면 jsonl, 그 밖은 csv)"""
+    return 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'csv'
+
+
+def iter_rows(file: TextIO, fmt: str) -> Iterator[Tuple[str, str]]:
+    return iter_jsonl_rows(file) if fmt == 'jsonl' else iter_csv_rows(file)
+
+
+def format_rows(verses: Iterable[Dict], fmt: str) -> Iterator[str]:
+    """구절을 CSV(머리글 포함) 또는 JSONL 한 줄씩의 문자열로 바꾸는 함수 (스트리밍 내보내기용)"""
+    if fmt == 'jsonl':
+        for verse in verses:
+            yield json.dumps({'reference': verse['reference'], 'content': verse['content']},
+                             ensure_ascii=False) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    rows = ([verse['reference'], verse['content']] for verse in verses)
+    for row in itertools.chain([VERSE_KEYS], rows):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# 컴파일된 코퍼스 파일 형식 (리틀 엔디언)
+#   헤더: 매직, 형식 버전, 구절 수, 책 수, 원본 CSV의 mtime_ns와 크기
+#   구획 표: 구획마다 (오프셋, 길이)
+#   구획: 책 이름 오프셋(Q), 책 이름 UTF-8, 구절별 책 번호(I), '장:절' 오프셋(Q),
+#         '장:절' UTF-8, 내용 오프셋(Q), 내용 UTF-8 (각 구획은 8바이트 경계에 맞춘다)
+COMPILED_MAGIC = b'BVC1'
+COMPILED_FORMAT = 1
+_HEADER = struct.Struct('<4sIQQqQ')
+_SECTION = struct.Struct('<QQ')
+_SECTION_COUNT = 7
+
+
+def compiled_path_for(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + '.bvc'
+
+
+def _source_stamp(csv_path: str) -> Tuple[int, int]:
+    stat = os.stat(csv_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def compile_corpus(csv_path: str, out_path: Optional[str] = None) -> str:
+    """CSV를 mmap으로 바로 읽을 수 있는 이진 코퍼스 파일로 컴파일하는 함수
+
+    임시 파일에 쓴 뒤 이름을 바꾸므로 다른 프로세스가 반쯤 쓴 파일을 읽지 않는다.
+    """
+    out_path = out_path or compiled_path_for(csv_path)
+    mtime_ns, size = _source_stamp(csv_path)
+    corpus = VerseCorpus.from_rows(read_csv_rows(csv_path))
+
+    book_names = bytearray()
+    book_offsets = array('Q', [0])
+    for book in corpus.books:
+        book_names += book.encode('utf-8')
+        book_offsets.append(len(book_names))
+    sections = [book_offsets.tobytes(), bytes(book_names), corpus._book_ids.tobytes(),
+                corpus._locator_offsets.tobytes(), corpus._locators,
+                corpus._content_offsets.tobytes(), corpus._contents]
+
+    position = _HEADER.size + _SECTION.size * _SECTION_COUNT
+    table = []
+    for data in sections:
+        position += -position % 8
+        table.append((position, len(data)))
+        position += len(data)
+
+    directory = os.path.dirname(os.path.abspath(out_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(_HEADER.pack(COMPILED_MAGIC, COMPILED_FORMAT, len(corpus), len(corpus.books), mtime_ns, size))
+            for offset, length in table:
+                file.write(_SECTION.pack(offset, length))
+            for (offset, _), data in zip(table, sections):
+                file.write(b'\0' * (offset - file.tell()))
+                file.write(data)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return out_path
+
+
+def _read_header(path: str):
+    with open(path, 'rb') as file:
+        header = file.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    magic, version, *rest = _HEADER.unpack(header)
+    if magic != COMPILED_MAGIC or version != COMPILED_FORMAT:
+        return None
+    return rest
+
+
+def open_compiled_corpus(path: str) -> VerseCorpus:
+    """컴파일된 코퍼스 파일을 mmap하여 복사 없이 VerseCorpus로 여는 함수
+
+    여러 프로세스가 같은 파일을 열면 운영체제 페이지 캐시를 함께 쓴다.
+    """
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic, version, n_verses, n_books, _, _ = _HEADER.unpack_from(view)
+    if magic != COMPILED_MAGIC or version != COMPILED_FORMAT:
+        raise ValueError(f"{path}은(는) 컴파일된 코퍼스 파일이 아닙니다.")
+    table = [_SECTION.unpack_from(view, _HEADER.size + i * _SECTION.size) for i in range(_SECTION_COUNT)]
+    sections = [view[offset:offset + length] for offset, length in table]
+
+    book_offsets = sections[0].cast('Q')
+    books = [str(sections[1][book_offsets[i]:book_offsets[i + 1]], 'utf-8') for i in range(n_books)]
+    corpus = VerseCorpus(books, sections[2].cast('I'), sections[4], sections[3].cast('Q'),
+                         sections[6], sections[5].cast('Q'))
+    corpus._mmap = mapped
+    return corpus
+
+
+def is_compiled_fresh(csv_path: str, compiled_path: str) -> bool:
+    """컴파일된 파일이 있고 원본 CSV의 mtime·크기가 컴파일할 때와 같은지 확인하는 함수"""
+    try:
+        header = _read_header(compiled_path)
+        stamp = _source_stamp(csv_path)
+    except OSError:
+        return False
+    return header is not None and tuple(header[2:]) == stamp
+
+
+def load_compiled_corpus(csv_path: str, compiled_path: Optional[str] = None) -> VerseCorpus:
+    """CSV의 컴파일된 코퍼스를 여는 함수 (없거나 CSV가 바뀌었으면 다시 컴파일)
+
+    컴파일된 파일을 쓸 수 없으면 CSV를 직접 읽는다.
+    """
+    compiled_path = compiled_path or compiled_path_for(csv_path)
+    if not is_compiled_fresh(csv_path, compiled_path):
+        try:
+            compile_corpus(csv_path, compiled_path)
+        except OSError:
+            return VerseCorpus.from_rows(read_csv_rows(csv_path))
+    return open_compiled_corpus(compiled_path)
+
+
+def main():
+    """python bible_corpus.py compile [CSV 경로] [출력 경로]"""
+    args = sys.argv[1:]
+    if not args or args[0] != 'compile' or len(args) > 3:
+        print("사용법: python bible_corpus.py compile [bible_verses.csv] [bible_verses.bvc]")
+        sys.exit(1)
+    csv_path = args[1] if len(args) > 1 else 'bible_verses.csv'
+    out_path = compile_corpus(csv_path, args[2] if len(args) > 2 else None)
+    print(f"{csv_path} → {out_path} 컴파일 완료")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,582 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import List, Dict, Optional
+
+import numpy as np
+
+# 1~3글자 n-gram을 색인한다. 3글자 이하 검색어는 해당 n-gram의
+# 게시 목록(posting list)이 곧 정답이고, 더 긴 검색어는 trigram 게시 목록을
+# 교집합한 뒤 원문으로 한 번 더 확인한다.
+MAX_GRAM = 3
+
+
+def _grams(text: str, n: int):
+    """문자열에서 길이 n인 n-gram을 중복 없이 반환하는 함수"""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramIndex:
+    """load_verses() 결과 위에 만드는 문자 n-gram 역색인
+
+    search_verses와 같은 의미(소문자 기준 부분 문자열 검색, 내용 또는 참조)를
+    게시 목록 교집합과 최종 확인 단계로 계산한다.
+    add()/remove()로 구절을 하나씩 더하거나 지울(묘비 표시) 수 있다. 쓰는 쪽은 한 스레드여야
+    하지만, 게시 목록에 먼저 덧붙이고 구절 수는 마지막에 올리므로 검색은 잠금 없이 함께 돌 수 있다.
+    """
+
+    def __init__(self, verses: List[Dict]):
+        self.verses = verses
+        self._size = 0
+        self._postings: Dict[str, List[int]] = {}
+        self._deleted = set()
+        for verse in verses:
+            self.add(verse)
+
+    def add(self, verse: Dict) -> int:
+        """구절을 색인하고 구절 번호를 반환하는 함수 (새 구절은 self.verses 끝에 먼저 덧붙인다)"""
+        doc_id = self._size
+        content = verse['content'].lower()
+        reference = verse['reference'].lower()
+
+        grams = set()
+        for n in range(1, MAX_GRAM + 1):
+            grams |= _grams(content, n)
+            grams |= _grams(reference, n)
+        for gram in grams:
+            self._postings.setdefault(gram, []).append(doc_id)
+        self._size = doc_id + 1
+        return doc_id
+
+    def remove(self, doc_id: int):
+        """구절을 검색 결과에서 빼는 함수 (게시 목록은 다시 만들 때까지 그대로 둔다)"""
+        self._deleted.add(doc_id)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _candidates(self, keyword: str) -> Optional[List[int]]:
+        """검색어를 포함할 수 있는 구절 번호 목록 (None이면 전체)"""
+        if not keyword:
+            return None
+        if len(keyword) <= MAX_GRAM:
+            return self._postings.get(keyword, [])
+
+        postings = []
+        for gram in _grams(keyword, MAX_GRAM):
+            posting = self._postings.get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+        return sorted(candidates)
+
+    def search(self, keyword: str) -> List[Dict]:
+        """키워드를 포함하는 구절을 코퍼스 순서대로 반환하는 함수"""
+        keyword = keyword.lower()
+        candidates = self._candidates(keyword)
+        if candidates is None:
+            candidates = range(self._size)
+        deleted = self._deleted
+        if len(keyword) <= MAX_GRAM:
+            return [self.verses[i] for i in candidates if i not in deleted]
+
+        # 후보만 소문자로 바꿔 확인하므로 코퍼스 전체의 소문자 사본을 들고 있지 않는다
+        matching = []
+        for i in candidates:
+            if i in deleted:
+                continue
+            verse = self.verses[i]
+            if keyword in verse['content'].lower() or keyword in verse['reference'].lower():
+                matching.append(verse)
+        return matching
+
+
+def build_search_index(verses: List[Dict]) -> NgramIndex:
+    """load_verses() 결과로 키워드 검색 색인을 만드는 함수"""
+    return NgramIndex(verses)
+
+
+# 한글 음절을 자모로 풀어 쓴 문자열 위에 n-gram 색인을 하나 더 만들어 두면
+# 'ㅎㄴㄴ'(초성) 같은 검색어나 입력 중인 '하나니'(→ 하나님) 같은 부분 음절도 색인으로 찾을 수 있다.
+CHOSEONG = 'ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ'
+JUNGSEONG = 'ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ'
+JONGSEONG = ['', 'ㄱ', 'ㄲ', 'ㄳ', 'ㄴ', 'ㄵ', 'ㄶ', 'ㄷ', 'ㄹ', 'ㄺ', 'ㄻ', 'ㄼ', 'ㄽ', 'ㄾ', 'ㄿ', 'ㅀ',
+             'ㅁ', 'ㅂ', 'ㅄ', 'ㅅ', 'ㅆ', 'ㅇ', 'ㅈ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ', 'ㅎ']
+# 겹받침과 겹모음은 키보드로 입력하는 순서대로 나눈다 ('달'이 '닭'의 앞부분이 되도록)
+_COMPOUND_JAMO = {'ㄳ': 'ㄱㅅ', 'ㄵ': 'ㄴㅈ', 'ㄶ': 'ㄴㅎ', 'ㄺ': 'ㄹㄱ', 'ㄻ': 'ㄹㅁ', 'ㄼ': 'ㄹㅂ', 'ㄽ': 'ㄹㅅ',
+                  'ㄾ': 'ㄹㅌ', 'ㄿ': 'ㄹㅍ', 'ㅀ': 'ㄹㅎ', 'ㅄ': 'ㅂㅅ', 'ㅘ': 'ㅗㅏ', 'ㅙ': 'ㅗㅐ', 'ㅚ': 'ㅗㅣ',
+                  'ㅝ': 'ㅜㅓ', 'ㅞ': 'ㅜㅔ', 'ㅟ': 'ㅜㅣ', 'ㅢ': 'ㅡㅣ'}
+_HANGUL_BASE = 0xAC00
+
+
+def _syllable_tables():
+    """str.translate용 음절→자모, 음절→초성 변환표를 만드는 함수"""
+    jamo_table = {ord(k): v for k, v in _COMPOUND_JAMO.items()}
+    choseong_table = {}
+    for code in range(_HANGUL_BASE, _HANGUL_BASE + 19 * 21 * 28):
+        offset = code - _HANGUL_BASE
+        initial, medial, final = offset // (21 * 28), offset // 28 % 21, offset % 28
+        jamo = CHOSEONG[initial] + JUNGSEONG[medial] + JONGSEONG[final]
+        jamo_table[code] = ''.join(_COMPOUND_JAMO.get(c, c) for c in jamo)
+        choseong_table[code] = CHOSEONG[initial]
+    return jamo_table, choseong_table
+
+
+_JAMO_TABLE, _CHOSEONG_TABLE = _syllable_tables()
+
+
+def to_jamo(text: str) -> str:
+    """한글 음절을 자모로 풀어 쓰는 함수 ('하나님' → 'ㅎㅏㄴㅏㄴㅣㅁ')"""
+    return text.translate(_JAMO_TABLE)
+
+
+def to_choseong(text: str) -> str:
+    """한글 음절을 초성으로 바꾸는 함수 ('하나님' → 'ㅎㄴㄴ')"""
+    return text.translate(_CHOSEONG_TABLE)
+
+
+def is_choseong_query(query: str) -> bool:
+    """완성된 음절이나 모음 없이 초성 자음만 쓴 검색어인지 확인하는 함수 ('ㅇㅎㅂㅇ 3:16'도 해당)"""
+    if not any(c in CHOSEONG for c in query):
+        return False
+    return not any(ord(c) in _CHOSEONG_TABLE or c in JUNGSEONG or c in _COMPOUND_JAMO for c in query)
+
+
+class JamoIndex:
+    """구절을 초성 문자열과 자모 문자열로 바꿔 각각 NgramIndex로 색인한 보조 색인
+
+    초성으로만 된 검색어는 초성 색인에서, 그 밖의 검색어는 자모로 풀어 자모 색인에서
+    부분 문자열로 찾는다. 변환은 색인을 만들 때 한 번만 하므로 검색할 때는 검색어만 바꾼다.
+    """
+
+    def __init__(self, verses: List[Dict]):
+        self.verses = verses
+        self._choseong = NgramIndex([
+            {'id': i, 'reference': to_choseong(v['reference']), 'content': to_choseong(v['content'])}
+            for i, v in enumerate(verses)])
+        self._jamo = NgramIndex([
+            {'id': i, 'reference': to_jamo(v['reference']), 'content': to_jamo(v['content'])}
+            for i, v in enumerate(verses)])
+
+    def search(self, query: str) -> List[Dict]:
+        """초성 또는 부분 음절 검색어와 맞는 구절을 코퍼스 순서대로 반환하는 함수"""
+        query = query.strip()
+        if not query:
+            return []
+        if is_choseong_query(query):
+            found = self._choseong.search(query)
+        else:
+            found = self._jamo.search(to_jamo(query))
+        return [self.verses[v['id']] for v in found]
+
+
+def build_jamo_index(verses: List[Dict]) -> JamoIndex:
+    """load_verses() 결과로 초성·자모 검색 색인을 만드는 함수"""
+    return JamoIndex(verses)
+
+
+# 오타 허용 검색: 코퍼스의 단어 목록(어휘) 위에 단어 bigram 색인을 두고,
+# 편집 거리 k 이내인 단어가 공유해야 하는 최소 bigram 수(q-gram 보조정리)로
+# 후보 단어를 먼저 거른 뒤 띠 모양(banded) Levenshtein으로 확인한다.
+_WORD = re.compile(r'\w+')
+
+
+def _word_bigrams(word: str) -> List[str]:
+    padded = f' {word} '
+    return [padded[i:i + 2] for i in range(len(padded) - 1)]
+
+
+def default_max_distance(term: str) -> int:
+    """검색어 길이에 따른 기본 허용 편집 거리 (1글자 0, 2~4글자 1, 그 이상 2)"""
+    if len(term) <= 1:
+        return 0
+    return 1 if len(term) <= 4 else 2
+
+
+def bounded_levenshtein(a: str, b: str, k: int) -> Optional[int]:
+    """편집 거리가 k 이하이면 그 거리를, 넘으면 None을 반환하는 함수
+
+    대각선에서 k칸 이내의 띠만 계산하고, 한 행의 최솟값이 k를 넘으면 바로 멈춘다.
+    """
+    if abs(len(a) - len(b)) > k:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    over = k + 1
+    previous = [j if j <= k else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        lo, hi = max(1, i - k), min(len(b), i + k)
+        current = [over] * (len(b) + 1)
+        current[0] = i if i <= k else over
+        best = current[0]
+        for j in range(lo, hi + 1):
+            cost = previous[j - 1] + (a[i - 1] != b[j - 1])
+            cost = min(cost, previous[j] + 1, current[j - 1] + 1)
+            current[j] = cost if cost <= k else over
+            best = min(best, current[j])
+        if best > k:
+            return None
+        previous = current
+    return previous[len(b)] if previous[len(b)] <= k else None
+
+
+class FuzzyIndex:
+    """코퍼스 어휘에 대한 오타 허용 검색 색인
+
+    검색어의 각 단어에 대해 편집 거리 max_distance 이내의 어휘를 찾고,
+    모든 검색어 단어와 맞는 구절을 거리 합이 작은 순서(같으면 코퍼스 순서)로 반환한다.
+    """
+
+    def __init__(self, verses: List[Dict]):
+        self.verses = verses
+        self.words: List[str] = []
+        self._word_ids: Dict[str, int] = {}
+        self._postings: List[List[int]] = []
+        for doc_id, verse in enumerate(verses):
+            for word in set(_WORD.findall(verse['content'].lower())):
+                word_id = self._word_ids.get(word)
+                if word_id is None:
+                    word_id = self._word_ids[word] = len(self.words)
+                    self.words.append(word)
+                    self._postings.append([])
+                self._postings[word_id].append(doc_id)
+        self._bigrams: Dict[str, List[int]] = {}
+        for word_id, word in enumerate(self.words):
+            for gram in set(_word_bigrams(word)):
+                self._bigrams.setdefault(gram, []).append(word_id)
+
+    def similar_words(self, term: str, max_distance: int) -> Dict[str, int]:
+        """term과 편집 거리 max_distance 이내인 어휘와 그 거리"""
+        term = term.lower()
+        grams = _word_bigrams(term)
+        shared = Counter()
+        for gram in set(grams):
+            # 같은 bigram이 여러 번 나오면 그만큼 공유할 수 있다
+            for word_id in self._bigrams.get(gram, ()):
+                shared[word_id] += grams.count(gram)
+        similar = {}
+        # 편집 한 번은 bigram을 최대 2개 바꾸므로, 공유 bigram이 기준보다 적은 단어는 확인할 필요가 없다
+        if len(term) + 1 - 2 * max_distance > 0:
+            candidates = [w for w, count in shared.items()
+                          if count >= max(len(term), len(self.words[w])) + 1 - 2 * max_distance]
+        else:
+            candidates = range(len(self.words))
+        for word_id in candidates:
+            word = self.words[word_id]
+            distance = bounded_levenshtein(term, word, max_distance)
+            if distance is not None:
+                similar[word] = distance
+        return similar
+
+    def search(self, query: str, max_distance: Optional[int] = None) -> List[Dict]:
+        terms = _WORD.findall(query.lower())
+        if not terms:
+            return []
+        totals: Optional[Dict[int, int]] = None
+        for term in terms:
+            k = default_max_distance(term) if max_distance is None else max_distance
+            best: Dict[int, int] = {}
+            for word, distance in self.similar_words(term, k).items():
+                for doc_id in self._postings[self._word_ids[word]]:
+                    if distance < best.get(doc_id, k + 1):
+                        best[doc_id] = distance
+            if totals is None:
+                totals = best
+            else:
+                totals = {doc_id: total + best[doc_id] for doc_id, total in totals.items() if doc_id in best}
+            if not totals:
+                return []
+        return [self.verses[doc_id] for doc_id in sorted(totals, key=lambda d: (totals[d], d))]
+
+
+def build_fuzzy_index(verses: List[Dict]) -> FuzzyIndex:
+    """load_verses() 결과로 오타 허용 검색 색인을 만드는 함수"""
+    return FuzzyIndex(verses)
+
+
+def _vector_terms(text: str) -> Counter:
+    """단어 양끝에 공백을 붙인 문자 bigram 빈도를 세는 함수"""
+    terms = Counter()
+    for word in text.lower().split():
+        word = f' {word} '
+        terms.update(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+class VectorIndex:
+    """구절마다 문자 bigram TF-IDF 벡터를 만들어 두고 코사인 유사도로 후보를 고르는 색인
+
+    행렬은 용어별(열 방향) 희소 배열로 저장한다. 각 구절 벡터는 길이 1로
+    정규화되어 있으므로 질의 벡터와의 내적이 곧 코사인 유사도다.
+    add()로 더한 구절은 용어별 추가 목록에 두고, 처음 보는 용어의 idf는 만들 때의
+    구절 수로 정한다. 지운 구절은 점수를 0으로 만든다. 빈도 통계는 다시 만들 때 갱신된다.
+    add()는 idf 배열을 먼저 늘린 뒤 용어 번호를 등록하고 구절 수는 마지막에 올리며,
+    scores()는 용어 번호를 찾은 뒤에 idf 배열을 읽고 시작할 때 읽은 구절 수까지만 보므로
+    한 스레드가 쓰는 동안에도 잠금 없이 검색할 수 있다.
+    """
+
+    def __init__(self, verses: List[Dict]):
+        self.verses = verses
+        doc_terms = [_vector_terms(f"{v['reference']} {v['content']}") for v in verses]
+
+        df = Counter()
+        for terms in doc_terms:
+            df.update(terms.keys())
+        n_docs = self._n_docs = self._size = len(verses)
+        self._term_ids = {term: i for i, term in enumerate(df)}
+        self._idf = np.array([math.log((1 + n_docs) / (1 + df[t])) + 1.0 for t in df], dtype=np.float32)
+
+        rows, cols, weights = [], [], []
+        for doc_id, terms in enumerate(doc_terms):
+            if not terms:
+                continue
+            ids = np.fromiter((self._term_ids[t] for t in terms), dtype=np.int64, count=len(terms))
+            tf = np.fromiter(terms.values(), dtype=np.float32, count=len(terms))
+            w = (1.0 + np.log(tf)) * self._idf[ids]
+            w /= np.linalg.norm(w)
+            rows.append(np.full(len(ids), doc_id, dtype=np.int64))
+            cols.append(ids)
+            weights.append(w)
+
+        if rows:
+            rows, cols, weights = np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+        else:
+            rows = cols = np.zeros(0, dtype=np.int64)
+            weights = np.zeros(0, dtype=np.float32)
+        order = np.argsort(cols, kind='stable')
+        self._docs = rows[order]
+        self._weights = weights[order]
+        self._offsets = np.searchsorted(cols[order], np.arange(len(self._term_ids) + 1))
+        self._base_terms = len(self._term_ids)
+        self._delta: Dict[int, List] = {}
+        self._deleted = set()
+        self._deleted_ids = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.verses)
+
+    def add(self, verse: Dict) -> int:
+        """구절 벡터를 추가하고 구절 번호를 반환하는 함수 (새 구절은 self.verses 끝에 먼저 덧붙인다)"""
+        doc_id = self._size
+        terms = _vector_terms(f"{verse['reference']} {verse['content']}")
+        if terms:
+            new_terms = [term for term in terms if term not in self._term_ids]
+            if new_terms:
+                # 검색 중인 스레드가 새 용어 번호로 idf를 읽기 전에 배열이 먼저 늘어나 있어야 한다
+                idf = math.log((1 + self._n_docs) / 2) + 1.0
+                self._idf = np.concatenate([self._idf, np.full(len(new_terms), idf, dtype=np.float32)])
+                for term in new_terms:
+                    self._term_ids[term] = len(self._term_ids)
+            ids = np.fromiter((self._term_ids[t] for t in terms), dtype=np.int64, count=len(terms))
+            tf = np.fromiter(terms.values(), dtype=np.float32, count=len(terms))
+            w = (1.0 + np.log(tf)) * self._idf[ids]
+            w /= np.linalg.norm(w)
+            for term_id, weight in zip(ids.tolist(), w.tolist()):
+                self._delta.setdefault(term_id, []).append((doc_id, weight))
+        self._size = doc_id + 1
+        return doc_id
+
+    def remove(self, doc_id: int):
+        """구절이 검색 후보로 뽑히지 않게 하는 함수"""
+        self._deleted.add(doc_id)
+        self._deleted_ids = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+
+    def scores(self, query: str) -> np.ndarray:
+        """모든 구절에 대한 질의의 코사인 유사도를 반환하는 함수
+
+        그 사이 add()로 더해지는 구절은 처음에 읽은 구절 수 size를 넘으므로 건너뛴다.
+        """
+        size = self._size
+        scores = np.zeros(size, dtype=np.float32)
+        terms = {self._term_ids[t]: c for t, c in _vector_terms(query).items() if t in self._term_ids}
+        if not terms:
+            return scores
+        # add()는 idf 배열을 늘린 뒤 용어 번호를 등록하므로, 용어 번호를 먼저 찾고 배열을 읽어야
+        # 찾은 번호가 모두 배열 안에 있다
+        idf = self._idf
+        ids = np.fromiter(terms.keys(), dtype=np.int64, count=len(terms))
+        q = (1.0 + np.log(np.fromiter(terms.values(), dtype=np.float32, count=len(terms)))) * idf[ids]
+        q /= np.linalg.norm(q)
+        for term_id, weight in zip(ids.tolist(), q.tolist()):
+            if term_id < self._base_terms:
+                start, end = self._offsets[term_id], self._offsets[term_id + 1]
+                scores[self._docs[start:end]] += weight * self._weights[start:end]
+            for doc_id, doc_weight in self._delta.get(term_id, ()):
+                if doc_id < size:
+                    scores[doc_id] += weight * doc_weight
+        deleted = self._deleted_ids
+        if len(deleted):
+            scores[deleted[deleted < size]] = 0
+        return scores
+
+    def top_indices(self, query: str, n: int) -> List[int]:
+        """질의와 가장 비슷한 구절 n개의 번호를 유사도 순으로 반환하는 함수 (유사도 0 제외)"""
+        scores = self.scores(query)
+        n = min(n, len(scores))
+        if n <= 0:
+            return []
+        best = np.argpartition(-scores, n - 1)[:n]
+        best = best[np.lexsort((best, -scores[best]))]
+        return [int(i) for i in best if scores[i] > 0]
+
+    def top(self, query: str, n: int) -> List[Dict]:
+        """질의와 가장 비슷한 구절 n개를 유사도 순으로 반환하는 함수 (유사도 0 제외)"""
+        return [self.verses[i] for i in self.top_indices(query, n)]
+
+
+def build_vector_index(verses: List[Dict]) -> VectorIndex:
+    """load_verses() 결과로 의미론적 검색 후보 선별용 벡터 색인을 만드는 함수"""
+    return VectorIndex(verses)
+
+
+# BM25 매개변수
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _bm25_doc_terms(text: str) -> List[str]:
+    """구절의 단어마다 모든 글자(unigram)와 bigram을 용어로 뽑는 함수"""
+    terms = []
+    for word in text.lower().split():
+        terms.extend(word)
+        terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+def _bm25_query_terms(text: str) -> List[str]:
+    """질의 단어가 한 글자면 그 글자를, 아니면 bigram을 용어로 뽑는 함수"""
+    terms = []
+    for word in text.lower().split():
+        if len(word) == 1:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+class BM25Index:
+    """load_verses() 결과 위에 만드는 BM25 순위 검색용 역색인
+
+    용어마다 (구절 번호, 빈도) 게시 목록을 두고, 그 용어가 낼 수 있는 최대 점수는 질의에
+    처음 쓰일 때 계산해 둔다. 질의는 최대 점수가 큰 용어부터 처리하고(max-score 방식),
+    남은 용어들의 최대 점수 합이 현재 k번째 점수보다 작아지면 새 후보를 더 만들지 않고
+    기존 후보 점수만 갱신한다. 상위 k개는 크기가 제한된 힙으로 고른다.
+    구절 수, 용어별 문서 빈도, 구절 길이 합만 통계로 들고 있으므로 add()/remove()로
+    구절을 더하거나 지우면 idf와 평균 길이가 바로 반영된다(최대 점수는 다시 계산).
+    add()는 구절 길이를 먼저 기록한 뒤 게시 목록과 문서 빈도를 늘리고, 최대 점수 캐시는
+    통째로 새 딕셔너리로 바꾸므로 한 스레드가 쓰는 동안에도 잠금 없이 검색할 수 있다.
+    """
+
+    def __init__(self, verses: List[Dict]):
+        self.verses = verses
+        self._postings: Dict[str, List] = {}
+        self._df: Dict[str, int] = {}
+        self._lengths: List[int] = []
+        self._total_length = 0
+        self._live = 0
+        self._deleted = set()
+        self._upper_bounds: Dict[str, float] = {}
+        for verse in verses:
+            self.add(verse)
+
+    def __len__(self) -> int:
+        return len(self.verses)
+
+    def add(self, verse: Dict) -> int:
+        """구절을 색인하고 구절 번호를 반환하는 함수 (새 구절은 self.verses 끝에 먼저 덧붙인다)"""
+        doc_id = len(self._lengths)
+        terms = _bm25_doc_terms(f"{verse['reference']} {verse['content']}")
+        # 게시 목록에서 이 구절을 본 검색이 길이를 읽을 수 있도록 길이를 먼저 기록한다
+        self._lengths.append(len(terms))
+        for term, tf in Counter(terms).items():
+            self._postings.setdefault(term, []).append((doc_id, tf))
+            self._df[term] = self._df.get(term, 0) + 1
+        self._total_length += len(terms)
+        self._live += 1
+        self._stats_changed()
+        return doc_id
+
+    def remove(self, doc_id: int):
+        """구절을 통계와 검색 결과에서 빼는 함수 (게시 목록은 다시 만들 때까지 그대로 둔다)"""
+        if doc_id in self._deleted:
+            return
+        self._deleted.add(doc_id)
+        verse = self.verses[doc_id]
+        for term in set(_bm25_doc_terms(f"{verse['reference']} {verse['content']}")):
+            self._df[term] -= 1
+        self._total_length -= self._lengths[doc_id]
+        self._live -= 1
+        self._stats_changed()
+
+    def _stats_changed(self):
+        # 문서 길이 정규화 항 k1 * (1 - b + b * dl / avgdl)을 a + c * dl로 계산한다
+        avgdl = self._total_length / self._live if self._live else 0.0
+        self._norm = (BM25_K1 * (1 - BM25_B), BM25_K1 * BM25_B / avgdl) if avgdl else (BM25_K1, 0.0)
+        self._upper_bounds = {}
+
+    def _idf(self, term: str) -> float:
+        df = self._df.get(term, 0)
+        return math.log(1 + (self._live - df + 0.5) / (df + 0.5))
+
+    def _term_score(self, idf: float, doc_id: int, tf: int) -> float:
+        norm_a, norm_c = self._norm
+        return idf * tf * (BM25_K1 + 1) / (tf + norm_a + norm_c * self._lengths[doc_id])
+
+    def _upper_bound(self, term: str, cache: Dict[str, float]) -> float:
+        # cache는 검색을 시작할 때의 self._upper_bounds다. 그 사이 통계가 바뀌면 이 딕셔너리는
+        # 버려지므로 예전 통계로 계산한 최대 점수가 새 캐시에 섞이지 않는다.
+        bound = cache.get(term)
+        if bound is None:
+            idf = self._idf(term)
+            bound = cache[term] = max(
+                (self._term_score(idf, doc_id, tf) for doc_id, tf in self._postings[term]
+                 if doc_id not in self._deleted), default=0.0)
+        return bound
+
+    def scored(self, query: str, k: int, offset: int = 0) -> List[tuple]:
+        """(구절 번호, 점수)를 점수 순으로 offset부터 k개 반환하는 함수"""
+        need = k + offset
+        query_terms = Counter(t for t in _bm25_query_terms(query) if self._df.get(t))
+        if need <= 0 or not query_terms:
+            return []
+        cache = self._upper_bounds
+        bounds = {t: self._upper_bound(t, cache) for t in query_terms}
+        terms = sorted(query_terms.items(), key=lambda item: bounds[item[0]] * item[1], reverse=True)
+        remaining = sum(bounds[t] * qtf for t, qtf in terms)
+
+        deleted = self._deleted
+        scores: Dict[int, float] = {}
+        for term, qtf in terms:
+            # 아직 점수가 없는 구절이 남은 용어로 얻을 수 있는 최대 점수가 현재 k번째 점수 이하이면
+            # 새 후보는 상위 k개에 들 수 없다
+            accept_new = len(scores) < need or heapq.nlargest(need, scores.values())[-1] <= remaining
+            remaining -= bounds[term] * qtf
+            idf = self._idf(term) * qtf
+            if accept_new:
+                for doc_id, tf in self._postings[term]:
+                    if doc_id not in deleted:
+                        scores[doc_id] = scores.get(doc_id, 0.0) + self._term_score(idf, doc_id, tf)
+            else:
+                for doc_id, tf in self._postings[term]:
+                    if doc_id in scores:
+                        scores[doc_id] += self._term_score(idf, doc_id, tf)
+
+        top = heapq.nsmallest(need, scores.items(), key=lambda item: (-item[1], item[0]))
+        return top[offset:]
+
+    def search(self, query: str, k: int = 10, offset: int = 0) -> List[Dict]:
+        """질의와 관련도가 높은 구절을 BM25 점수 순으로 offset부터 k개 반환하는 함수"""
+        return [self.verses[doc_id] for doc_id, _ in self.scored(query, k, offset)]
+
+
+def build_bm25_index(verses: List[Dict]) -> BM25Index:
+    """load_verses() 결과로 BM25 순위 검색 색인을 만드는 함수"""
+    return BM25Index(verses)
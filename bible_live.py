@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from typing import List, Dict, Optional, Any, Callable, Iterable
+
+from bible_corpus import VerseCorpus
+from bible_index import build_search_index, build_vector_index, build_bm25_index
+from bible_reference import build_reference_index
+from bible_search import VerseCache
+from bible_store import VerseStore
+
+# add()/remove()로 증분 갱신하는 파생 색인 (이름은 VerseCache.derived의 이름과 같다)
+INCREMENTAL_INDEXES: Dict[str, Callable[[List[Dict]], Any]] = {
+    'ngram': build_search_index,
+    'vectors': build_vector_index,
+    'bm25': build_bm25_index,
+    'references': build_reference_index,
+}
+# 적용한 변경이 코퍼스의 이 비율을 넘거나, 마지막으로 만든 뒤 이 시간(초)이 지나면 백그라운드에서 다시 만든다
+COMPACT_RATIO = float(os.getenv('COMPACT_RATIO', '0.2'))
+COMPACT_INTERVAL = float(os.getenv('COMPACT_INTERVAL', '600'))
+# 한 번에 따라잡을 변경이 코퍼스의 이 비율보다 많으면(대량 가져오기 등) 하나씩 적용하지 않고 다시 읽는다
+RELOAD_RATIO = 0.25
+
+
+class _Generation:
+    """한 번 읽어 들인 코퍼스와 그 뒤에 적용한 변경
+
+    slots는 증분 색인과 같은 구절 번호 공간이다. 지운 구절은 번호를 deleted에 남기고
+    (묘비), 새로 들어오거나 바뀐 구절은 끝에 덧붙인다.
+    """
+
+    def __init__(self, position: int, ids: List[int], rows: Iterable):
+        self.position = position
+        self.slots: List[Dict] = list(VerseCorpus.from_rows(rows))
+        self.slot_of: Dict[int, int] = {verse_id: slot for slot, verse_id in enumerate(ids)}
+        self.deleted = set()
+        self.indexes: Dict[str, Any] = {}
+        self.created = time.monotonic()
+        self.changed = 0
+
+    def apply(self, op: str, verse_id: int, verse: Optional[Dict]):
+        old = self.slot_of.pop(verse_id, None)
+        if old is not None:
+            self.deleted.add(old)
+            for index in self.indexes.values():
+                index.remove(old)
+        if op != 'delete' and verse is not None:
+            self.slots.append(verse)
+            self.slot_of[verse_id] = len(self.slots) - 1
+            for index in self.indexes.values():
+                index.add(verse)
+        self.changed += 1
+
+    def live(self) -> List[Dict]:
+        return [verse for slot, verse in enumerate(self.slots) if slot not in self.deleted]
+
+
+class LiveVerseCache(VerseCache):
+    """VerseStore의 변경 기록(bible_changes)을 따라가며 색인을 증분 갱신하는 코퍼스 캐시
+
+    get()은 마지막으로 본 뒤의 변경을 읽어 n-gram·BM25·벡터·참조 색인에 바로 적용하므로
+    추가·수정·삭제가 있어도 이 색인들은 다시 만들지 않는다(수정은 묘비 + 추가).
+    이 색인들을 처음 만들 때도 잠금 밖에서 만든 뒤 그 사이 적용된 변경을 따라잡아 끼운다.
+    나머지 파생 값은 VerseCache처럼 코퍼스가 바뀐 뒤 처음 쓸 때 잠금 밖에서 다시 만든다.
+    쌓인 변경이 많아지면 백그라운드 스레드가 새로 읽어 만든 색인으로 바꿔 끼운다(압축).
+    따라잡을 변경이 너무 많거나 기록이 정리되었을 때도 같은 방식으로 다시 읽으며,
+    그동안에는 이전 코퍼스로 계속 검색한다. 다른 프로세스가 쓴 변경도 같은 기록으로 따라간다.
+    """
+
+    def __init__(self, store: VerseStore, compact_ratio: float = COMPACT_RATIO,
+                 compact_interval: float = COMPACT_INTERVAL, background: bool = True):
+        super().__init__(path=store.path)
+        self.store = store
+        self.compact_ratio = compact_ratio
+        self.compact_interval = compact_interval
+        self.background = background
+        self._generation: Optional[_Generation] = None
+        self._compact_lock = threading.Lock()
+        # 변경 기록으로 따라잡을 수 없어 다시 읽기를 기다리는 중
+        self._reloading = False
+
+    def _load(self, names: Iterable[str] = ()) -> _Generation:
+        position, ids, rows = self.store.snapshot()
+        generation = _Generation(position, ids, rows)
+        for name in names:
+            generation.indexes[name] = INCREMENTAL_INDEXES[name](generation.slots)
+        return generation
+
+    def _install(self, generation: _Generation):
+        self._generation = generation
+        self._verses = None
+        self._reloading = False
+
+    def _catch_up(self) -> bool:
+        """새 변경을 현재 세대에 적용하는 함수 (다시 읽어야 하면 아무것도 하지 않고 False)"""
+        generation = self._generation
+        limit = int(RELOAD_RATIO * max(len(generation.slot_of), 1))
+        changes = self.store.changes_since(generation.position, limit=limit + 1)
+        if changes is None or len(changes) > limit:
+            return False
+        for position, op, verse_id, verse in changes:
+            generation.apply(op, verse_id, verse)
+            generation.position = position
+        if changes:
+            self._verses = None
+        return True
+
+    def get(self) -> List[Dict]:
+        """현재 코퍼스를 반환하는 함수 (새 변경이 있으면 먼저 적용)"""
+        position = self.store.change_position()
+        generation, verses = self._generation, self._verses
+        if generation is None or verses is None or (position != generation.position and not self._reloading):
+            with self._lock:
+                if self._generation is None:
+                    self._install(self._load())
+                elif position != self._generation.position and not self._reloading:
+                    self._reloading = not self._catch_up()
+                if self._verses is None:
+                    self._verses = self._generation.live()
+                    self._derived = {}
+                    self.version += 1
+                verses = self._verses
+        if self._maybe_compact() and not self.background:
+            return self.get()
+        return verses
+
+    def invalidate(self):
+        with self._lock:
+            self._generation = None
+            self._verses = None
+            self._reloading = False
+
+    def derived(self, name: str, factory: Callable[[List[Dict]], Any]) -> Any:
+        if name not in INCREMENTAL_INDEXES:
+            return super().derived(name, factory)
+        self.get()
+        generation = self._generation
+        index = generation.indexes.get(name)
+        if index is not None:
+            return index
+        index = self._building.do((name, generation), lambda: self._build_index(generation, name, factory))
+        return index if index is not None else self.derived(name, factory)
+
+    def _build_index(self, generation: _Generation, name: str, factory: Callable[[List[Dict]], Any]) -> Any:
+        """잠금 밖에서 증분 색인을 처음 만들고, 그 사이 적용된 변경을 따라잡아 끼우는 함수
+
+        만드는 동안 세대가 바뀌었으면(압축·다시 읽기) None을 반환한다.
+        """
+        with self._lock:
+            index = generation.indexes.get(name)
+            if index is not None:
+                return index
+            slots = list(generation.slots)
+        index = factory(slots)
+        with self._lock:
+            if generation is not self._generation:
+                return None
+            for verse in generation.slots[len(slots):]:
+                slots.append(verse)
+                index.add(verse)
+            for slot in generation.deleted:
+                index.remove(slot)
+            # 이제 내용이 같으므로 앞으로 apply()가 덧붙이는 세대의 목록을 함께 보게 한다
+            index.verses = generation.slots
+            generation.indexes[name] = index
+            return index
+
+    def _maybe_compact(self) -> bool:
+        """압축(또는 기다리던 다시 읽기)이 필요하면 시작하고 True를 반환하는 함수"""
+        generation = self._generation
+        if generation is None or self._compact_lock.locked():
+            return False
+        if not self._reloading:
+            if not generation.changed:
+                return False
+            if (generation.changed < self.compact_ratio * max(len(generation.slot_of), 1) and
+                    time.monotonic() - generation.created < self.compact_interval):
+                return False
+        if not self._compact_lock.acquire(blocking=False):
+            return False
+        if self.background:
+            threading.Thread(target=self._compact_locked, daemon=True).start()
+        else:
+            self._compact_locked()
+        return True
+
+    def compact(self):
+        """코퍼스를 새로 읽어 묘비와 추가 목록이 없는 색인을 만들어 바꿔 끼우는 함수
+
+        새 색인을 만드는 동안에는 기존 색인으로 계속 검색한다. 그 사이의 변경은
+        바꿔 끼운 뒤 get()이 변경 기록에서 다시 따라잡는다.
+        """
+        self._compact_lock.acquire()
+        self._compact_locked()
+
+    def _compact_locked(self):
+        try:
+            generation = self._generation
+            fresh = self._load(list(generation.indexes) if generation else ())
+            with self._lock:
+                self._install(fresh)
+            self.store.prune_changes()
+        finally:
+            self._compact_lock.release()
@@ -0,0 +1,278 @@
+import re
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from typing import List, Dict, Optional, Iterator, Tuple
+
+from bible_corpus import split_reference
+
+# 성경 구절 참조. verse_start/verse_end가 None이면 장 전체를 뜻한다.
+VerseRef = namedtuple('VerseRef', ['book', 'chapter', 'verse_start', 'verse_end'])
+
+# (한글 이름, 영어 이름, 영어 약칭...) — 한글 이름을 표준 책 이름으로 쓴다
+BOOKS = [
+    ('창세기', 'Genesis', 'Gen'), ('출애굽기', 'Exodus', 'Exod'), ('레위기', 'Leviticus', 'Lev'),
+    ('민수기', 'Numbers', 'Num'), ('신명기', 'Deuteronomy', 'Deut'), ('여호수아', 'Joshua', 'Josh'),
+    ('사사기', 'Judges', 'Judg'), ('룻기', 'Ruth'), ('사무엘상', '1 Samuel', '1 Sam'),
+    ('사무엘하', '2 Samuel', '2 Sam'), ('열왕기상', '1 Kings', '1 Kgs'), ('열왕기하', '2 Kings', '2 Kgs'),
+    ('역대상', '1 Chronicles', '1 Chr'), ('역대하', '2 Chronicles', '2 Chr'), ('에스라', 'Ezra'),
+    ('느헤미야', 'Nehemiah', 'Neh'), ('에스더', 'Esther', 'Esth'), ('욥기', 'Job'),
+    ('시편', 'Psalms', 'Psalm', 'Ps'), ('잠언', 'Proverbs', 'Prov'), ('전도서', 'Ecclesiastes', 'Eccl'),
+    ('아가', 'Song of Songs', 'Song of Solomon', 'Song'), ('이사야', 'Isaiah', 'Isa'),
+    ('예레미야', 'Jeremiah', 'Jer'), ('예레미야애가', 'Lamentations', 'Lam'), ('에스겔', 'Ezekiel', 'Ezek'),
+    ('다니엘', 'Daniel', 'Dan'), ('호세아', 'Hosea', 'Hos'), ('요엘', 'Joel'), ('아모스', 'Amos'),
+    ('오바댜', 'Obadiah', 'Obad'), ('요나', 'Jonah', 'Jon'), ('미가', 'Micah', 'Mic'), ('나훔', 'Nahum', 'Nah'),
+    ('하박국', 'Habakkuk', 'Hab'), ('스바냐', 'Zephaniah', 'Zeph'), ('학개', 'Haggai', 'Hag'),
+    ('스가랴', 'Zechariah', 'Zech'), ('말라기', 'Malachi', 'Mal'),
+    ('마태복음', 'Matthew', 'Matt'), ('마가복음', 'Mark'), ('누가복음', 'Luke'), ('요한복음', 'John'),
+    ('사도행전', 'Acts'), ('로마서', 'Romans', 'Rom'), ('고린도전서', '1 Corinthians', '1 Cor'),
+    ('고린도후서', '2 Corinthians', '2 Cor'), ('갈라디아서', 'Galatians', 'Gal'), ('에베소서', 'Ephesians', 'Eph'),
+    ('빌립보서', 'Philippians', 'Phil'), ('골로새서', 'Colossians', 'Col'),
+    ('데살로니가전서', '1 Thessalonians', '1 Thess'), ('데살로니가후서', '2 Thessalonians', '2 Thess'),
+    ('디모데전서', '1 Timothy', '1 Tim'), ('디모데후서', '2 Timothy', '2 Tim'), ('디도서', 'Titus'),
+    ('빌레몬서', 'Philemon', 'Phlm'), ('히브리서', 'Hebrews', 'Heb'), ('야고보서', 'James', 'Jas'),
+    ('베드로전서', '1 Peter', '1 Pet'), ('베드로후서', '2 Peter', '2 Pet'), ('요한일서', '1 John'),
+    ('요한이서', '2 John'), ('요한삼서', '3 John'), ('유다서', 'Jude'), ('요한계시록', 'Revelation', 'Rev'),
+]
+
+
+def _book_key(name: str) -> str:
+    return ''.join(name.split()).rstrip('.').lower()
+
+
+_BOOK_ALIASES: Dict[str, str] = {_book_key(alias): names[0] for names in BOOKS for alias in names}
+# 표준 책 이름 → 영어 이름 (모델이 영어로 답할 때를 위해 참조 매처가 함께 등록한다)
+_ENGLISH_NAMES: Dict[str, str] = {names[0]: names[1] for names in BOOKS}
+
+
+def canonical_book(name: str) -> str:
+    """책 이름을 표준(한글) 이름으로 바꾸는 함수 (모르는 이름은 공백만 정리해 그대로 둠)"""
+    name = ' '.join(name.split())
+    canonical = _BOOK_ALIASES.get(_book_key(name))
+    if canonical is None and ' ' in name:
+        # '그리고 요한복음'처럼 앞에 다른 말이 붙은 경우 마지막 단어만 확인한다
+        canonical = _BOOK_ALIASES.get(_book_key(name.rsplit(' ', 1)[1]))
+    return canonical or name
+
+
+# 책 이름, 장, (선택) 절 또는 절 범위. '3:16', '3:16-18', '3장', '3장 16절', '3장 16-18절' 형식을 받는다.
+_REFERENCE_BODY = r'''
+    (?P<chapter>\d+)\s*
+    (?:
+        (?:[:：]|장)\s*(?P<start>\d+)\s*절?
+        (?:\s*[-–~]\s*(?P<end>\d+)\s*절?)?
+      | 장
+    )?
+'''
+_REFERENCE = re.compile(r'^\s*(?P<book>(?:[1-3]\s*)?[^\W\d][\w .]*?)\s*' + _REFERENCE_BODY + r'\s*$', re.X)
+
+
+def _to_ref(match) -> VerseRef:
+    start = match.group('start')
+    end = match.group('end') or start
+    return VerseRef(canonical_book(match.group('book')), int(match.group('chapter')),
+                    int(start) if start else None, int(end) if end else None)
+
+
+def parse_reference(text: str) -> Optional[VerseRef]:
+    """'요한복음 1:35-42', '요한복음 3장', 'John 1:1-14' 같은 참조를 VerseRef로 바꾸는 함수
+
+    참조 형식이 아니면 None을 반환한다.
+    """
+    match = _REFERENCE.match(text)
+    if not match:
+        return None
+    return _to_ref(match)
+
+
+class ReferenceIndex:
+    """구절 참조를 (책, 장, 시작 절, 끝 절) 순으로 정렬해 둔 구간 색인
+
+    장이나 절 범위 조회는 이진 탐색으로 시작 위치를 찾는다. 구절 하나가 덮는 절 범위의
+    최대 길이를 기억해 두므로, 조회 범위와 겹치는 구절은 O(log n + 결과 수)로 찾는다.
+    add()는 정렬된 목록을 복사해 끼워 넣은 뒤 통째로 바꾸고, remove()는 묘비만 남기므로
+    한 스레드가 쓰는 동안에도 조회는 잠금 없이 할 수 있다.
+    """
+
+    def __init__(self, verses: List[Dict]):
+        self.verses = verses
+        entries = []
+        for doc_id, verse in enumerate(verses):
+            key = self._key(verse)
+            if key is not None:
+                entries.append(key + (doc_id,))
+        entries.sort()
+        # (정렬된 키, 같은 순서의 구절 번호, 최대 절 범위)를 한 번에 바꿔 끼운다
+        self._sorted = ([entry[:4] for entry in entries], [entry[4] for entry in entries],
+                        max((end - start for _, _, start, end, _ in entries), default=0))
+        self.books = {entry[0] for entry in entries}
+        self._size = len(verses)
+        self._deleted = set()
+
+    @staticmethod
+    def _key(verse: Dict) -> Optional[tuple]:
+        ref = parse_reference(verse['reference'])
+        if ref is None or ref.verse_start is None:
+            return None
+        return ref.book, ref.chapter, ref.verse_start, ref.verse_end
+
+    def __len__(self) -> int:
+        deleted = self._deleted
+        return sum(1 for doc_id in self._sorted[1] if doc_id not in deleted)
+
+    def add(self, verse: Dict) -> int:
+        """구절을 색인하고 구절 번호를 반환하는 함수 (새 구절은 self.verses 끝에 먼저 덧붙인다)"""
+        doc_id = self._size
+        key = self._key(verse)
+        if key is not None:
+            keys, doc_ids, max_span = self._sorted
+            i = bisect_right(keys, key)
+            self._sorted = (keys[:i] + [key] + keys[i:], doc_ids[:i] + [doc_id] + doc_ids[i:],
+                            max(max_span, key[3] - key[2]))
+            self.books.add(key[0])
+        self._size = doc_id + 1
+        return doc_id
+
+    def remove(self, doc_id: int):
+        """구절을 조회 결과에서 빼는 함수 (목록에서는 다시 만들 때 빠진다)"""
+        self._deleted.add(doc_id)
+
+    def overlapping(self, ref: VerseRef) -> List[int]:
+        """ref 범위와 겹치는 구절 번호를 성경 순서대로 반환하는 함수"""
+        keys, doc_ids, max_span = self._sorted
+        deleted = self._deleted
+        book, chapter = ref.book, ref.chapter
+        if ref.verse_start is None:
+            lo = bisect_left(keys, (book, chapter))
+            hi = bisect_left(keys, (book, chapter + 1))
+            return [doc_id for doc_id in doc_ids[lo:hi] if doc_id not in deleted]
+        start, end = ref.verse_start, ref.verse_end
+        lo = bisect_left(keys, (book, chapter, start - max_span))
+        hi = bisect_right(keys, (book, chapter, end, float('inf')))
+        return [doc_ids[i] for i in range(lo, hi) if keys[i][3] >= start and doc_ids[i] not in deleted]
+
+    def lookup(self, text: str) -> Optional[List[Dict]]:
+        """참조 문자열에 해당하는 구절을 반환하는 함수
+
+        참조 형식이 아니거나 코퍼스에 없는 책 이름이면('사랑 3' 등) None을 반환한다.
+        """
+        ref = parse_reference(text)
+        if ref is None or ref.book not in self.books:
+            return None
+        return [self.verses[i] for i in self.overlapping(ref)]
+
+
+def build_reference_index(verses: List[Dict]) -> ReferenceIndex:
+    """load_verses() 결과로 참조 구간 색인을 만드는 함수"""
+    return ReferenceIndex(verses)
+
+
+def reference_forms(reference: str) -> List[str]:
+    """모델 응답에서 찾을 참조 표기 목록 ('요한복음 3:16' → ['요한복음 3:16', 'John 3:16'])"""
+    forms = [reference]
+    book, locator = split_reference(reference)
+    english = _ENGLISH_NAMES.get(canonical_book(book)) if book else None
+    if english and english != book:
+        forms.append(f'{english} {locator}')
+    return forms
+
+
+class ReferenceMatcher:
+    """코퍼스의 모든 구절 참조로 만든 Aho–Corasick 자동자
+
+    모델 응답을 한 번만 훑어 참조를 찾는다. 참조 앞뒤가 다른 글자나 숫자에 붙어 있으면
+    ('요한복음 1:12' 안의 '요한복음 1:1', '1:35-42' 안의 '1:35') 일치로 보지 않고,
+    겹치는 일치는 가장 왼쪽에서 시작하는 가장 긴 참조를 고른다.
+    상태 전이는 (상태 << 21 | 문자 코드)를 키로 하는 딕셔너리 하나에 담는다.
+    """
+
+    _BOUNDARY_AFTER = re.compile(r'\w|[-–~:：]\s*\d')
+
+    def __init__(self, verses: List[Dict]):
+        self.verses = verses
+        self._goto: Dict[int, int] = {}
+        self._fail = [0]
+        self._depth = [0]
+        self._output = [-1]  # 이 상태에서 끝나는 참조의 구절 번호 (없으면 -1)
+        self._next_output = [0]  # 실패 링크를 따라 만나는 다음 출력 상태 (없으면 0)
+        self._children: List[List[Tuple[int, int]]] = [[]]
+        for doc_id, verse in enumerate(verses):
+            for form in reference_forms(verse['reference']):
+                self._insert(form.lower(), doc_id)
+        self._link()
+        del self._children
+
+    def _insert(self, pattern: str, doc_id: int):
+        state = 0
+        for char in pattern:
+            key = state << 21 | ord(char)
+            child = self._goto.get(key)
+            if child is None:
+                child = self._goto[key] = len(self._fail)
+                self._fail.append(0)
+                self._depth.append(self._depth[state] + 1)
+                self._output.append(-1)
+                self._next_output.append(0)
+                self._children.append([])
+                self._children[state].append((ord(char), child))
+            state = child
+        if self._output[state] < 0:
+            self._output[state] = doc_id
+
+    def _link(self):
+        """너비 우선으로 실패 링크와 출력 링크를 채우는 함수"""
+        queue = [child for _, child in self._children[0]]
+        for state in queue:
+            for code, child in self._children[state]:
+                fallback = self._fail[state]
+                while fallback and (fallback << 21 | code) not in self._goto:
+                    fallback = self._fail[fallback]
+                target = self._fail[child] = self._goto.get(fallback << 21 | code, 0)
+                self._next_output[child] = target if self._output[target] >= 0 else self._next_output[target]
+                queue.append(child)
+
+    def _hits(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """(시작, 끝, 구절 번호)를 끝 위치 순서대로 돌려주는 함수"""
+        goto, fail = self._goto, self._fail
+        state = 0
+        for position, char in enumerate(text):
+            code = ord(char)
+            while state and (state << 21 | code) not in goto:
+                state = fail[state]
+            state = goto.get(state << 21 | code, 0)
+            found = state if self._output[state] >= 0 else self._next_output[state]
+            while found:
+                end = position + 1
+                yield end - self._depth[found], end, self._output[found]
+                found = self._next_output[found]
+
+    def _on_boundary(self, text: str, start: int, end: int) -> bool:
+        before = text[start - 1] if start else ' '
+        if before.isalnum() or before == '_':
+            return False
+        # '1 John 1:9' 안의 'John 1:9' (앞 줄 끝의 '20:24 '처럼 숫자가 이어진 경우는 제외)
+        if before == ' ' and start >= 2 and text[start - 2].isdigit() and (
+                start == 2 or not (text[start - 3].isalnum() or text[start - 3] in ':：')):
+            return False
+        return not self._BOUNDARY_AFTER.match(text, end)
+
+    def match(self, text: str) -> List[Dict]:
+        """응답에 나온 참조의 구절을 응답 순서대로, 중복 없이 반환하는 함수"""
+        text = text.lower()
+        hits = [hit for hit in self._hits(text) if self._on_boundary(text, hit[0], hit[1])]
+        hits.sort(key=lambda hit: (hit[0], hit[0] - hit[1]))
+        seen = set()
+        matching = []
+        covered = 0
+        for start, end, doc_id in hits:
+            if start < covered:
+                continue
+            covered = end
+            if doc_id not in seen:
+                seen.add(doc_id)
+                matching.append(self.verses[doc_id])
+        return matching
+
+
+def build_reference_matcher(verses: List[Dict]) -> ReferenceMatcher:
+    """load_verses() 결과로 모델 응답용 참조 매처를 만드는 함수"""
+    return ReferenceMatcher(verses)
@@ -1,59 +1,179 @@
 import csv
 import sys
 import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
-from typing import List, Dict
+from typing import List, Dict, Optional, Callable, Any, Tuple
 from dotenv import load_dotenv
+from bible_index import (NgramIndex, VectorIndex, BM25Index, JamoIndex, FuzzyIndex, build_search_index,
+                         build_vector_index, build_bm25_index, build_jamo_index, build_fuzzy_index)
+from bible_reference import ReferenceIndex, ReferenceMatcher, build_reference_index, build_reference_matcher
+from bible_cache import SemanticResultCache, cache_key, corpus_fingerprint
+from bible_store import DB_PATH, VerseStore
+from bible_corpus import VerseCorpus, load_compiled_corpus
+from bible_concurrency import CallLimiter, ModelBusyError, SingleFlight
+from bible_shards import (SHARD_TOKEN_BUDGET, SHARD_PARALLELISM, SHARD_CANDIDATES, RankBackend, map_reduce_search,
+                          verse_line)
+from google.api_core import exceptions as google_exceptions
 
 # Load environment variables
 load_dotenv()
 
-# Get API key from environment variable
-api_key = os.getenv('GOOGLE_API_KEY')
-print(f"API Key: {api_key}")
-if not api_key:
-    print("Error: GOOGLE_API_KEY가 설정되지 않았습니다.")
-    print("1. .env 파일을 생성하고 GOOGLE_API_KEY=your_api_key_here 형식으로 API 키를 설정해주세요.")
-    print("2. Google AI Studio (https://makersuite.google.com/app/apikey)에서 API 키를 발급받을 수 있습니다.")
-    sys.exit(1)
-
-# Configure Gemini API
-try:
-    genai.configure(api_key=api_key)
-    
-    # Get the latest Gemini Pro model
-    models = [m.name for m in genai.list_models()]
-    print("Available models:", models)
-    
-    # Look for the latest Gemini Pro model
-    gemini_model = None
-    preferred_models = [
-        'models/gemini-1.5-pro-latest',
-        'models/gemini-1.5-pro',
-        'models/gemini-1.5-pro-001',
-        'models/gemini-1.5-pro-002'
-    ]
-    
-    for model_name in preferred_models:
-        if model_name in models:
-            gemini_model = model_name
-            break
-            
-    if not gemini_model:
-        raise ValueError("No suitable Gemini Pro model found. Available models: " + ", ".join(models))
-        
-    print(f"Using model: {gemini_model}")
-    model = genai.GenerativeModel(model_name=gemini_model)
-    
-except Exception as e:
-    print(f"Error: Gemini API 설정 중 오류가 발생했습니다: {str(e)}")
-    print(f"API Key: {api_key}")
-    sys.exit(1)
+# 사용 가능한 모델 중 앞에 있는 것을 우선 사용한다
+PREFERRED_MODELS = [
+    'models/gemini-1.5-pro-latest',
+    'models/gemini-1.5-pro',
+    'models/gemini-1.5-pro-001',
+    'models/gemini-1.5-pro-002'
+]
+# list_models()로 찾은 모델 이름을 디스크에 보관하는 파일과 유효 시간(초)
+MODEL_CACHE_PATH = '.gemini_model.json'
+MODEL_CACHE_TTL = 24 * 3600
+# 프로세스 전체의 Gemini 호출 제한: 동시 호출 수, 대기열 길이, 대기·요청 시간 제한(초)
+MODEL_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '4'))
+MODEL_MAX_QUEUE = int(os.getenv('GEMINI_MAX_QUEUE', '32'))
+MODEL_QUEUE_TIMEOUT = float(os.getenv('GEMINI_QUEUE_TIMEOUT', '30'))
+MODEL_REQUEST_TIMEOUT = float(os.getenv('GEMINI_REQUEST_TIMEOUT', '60'))
+MODEL_RETRIES = 3
+
+def is_rate_limited(error: BaseException) -> bool:
+    """속도 제한(429)이나 일시적인 서버 과부하 오류인지 확인하는 함수"""
+    return isinstance(error, (google_exceptions.ResourceExhausted,
+                              google_exceptions.TooManyRequests,
+                              google_exceptions.ServiceUnavailable))
+
+class GeminiUnavailableError(RuntimeError):
+    """API 키가 없거나 사용할 수 있는 모델을 찾지 못했을 때 발생하는 예외"""
+
+class GeminiClient:
+    """Gemini 모델을 처음 필요할 때 초기화하고 재사용하는 클라이언트
+
+    모듈을 import할 때는 네트워크를 쓰지 않는다. 모델 이름은 GEMINI_MODEL 환경 변수,
+    디스크 캐시(MODEL_CACHE_TTL 이내), list_models() 순서로 결정한다.
+    """
+
+    def __init__(self, cache_path: Optional[str] = MODEL_CACHE_PATH, ttl: float = MODEL_CACHE_TTL,
+                 limiter: Optional[CallLimiter] = None, timeout: float = MODEL_REQUEST_TIMEOUT):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.limiter = limiter or CallLimiter(MODEL_MAX_CONCURRENCY, MODEL_MAX_QUEUE, MODEL_QUEUE_TIMEOUT,
+                                              retries=MODEL_RETRIES, is_retryable=is_rate_limited)
+        self._lock = threading.Lock()
+        self._configured = False
+        self._model_name: Optional[str] = None
+        self._model = None
+
+    @property
+    def api_key(self) -> Optional[str]:
+        return os.getenv('GOOGLE_API_KEY')
+
+    def available(self) -> bool:
+        """API 키가 설정되어 있는지 확인하는 함수 (네트워크를 쓰지 않음)"""
+        return bool(self.api_key)
 
-def load_verses():
+    def _configure(self):
+        if self._configured:
+            return
+        if not self.api_key:
+            raise GeminiUnavailableError(
+                "GOOGLE_API_KEY가 설정되지 않았습니다. "
+                ".env 파일에 GOOGLE_API_KEY=your_api_key_here 형식으로 API 키를 설정해주세요. "
+                "(Google AI Studio: https://makersuite.google.com/app/apikey)")
+        genai.configure(api_key=self.api_key)
+        self._configured = True
+
+    def _read_cached_name(self) -> Optional[str]:
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if time.time() - cached.get('resolved_at', 0) > self.ttl:
+            return None
+        return cached.get('model')
+
+    def _write_cached_name(self, name: str):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, 'w', encoding='utf-8') as file:
+                json.dump({'model': name, 'resolved_at': time.time()}, file)
+        except OSError:
+            pass
+
+    def _discover_model_name(self) -> str:
+        self._configure()
+        models = [m.name for m in genai.list_models()]
+        for model_name in PREFERRED_MODELS:
+            if model_name in models:
+                return model_name
+        raise GeminiUnavailableError("No suitable Gemini Pro model found. Available models: " + ", ".join(models))
+
+    def model_name(self) -> str:
+        """사용할 모델 이름을 반환하는 함수 (한 번 결정되면 재사용)"""
+        if self._model_name is None:
+            with self._lock:
+                if self._model_name is None:
+                    name = os.getenv('GEMINI_MODEL') or self._read_cached_name()
+                    if not name:
+                        name = self._discover_model_name()
+                        self._write_cached_name(name)
+                    self._model_name = name
+        return self._model_name
+
+    def model(self):
+        """초기화된 GenerativeModel을 반환하는 함수"""
+        if self._model is None:
+            name = self.model_name()
+            with self._lock:
+                if self._model is None:
+                    self._configure()
+                    print(f"Using model: {name}")
+                    self._model = genai.GenerativeModel(model_name=name)
+        return self._model
+
+    def generate_content(self, prompt: str, **kwargs):
+        """동시 호출 제한과 재시도를 거쳐 모델을 호출하는 함수"""
+        model = self.model()
+        kwargs.setdefault('request_options', {'timeout': self.timeout})
+        return self.limiter.call(lambda: model.generate_content(prompt, **kwargs))
+
+    def reset(self):
+        """메모이즈된 모델을 버리는 함수 (API 키나 모델을 바꾼 뒤 사용)"""
+        with self._lock:
+            self._configured = False
+            self._model_name = None
+            self._model = None
+
+# 프로세스 전체에서 공유하는 Gemini 클라이언트
+gemini = GeminiClient()
+
+VERSES_CSV = 'bible_verses.csv'
+
+# 의미론적 검색에서 Gemini에 보낼 후보 구절 수
+SEMANTIC_CANDIDATES = int(os.getenv('SEMANTIC_CANDIDATES', '50'))
+# 모델 없이 로컬 벡터 검색만 할 때 반환할 구절 수
+LOCAL_RESULTS = 3
+# 순위 검색 한 쪽에 보여줄 구절 수
+RESULTS_PER_PAGE = 20
+# 의미론적 검색에 쓰는 Gemini 생성 설정 (결과 캐시 키에도 포함됨)
+GENERATION_CONFIG = {
+    'temperature': 0.7,
+    'top_p': 0.8,
+    'top_k': 40,
+    'max_output_tokens': 2048,
+}
+
+def load_verses(path: str = VERSES_CSV):
     verses = []
     try:
-        with open('bible_verses.csv', 'r', encoding='utf-8') as file:
+        with open(path, 'r', encoding='utf-8') as file:
             reader = csv.reader(file)
             next(reader)  # Skip header
             for row in reader:
@@ -63,12 +183,132 @@ def load_verses():
                         'content': row[1]
                     })
     except FileNotFoundError:
-        print("Error: bible_verses.csv 파일을 찾을 수 없습니다.")
+        print(f"Error: {path} 파일을 찾을 수 없습니다.")
         sys.exit(1)
     return verses
 
-def search_verses(verses: List[Dict], keyword: str) -> List[Dict]:
-    """키워드로 성경 구절을 검색하는 함수"""
+def init_db(path: str = DB_PATH, csv_path: str = VERSES_CSV):
+    """웹 앱이 쓰는 bible_verses.db(FTS5 색인 포함)를 만들고, 비어 있으면 CSV를 가져오는 함수"""
+    VerseStore(path).init(csv_path)
+
+def load_corpus(path: str = VERSES_CSV) -> VerseCorpus:
+    """load_verses와 같은 CSV를 메모리를 적게 쓰는 VerseCorpus로 읽는 함수
+
+    CSV 옆의 컴파일된 코퍼스 파일(.bvc)을 mmap으로 열고, 없거나 CSV가 바뀌었으면 다시 컴파일한다.
+    """
+    try:
+        return load_compiled_corpus(path)
+    except FileNotFoundError:
+        print(f"Error: {path} 파일을 찾을 수 없습니다.")
+        sys.exit(1)
+
+class VerseCache:
+    """성경 구절 CSV를 한 번만 읽어 두고 파일이 바뀔 때만 다시 읽는 캐시
+
+    파일의 mtime/크기가 바뀌거나 invalidate()가 호출되면 다음 접근 때 다시 읽고
+    version을 올린다. 색인처럼 코퍼스에서 파생된 값은 derived()로 버전별로 보관한다.
+    loader와 stamp를 주면 CSV 대신 다른 저장소(예: VerseStore)를 같은 방식으로 캐시한다.
+    """
+
+    def __init__(self, path: str = VERSES_CSV, loader: Optional[Callable[[], List[Dict]]] = None,
+                 stamp: Optional[Callable[[], Any]] = None):
+        self.path = path
+        self.version = 0
+        self._loader = loader or (lambda: load_corpus(self.path))
+        self._stamp_func = stamp or self._file_stamp
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._verses: Optional[List[Dict]] = None
+        self._derived: Dict[str, Any] = {}
+        self._building = SingleFlight()
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self) -> List[Dict]:
+        """현재 코퍼스를 반환하는 함수 (필요할 때만 다시 읽음)"""
+        stamp = self._stamp_func()
+        verses = self._verses
+        if verses is not None and stamp == self._stamp:
+            return verses
+        with self._lock:
+            if self._verses is None or stamp != self._stamp:
+                self._verses = self._loader()
+                self._stamp = stamp
+                self._derived = {}
+                self.version += 1
+            return self._verses
+
+    def invalidate(self):
+        """저장소에 쓰기가 일어났을 때 다음 접근에서 다시 읽도록 표시하는 함수"""
+        with self._lock:
+            self._verses = None
+
+    def derived(self, name: str, factory: Callable[[List[Dict]], Any]) -> Any:
+        """코퍼스 버전별로 한 번만 만드는 파생 값(색인 등)을 반환하는 함수
+
+        만드는 동안에는 잠금을 잡지 않으므로 다른 검색은 기다리지 않는다.
+        같은 값을 동시에 찾으면 한 번만 만들어 나눠 쓴다.
+        """
+        verses = self.get()
+        entry = self._derived.get(name)
+        if entry is not None and entry[0] is verses:
+            return entry[1]
+
+        def build():
+            entry = self._derived.get(name)
+            if entry is not None and entry[0] is verses:
+                return entry[1]
+            value = factory(verses)
+            with self._lock:
+                if verses is self._verses:
+                    self._derived[name] = (verses, value)
+            return value
+
+        # 만드는 동안 verses를 붙잡고 있으므로 id가 다른 코퍼스와 겹치지 않는다
+        return self._building.do((name, id(verses)), build)
+
+    def search_index(self) -> NgramIndex:
+        return self.derived('ngram', build_search_index)
+
+    def vector_index(self) -> VectorIndex:
+        return self.derived('vectors', build_vector_index)
+
+    def bm25_index(self) -> BM25Index:
+        return self.derived('bm25', build_bm25_index)
+
+    def jamo_index(self) -> JamoIndex:
+        return self.derived('jamo', build_jamo_index)
+
+    def fuzzy_index(self) -> FuzzyIndex:
+        return self.derived('fuzzy', build_fuzzy_index)
+
+    def reference_index(self) -> ReferenceIndex:
+        return self.derived('references', build_reference_index)
+
+    def reference_matcher(self) -> ReferenceMatcher:
+        return self.derived('reference_matcher', build_reference_matcher)
+
+    def fingerprint(self) -> str:
+        return self.derived('fingerprint', corpus_fingerprint)
+
+# 프로세스 전체에서 공유하는 코퍼스 캐시와 의미론적 검색 결과 캐시
+verse_cache = VerseCache()
+semantic_cache = SemanticResultCache()
+
+def search_verses(verses: List[Dict], keyword: str, index: Optional[NgramIndex] = None) -> List[Dict]:
+    """키워드로 성경 구절을 검색하는 함수
+
+    index가 주어지면 미리 만든 n-gram 색인으로 검색하고,
+    없으면 모든 구절을 순서대로 확인한다.
+    """
+    if index is not None:
+        return index.search(keyword)
+
     matching_verses = []
     keyword = keyword.lower()
     
@@ -80,15 +320,59 @@ def search_verses(verses: List[Dict], keyword: str) -> List[Dict]:
     
     return matching_verses
 
-def semantic_search_verses(verses: List[Dict], query: str) -> List[Dict]:
-    """Gemini를 사용하여 의미론적 검색을 수행하는 함수"""
-    try:
-        # 모든 구절을 하나의 문자열로 결합
-        verses_text = "\n".join([f"{v['reference']}: {v['content']}" for v in verses])
-        
-        # 프롬프트 구성
-        prompt = f"""당신은 성경 구절을 검색하는 도우미입니다.
-다음 성경 구절들 중에서 '{query}'와 가장 관련이 있는 구절들을 3개 찾아주세요.
+def jamo_search_verses(verses: List[Dict], query: str, index: Optional[JamoIndex] = None) -> List[Dict]:
+    """초성('ㅎㄴㄴ')이나 입력 중인 부분 음절('하나니')로 성경 구절을 검색하는 함수"""
+    if index is None:
+        index = build_jamo_index(verses)
+    return index.search(query)
+
+def fuzzy_search_verses(verses: List[Dict], query: str, max_distance: Optional[int] = None,
+                        index: Optional[FuzzyIndex] = None) -> List[Dict]:
+    """오타가 있어도 검색어 단어마다 편집 거리 max_distance 이내의 단어를 가진 구절을 찾는 함수
+
+    max_distance가 None이면 검색어 단어 길이에 따라 정한다(bible_index.default_max_distance).
+    """
+    if index is None:
+        index = build_fuzzy_index(verses)
+    return index.search(query, max_distance)
+
+def lookup_reference(verses: List[Dict], text: str,
+                     index: Optional[ReferenceIndex] = None) -> Optional[List[Dict]]:
+    """'요한복음 3장'이나 'John 1:1-14' 같은 참조로 구절을 찾는 함수
+
+    참조 형식이 아니면 None을 반환하므로 일반 검색으로 넘어갈 수 있다.
+    """
+    if index is None:
+        index = build_reference_index(verses)
+    return index.lookup(text)
+
+def ranked_search_verses(verses: List[Dict], keyword: str, page: int = 1, per_page: int = RESULTS_PER_PAGE,
+                         index: Optional[BM25Index] = None) -> Tuple[List[Dict], bool]:
+    """BM25 점수 순으로 성경 구절을 검색하는 함수
+
+    page번째 쪽의 구절 목록과 다음 쪽이 있는지 여부를 반환한다.
+    """
+    if index is None:
+        index = build_bm25_index(verses)
+    page = max(page, 1)
+    results = index.search(keyword, per_page + 1, (page - 1) * per_page)
+    return results[:per_page], len(results) > per_page
+
+def local_semantic_search(verses: List[Dict], query: str, limit: int = LOCAL_RESULTS,
+                          vector_index: Optional[VectorIndex] = None) -> List[Dict]:
+    """모델 없이 로컬 TF-IDF 벡터 유사도만으로 관련 구절을 찾는 함수"""
+    if vector_index is None:
+        vector_index = build_vector_index(verses)
+    return vector_index.top(query, limit)
+
+def gemini_rank(query: str, verses: List[Dict], limit: int) -> str:
+    """verses 중 query와 가장 관련 있는 limit개의 참조를 Gemini에게 묻고 응답 텍스트를 반환하는 함수"""
+    # 후보 구절을 하나의 문자열로 결합
+    verses_text = "\n".join([verse_line(v) for v in verses])
+
+    # 프롬프트 구성
+    prompt = f"""당신은 성경 구절을 검색하는 도우미입니다.
+다음 성경 구절들 중에서 '{query}'와 가장 관련이 있는 구절들을 {limit}개 찾아주세요.
 구절의 참조와 내용을 함께 알려주세요.
 
 성경 구절들:
@@ -100,51 +384,249 @@ def semantic_search_verses(verses: List[Dict], query: str) -> List[Dict]:
 John 1:1
 John 3:16
 """
+
+    # Gemini API 호출
+    response = gemini.generate_content(
+        prompt,
+        generation_config=genai.types.GenerationConfig(**GENERATION_CONFIG)
+    )
+    return response.text
+
+def _semantic_cache_key(query: str, corpus_version: str, candidates: int) -> str:
+    return cache_key(query, corpus_version, gemini.model_name(), dict(GENERATION_CONFIG, candidates=candidates))
+
+def semantic_search_verses(verses: List[Dict], query: str, candidates: int = SEMANTIC_CANDIDATES,
+                           vector_index: Optional[VectorIndex] = None, local_only: bool = False,
+                           cache: Optional[SemanticResultCache] = None,
+                           corpus_version: Optional[str] = None,
+                           reference_matcher: Optional[ReferenceMatcher] = None) -> List[Dict]:
+    """Gemini를 사용하여 의미론적 검색을 수행하는 함수
+
+    구절이 candidates개보다 많으면 로컬 벡터 색인으로 후보를 먼저 고른 뒤
+    그 후보만 프롬프트에 넣는다. local_only이면 모델을 호출하지 않는다.
+    cache가 주어지면 정규화된 질의와 코퍼스 버전, 모델, 생성 설정이 같은
+    이전 결과를 재사용한다. reference_matcher는 전체 코퍼스로 미리 만든
+    참조 매처로, 없으면 후보 구절로 그때그때 만든다.
+    """
+    if local_only or not gemini.available():
+        return local_semantic_search(verses, query, vector_index=vector_index)
+
+    try:
+        key = None
+        if cache is not None:
+            if corpus_version is None:
+                corpus_version = corpus_fingerprint(verses)
+            key = _semantic_cache_key(query, corpus_version, candidates)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
+        if len(verses) > candidates:
+            if vector_index is None:
+                vector_index = build_vector_index(verses)
+            verses = vector_index.top(query, candidates)
+            if not verses:
+                return []
+
+        response_text = gemini_rank(query, verses, LOCAL_RESULTS)
+
+        # 응답을 한 번 훑어 참조를 응답 순서대로 추출 ('1:1'이 '1:12'에 걸리지 않음)
+        if reference_matcher is None:
+            reference_matcher = build_reference_matcher(verses)
+        matching_verses = reference_matcher.match(response_text)
         
-        # Gemini API 호출
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
-                top_p=0.8,
-                top_k=40,
-                max_output_tokens=2048,
-            )
-        )
-        
-        # 응답에서 구절 참조 추출
-        response_text = response.text
-        
-        # 응답에서 구절 참조 추출
-        matching_verses = []
-        for verse in verses:
-            if verse['reference'] in response_text:
-                matching_verses.append(verse)
-        
+        if cache is not None:
+            cache.put(key, matching_verses)
+        return matching_verses
+    except ModelBusyError as e:
+        print(f"{str(e)} 로컬 검색 결과를 대신 반환합니다.")
+        return local_semantic_search(verses, query, vector_index=vector_index)
+    except Exception as e:
+        print(f"Gemini API 호출 중 오류가 발생했습니다: {str(e)}")
+        return []
+
+def sharded_semantic_search(verses: List[Dict], query: str, backend: Optional[RankBackend] = None,
+                            token_budget: int = SHARD_TOKEN_BUDGET, parallelism: int = SHARD_PARALLELISM,
+                            per_shard: int = SHARD_CANDIDATES, local_only: bool = False,
+                            cache: Optional[SemanticResultCache] = None, corpus_version: Optional[str] = None,
+                            reference_matcher: Optional[ReferenceMatcher] = None,
+                            vector_index: Optional[VectorIndex] = None) -> List[Dict]:
+    """벡터 색인으로 후보를 줄이지 않고 코퍼스 전체를 샤드로 나눠 의미론적 검색을 하는 함수
+
+    샤드마다 backend(기본은 Gemini)로 후보를 고른 뒤 마지막 호출 한 번으로 다시 순위를 매긴다
+    (bible_shards.map_reduce_search 참고). 코퍼스가 한 프롬프트에 다 들어가지 않을 때 쓴다.
+    backend를 주면 API 키가 없어도 그 백엔드로 검색한다. vector_index는 모델을 쓸 수 없을 때
+    로컬 검색에 쓸 미리 만든 색인이다.
+    """
+    if backend is None:
+        if local_only or not gemini.available():
+            return local_semantic_search(verses, query, vector_index=vector_index)
+        backend = gemini_rank
+
+    try:
+        key = None
+        if cache is not None:
+            if corpus_version is None:
+                corpus_version = corpus_fingerprint(verses)
+            model_name = gemini.model_name() if backend is gemini_rank else getattr(backend, '__name__', 'custom')
+            key = cache_key(query, corpus_version, model_name,
+                            dict(GENERATION_CONFIG, sharded=True, token_budget=token_budget, per_shard=per_shard))
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
+        matching_verses = map_reduce_search(verses, query, backend, token_budget, parallelism, per_shard,
+                                            LOCAL_RESULTS, reference_matcher)
+        if cache is not None:
+            cache.put(key, matching_verses)
         return matching_verses
+    except ModelBusyError as e:
+        print(f"{str(e)} 로컬 검색 결과를 대신 반환합니다.")
+        return local_semantic_search(verses, query, vector_index=vector_index)
     except Exception as e:
-        print(f"API Key: {api_key}")
         print(f"Gemini API 호출 중 오류가 발생했습니다: {str(e)}")
         return []
 
+# 배치 검색에서 모델 호출 한 번에 넣을 질문 수
+SEMANTIC_BATCH_SIZE = int(os.getenv('SEMANTIC_BATCH_SIZE', '20'))
+
+def _parse_batch_answer(text: str) -> Dict[str, List[str]]:
+    """{"1": ["요한복음 1:1", ...], ...} 형식의 모델 응답을 읽는 함수 (코드 블록 허용)"""
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        return {}
+    try:
+        answer = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(answer, dict):
+        return {}
+    return {str(k): [str(r).strip() for r in v] for k, v in answer.items() if isinstance(v, list)}
+
+def _semantic_batch_call(verses: List[Dict], queries: List[str],
+                         reference_matcher: Optional[ReferenceMatcher] = None) -> List[Optional[List[Dict]]]:
+    """질문 여러 개를 모델 호출 한 번으로 처리하는 함수 (답을 못 받은 질문은 None)"""
+    verses_text = "\n".join([verse_line(v) for v in verses])
+    questions_text = "\n".join([f"{i}. {q}" for i, q in enumerate(queries, 1)])
+    prompt = f"""당신은 성경 구절을 검색하는 도우미입니다.
+아래 성경 구절들 중에서 각 질문과 가장 관련이 있는 구절들을 질문마다 3개씩 찾아주세요.
+
+성경 구절들:
+{verses_text}
+
+질문들:
+{questions_text}
+
+질문 번호를 키로, 관련된 구절들의 참조 목록을 값으로 하는 JSON 객체 하나로만 답해주세요. 예시:
+{{"1": ["요한복음 1:1", "요한복음 3:16"], "2": ["John 1:1"]}}
+"""
+    response = gemini.generate_content(
+        prompt,
+        generation_config=genai.types.GenerationConfig(**GENERATION_CONFIG)
+    )
+    answer = _parse_batch_answer(response.text)
+    if reference_matcher is None:
+        reference_matcher = build_reference_matcher(verses)
+    results = []
+    for i in range(1, len(queries) + 1):
+        references = answer.get(str(i))
+        if references is None:
+            results.append(None)
+            continue
+        results.append(reference_matcher.match('\n'.join(references)))
+    return results
+
+def semantic_search_batch(verses: List[Dict], queries: List[str], batch_size: int = SEMANTIC_BATCH_SIZE,
+                          candidates: int = SEMANTIC_CANDIDATES, vector_index: Optional[VectorIndex] = None,
+                          local_only: bool = False, cache: Optional[SemanticResultCache] = None,
+                          corpus_version: Optional[str] = None,
+                          reference_matcher: Optional[ReferenceMatcher] = None) -> List[List[Dict]]:
+    """여러 질문을 한꺼번에 의미론적으로 검색하는 함수
+
+    질문을 batch_size개씩 묶어 모델 호출 한 번에 보낸다. 각 묶음은 질문별 후보
+    구절의 합집합을 공통 문맥으로 쓰고, 질문 번호별 JSON 답을 받는다.
+    답을 읽지 못한 질문은 semantic_search_verses를 병렬로 호출해 채운다.
+    결과는 queries와 같은 순서의 목록이다.
+    """
+    if local_only or not gemini.available():
+        if vector_index is None:
+            vector_index = build_vector_index(verses)
+        return [local_semantic_search(verses, q, vector_index=vector_index) for q in queries]
+    if len(verses) > candidates and vector_index is None:
+        vector_index = build_vector_index(verses)
+    if cache is not None and corpus_version is None:
+        corpus_version = corpus_fingerprint(verses)
+    if reference_matcher is None:
+        reference_matcher = build_reference_matcher(verses)
+
+    results: List[Optional[List[Dict]]] = [None] * len(queries)
+    keys: List[Optional[str]] = [None] * len(queries)
+    pending = []
+    for i, query in enumerate(queries):
+        if cache is not None:
+            keys[i] = _semantic_cache_key(query, corpus_version, candidates)
+            results[i] = cache.get(keys[i])
+        if results[i] is None:
+            pending.append(i)
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        # 한 묶음이 실패해도 그 묶음의 질문만 개별 호출로 넘기고 다음 묶음은 계속 보낸다
+        try:
+            if len(verses) > candidates:
+                chosen = set()
+                for i in batch:
+                    chosen.update(vector_index.top_indices(queries[i], candidates))
+                context = [vector_index.verses[j] for j in sorted(chosen)]
+            else:
+                context = verses
+            answers = _semantic_batch_call(context, [queries[i] for i in batch], reference_matcher)
+        except Exception as e:
+            print(f"Gemini 배치 호출 중 오류가 발생했습니다: {str(e)}")
+            continue
+        for i, matching in zip(batch, answers):
+            results[i] = matching
+            if matching is not None and cache is not None:
+                cache.put(keys[i], matching)
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=MODEL_MAX_CONCURRENCY) as executor:
+            singles = executor.map(
+                lambda i: semantic_search_verses(verses, queries[i], candidates, vector_index,
+                                                 cache=cache, corpus_version=corpus_version,
+                                                 reference_matcher=reference_matcher),
+                missing)
+            for i, matching in zip(missing, singles):
+                results[i] = matching
+    return results
+
 def main():
-    verses = load_verses()
+    # 색인은 모드를 처음 쓸 때 verse_cache.derived()로 만들므로 시작은 코퍼스 읽기만큼 빠르다
+    verses = verse_cache.get()
     
     print("\n=== 성경 구절 검색 프로그램 ===")
-    print("1. 일반 검색")
+    print("1. 일반 검색 ('요한복음 3장', 'John 1:1-14' 같은 참조도 가능)")
     print("2. 의미론적 검색 (Gemini)")
+    print("3. 로컬 의미론적 검색 (모델 없이)")
+    print("4. 순위 검색 (BM25)")
+    print("5. 전체 코퍼스 분할 의미론적 검색 (Gemini, 샤드별 검색 후 재순위)")
+    print("6. 초성·부분 음절 검색 (예: ㅎㄴㄴ, 하나니)")
+    print("7. 오타 허용 검색 (예: 하나닙)")
     print("종료하려면 'q' 또는 'quit'를 입력하세요.")
+    if not gemini.available():
+        print("GOOGLE_API_KEY가 설정되지 않아 의미론적 검색은 로컬 검색으로 대체됩니다.")
     
     while True:
-        print("\n검색 모드를 선택하세요 (1 또는 2): ", end='')
+        print("\n검색 모드를 선택하세요 (1~7): ", end='')
         mode = input().strip()
         
         if mode.lower() in ['q', 'quit']:
             print("프로그램을 종료합니다.")
             break
         
-        if mode not in ['1', '2']:
-            print("1 또는 2를 입력해주세요.")
+        if mode not in ['1', '2', '3', '4', '5', '6', '7']:
+            print("1에서 7 사이의 숫자를 입력해주세요.")
             continue
         
         print("\n검색할 단어나 구절을 입력하세요: ", end='')
@@ -158,10 +640,28 @@ def main():
             print("검색어를 입력해주세요.")
             continue
         
+        verses = verse_cache.get()
         if mode == '1':
-            matching_verses = search_verses(verses, user_input)
+            matching_verses = lookup_reference(verses, user_input, verse_cache.reference_index())
+            if matching_verses is None:
+                matching_verses = search_verses(verses, user_input, verse_cache.search_index())
+        elif mode == '2':
+            matching_verses = semantic_search_verses(verses, user_input, vector_index=verse_cache.vector_index(),
+                                                     cache=semantic_cache, corpus_version=verse_cache.fingerprint(),
+                                                     reference_matcher=verse_cache.reference_matcher())
+        elif mode == '3':
+            matching_verses = local_semantic_search(verses, user_input, vector_index=verse_cache.vector_index())
+        elif mode == '4':
+            matching_verses, _ = ranked_search_verses(verses, user_input, index=verse_cache.bm25_index())
+        elif mode == '5':
+            matching_verses = sharded_semantic_search(verses, user_input, cache=semantic_cache,
+                                                      corpus_version=verse_cache.fingerprint(),
+                                                      reference_matcher=verse_cache.reference_matcher(),
+                                                      vector_index=verse_cache.vector_index())
+        elif mode == '6':
+            matching_verses = jamo_search_verses(verses, user_input, verse_cache.jamo_index())
         else:
-            matching_verses = semantic_search_verses(verses, user_input)
+            matching_verses = fuzzy_search_verses(verses, user_input, index=verse_cache.fuzzy_index())
         
         if matching_verses:
             print(f"\n'{user_input}'과(와) 관련된 성경 구절:")
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from bible_search import semantic_cache, semantic_search_batch, MODEL_MAX_CONCURRENCY, MODEL_MAX_QUEUE
+from bible_search_web import verse_store, verse_cache, run_search, search_page, SEARCH_TYPES, MODEL_SEARCH_TYPES
+
+# 비동기 서비스 모드: bible_search_web과 같은 저장소·캐시를 쓰는 ASGI 앱 (JSON API)
+#   uvicorn bible_search_asgi:app   또는   python bible_search_asgi.py
+# ASGI 서버(uvicorn)는 이 모드에서만 쓰는 선택 의존성이다. 없으면 main()이 설치 방법을 알려 주고 끝낸다.
+# 키워드·메모리 색인 검색은 기본 스레드 풀에서, 모델 호출은 전용 스레드 풀에서 기다리므로
+# 느린 의미론적 검색이 빠른 검색을 막지 않고, 색인을 다시 만드는 동안에도 이벤트 루프는 멈추지 않는다.
+
+# 모델 호출 전용 스레드 수. CallLimiter가 동시에 붙잡아 둘 수 있는 호출 수(실행 + 대기열)에 맞춘다.
+SEMANTIC_WORKERS = int(os.getenv('SEMANTIC_WORKERS', str(MODEL_MAX_CONCURRENCY + MODEL_MAX_QUEUE)))
+# 요청 본문 최대 크기 (바이트)
+MAX_BODY_SIZE = 1024 * 1024
+
+model_pool = ThreadPoolExecutor(max_workers=SEMANTIC_WORKERS, thread_name_prefix='semantic')
+
+
+class ClientDisconnected(Exception):
+    """응답을 보내기 전에 클라이언트가 연결을 끊음"""
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json; charset=utf-8'),
+                            (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive) -> bytes:
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        chunks.append(message.get('body', b''))
+        size += len(chunks[-1])
+        if size > MAX_BODY_SIZE:
+            raise ValueError('요청 본문이 너무 큽니다.')
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def run_blocking(receive, pool, fn, *args):
+    """fn을 스레드 풀에서 실행하고, 그 전에 클라이언트가 끊으면 기다리기를 그만두는 함수
+
+    아직 시작하지 않은 호출은 취소한다. 이미 실행 중인 모델 호출은 멈출 수 없지만 결과는
+    semantic_cache와 SingleFlight로 같은 질의를 기다리는 다른 요청에 그대로 쓰인다.
+    본문을 다 읽은 뒤에만 부른다 (receive에는 연결 끊김만 남아 있어야 한다).
+    """
+    loop = asyncio.get_running_loop()
+    call = loop.run_in_executor(pool, fn, *args)
+    disconnect = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await asyncio.wait({call, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+    if not call.done():
+        call.cancel()
+        raise ClientDisconnected()
+    return call.result()
+
+
+def verse_dicts(verses):
+    return [{'reference': v['reference'], 'content': v['content']} for v in verses]
+
+
+async def search(scope, receive, send):
+    """GET /api/search?q=검색어&type=검색 종류&page=쪽"""
+    params = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+    keyword = params.get('q', [''])[0].strip()
+    search_type = params.get('type', ['keyword'])[0]
+    try:
+        page = max(int(params.get('page', ['1'])[0]), 1)
+    except ValueError:
+        page = 1
+    if search_type not in SEARCH_TYPES:
+        await send_json(send, 400, {'error': f'type은 {", ".join(SEARCH_TYPES)} 중 하나여야 합니다.'})
+        return
+    if not keyword:
+        await send_json(send, 400, {'error': 'q를 입력하세요.'})
+        return
+    await read_body(receive)
+
+    if search_type in MODEL_SEARCH_TYPES:
+        results, has_next = await run_blocking(receive, model_pool, run_search, search_type, keyword), False
+    else:
+        results, has_next = await run_blocking(receive, None, search_page, search_type, keyword, page)
+    await send_json(send, 200, {'query': keyword, 'type': search_type, 'page': page, 'has_next': has_next,
+                                'verses': verse_dicts(results)})
+
+
+async def semantic_batch(scope, receive, send):
+    """POST /api/semantic_batch ({"queries": [...], "local": false}, bible_search_web의 같은 API와 같은 형식)"""
+    try:
+        payload = json.loads(await read_body(receive) or b'{}')
+    except ValueError:
+        payload = None
+    queries = payload.get('queries') if isinstance(payload, dict) else None
+    if not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+        await send_json(send, 400, {'error': 'queries는 비어 있지 않은 문자열 목록이어야 합니다.'})
+        return
+
+    def call():
+        return semantic_search_batch(verse_cache.get(), [q.strip() for q in queries],
+                                     vector_index=verse_cache.vector_index(), local_only=bool(payload.get('local')),
+                                     cache=semantic_cache, corpus_version=verse_cache.fingerprint(),
+                                     reference_matcher=verse_cache.reference_matcher())
+
+    results = await run_blocking(receive, model_pool, call)
+    await send_json(send, 200, {'results': [{'query': q, 'verses': verse_dicts(r)} for q, r in zip(queries, results)]})
+
+
+ROUTES = {
+    ('GET', '/api/search'): search,
+    ('POST', '/api/semantic_batch'): semantic_batch,
+}
+
+
+def warm_up():
+    """첫 요청이 이벤트 루프에서 코퍼스와 색인을 만들지 않도록 미리 읽어 두는 함수"""
+    verse_cache.get()
+    verse_cache.reference_index()
+    verse_cache.bm25_index()
+    verse_store.search('warm')
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(None, warm_up)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            model_pool.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI 3 진입점"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    route = ROUTES.get((scope['method'], scope['path']))
+    if route is None:
+        await send_json(send, 404, {'error': '찾을 수 없는 경로입니다.'})
+        return
+    try:
+        await route(scope, receive, send)
+    except ClientDisconnected:
+        return
+    except ValueError as e:
+        await send_json(send, 400, {'error': str(e)})
+
+
+def main():
+    try:
+        import uvicorn
+    except ImportError:
+        print("비동기 서비스 모드에는 ASGI 서버가 필요합니다 (예: pip install uvicorn).")
+        sys.exit(1)
+    uvicorn.run(app, host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', '8000')))
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,18 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response,
+                   stream_with_context)
+from datetime import datetime, timezone
+import hashlib
+import io
 import sqlite3
 import os
-from bible_search import load_verses, search_verses, semantic_search_verses, init_db
+from bible_search import (semantic_cache, semantic_search_verses, semantic_search_batch,
+                          sharded_semantic_search, ranked_search_verses, jamo_search_verses,
+                          fuzzy_search_verses, lookup_reference, RESULTS_PER_PAGE, init_db)
+from bible_store import VerseStore, IMPORT_BATCH_SIZE
+from bible_corpus import ROW_FORMATS, iter_rows, format_for_path
+from bible_cache import normalize_query, FragmentCache
+from bible_concurrency import SingleFlight
+from bible_live import LiveVerseCache
 from dotenv import load_dotenv
 
 app = Flask(__name__)
@@ -10,21 +21,149 @@ app.secret_key = 'biblesearch_secret_key'
 # Initialize DB
 init_db()
 
+# 검색과 목록은 모두 bible_verses.db를 기준으로 한다. 키워드 검색은 FTS5 색인으로,
+# 나머지 검색은 DB 변경 기록을 따라 색인을 증분 갱신하는 코퍼스 캐시로 수행한다.
+verse_store = VerseStore()
+verse_cache = LiveVerseCache(verse_store)
+# /all 한 쪽에 보여 줄 구절 수 (?size=로 MAX_ALL_PAGE_SIZE까지 바꿀 수 있다)
+ALL_PAGE_SIZE = int(os.getenv('ALL_PAGE_SIZE', '100'))
+MAX_ALL_PAGE_SIZE = 1000
+# 내보내기 스트림이 DB에서 한 번에 읽는 구절 수
+EXPORT_BATCH_SIZE = 1000
+# 동시에 들어온 같은 의미론적 검색은 모델 호출 하나로 합친다
+semantic_flights = SingleFlight()
+# GET 검색·목록 응답의 Cache-Control max-age(초). 0이면 매번 ETag로 재검증만 한다.
+SEARCH_MAX_AGE = int(os.getenv('SEARCH_MAX_AGE', '0'))
+SEARCH_TYPES = ('keyword', 'ranked', 'jamo', 'fuzzy', 'semantic', 'local', 'sharded')
+# 모델이 바쁘거나 실패하면 대체 결과가 나오는 검색 종류. 결과는 semantic_cache가 캐시하므로
+# 페이지는 캐시하지 않는다.
+MODEL_SEARCH_TYPES = ('semantic', 'sharded')
+# 렌더링한 검색·목록 페이지 (키는 ETag)
+page_cache = FragmentCache()
+
+def validators(key):
+    """코퍼스 변경 기록 위치와 요청 키로 (ETag, Last-Modified)를 만드는 함수"""
+    position, changed_at = verse_store.change_stamp()
+    etag = hashlib.sha256(f'{position}\0{key}'.encode('utf-8')).hexdigest()[:32]
+    last_modified = datetime.fromtimestamp(changed_at, timezone.utc) if changed_at is not None else None
+    return etag, last_modified
+
+def not_modified(etag, last_modified):
+    """요청의 If-None-Match/If-Modified-Since로 보아 클라이언트 사본이 최신인지 여부"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return (last_modified is not None and request.if_modified_since is not None and
+            last_modified <= request.if_modified_since)
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if SEARCH_MAX_AGE > 0:
+        response.cache_control.public = True
+        response.cache_control.max_age = SEARCH_MAX_AGE
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def cached_page(key, render, cacheable=True):
+    """키와 코퍼스 버전이 같으면 304 또는 캐시한 HTML로 응답하는 함수
+
+    flash 메시지가 남아 있는 응답은 사용자마다 다르므로 캐시하지 않는다.
+    """
+    if not cacheable or session.get('_flashes'):
+        response = Response(render())
+        response.cache_control.no_store = True
+        return response
+    etag, last_modified = validators(key)
+    if not_modified(etag, last_modified):
+        return with_validators(Response(status=304), etag, last_modified)
+    body = page_cache.get(etag)
+    if body is None:
+        body = render()
+        page_cache.put(etag, body)
+    return with_validators(Response(body), etag, last_modified)
+
+def run_search(search_type, keyword):
+    """검색 종류에 맞는 백엔드로 검색을 수행하는 함수"""
+    if search_type == 'keyword':
+        results = lookup_reference(verse_cache.get(), keyword, verse_cache.reference_index())
+        return results if results is not None else verse_store.search(keyword)
+    if search_type == 'ranked':
+        return ranked_search_verses(verse_cache.get(), keyword, index=verse_cache.bm25_index())[0]
+    if search_type == 'jamo':
+        return jamo_search_verses(verse_cache.get(), keyword, verse_cache.jamo_index())
+    if search_type == 'fuzzy':
+        return fuzzy_search_verses(verse_cache.get(), keyword, index=verse_cache.fuzzy_index())
+    verses = verse_cache.get()
+    fingerprint = verse_cache.fingerprint()
+    if search_type == 'sharded':
+        return semantic_flights.do(
+            (search_type, normalize_query(keyword), fingerprint),
+            lambda: sharded_semantic_search(verses, keyword, cache=semantic_cache, corpus_version=fingerprint,
+                                            reference_matcher=verse_cache.reference_matcher(),
+                                            vector_index=verse_cache.vector_index()))
+    return semantic_flights.do(
+        (search_type, normalize_query(keyword), fingerprint),
+        lambda: semantic_search_verses(verses, keyword, vector_index=verse_cache.vector_index(),
+                                       local_only=search_type == 'local', cache=semantic_cache,
+                                       corpus_version=fingerprint,
+                                       reference_matcher=verse_cache.reference_matcher()))
+
+def search_page(search_type, keyword, page):
+    """검색 결과의 page번째 쪽과 다음 쪽이 있는지 여부를 반환하는 함수"""
+    if search_type == 'ranked':
+        return ranked_search_verses(verse_cache.get(), keyword, page, index=verse_cache.bm25_index())
+    if search_type == 'keyword':
+        # '요한복음 3장' 같은 참조는 구간 색인에서 바로 찾는다
+        start = (page - 1) * RESULTS_PER_PAGE
+        results = lookup_reference(verse_cache.get(), keyword, verse_cache.reference_index())
+        if results is not None:
+            results = results[start:start + RESULTS_PER_PAGE + 1]
+        else:
+            results = verse_store.search(keyword, RESULTS_PER_PAGE + 1, start)
+        return results[:RESULTS_PER_PAGE], len(results) > RESULTS_PER_PAGE
+    if search_type in ('jamo', 'fuzzy'):
+        start = (page - 1) * RESULTS_PER_PAGE
+        results = run_search(search_type, keyword)[start:start + RESULTS_PER_PAGE + 1]
+        return results[:RESULTS_PER_PAGE], len(results) > RESULTS_PER_PAGE
+    return run_search(search_type, keyword), False
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    verses = load_verses()
     results = []
     search_type = 'keyword'
     keyword = ''
+    page = 1
+    has_next = False
     if request.method == 'POST':
-        search_type = request.form.get('search_type', 'keyword')
+        # 같은 검색을 캐시할 수 있도록 GET /search로 넘긴다
         keyword = request.form.get('keyword', '').strip()
         if keyword:
-            if search_type == 'keyword':
-                results = search_verses(verses, keyword)
-            else:
-                results = semantic_search_verses(verses, keyword)
-    return render_template('bible_search_index.html', results=results, keyword=keyword, search_type=search_type)
+            return redirect(url_for('search', q=keyword, type=request.form.get('search_type', 'keyword'),
+                                    page=max(request.form.get('page', 1, type=int), 1)), code=303)
+    return render_template('bible_search_index.html', results=results, keyword=keyword, search_type=search_type,
+                           page=page, has_next=has_next)
+
+@app.route('/search')
+def search():
+    """검색 결과 쪽 (?q=검색어&type=검색 종류&page=쪽). 코퍼스가 그대로면 ETag로 304를 돌려준다."""
+    keyword = request.args.get('q', '').strip()
+    search_type = request.args.get('type', 'keyword')
+    page = max(request.args.get('page', 1, type=int), 1)
+    if search_type not in SEARCH_TYPES:
+        return jsonify({'error': f'type은 {", ".join(SEARCH_TYPES)} 중 하나여야 합니다.'}), 400
+    if not keyword:
+        return redirect(url_for('index'))
+
+    def render():
+        results, has_next = search_page(search_type, keyword, page)
+        return render_template('bible_search_index.html', results=results, keyword=keyword,
+                               search_type=search_type, page=page, has_next=has_next)
+
+    # 검색어는 공백까지 그대로 키에 넣는다 (키워드 검색은 공백이 다르면 결과도 다를 수 있다)
+    return cached_page(f'search\0{search_type}\0{keyword}\0{page}', render,
+                       cacheable=search_type not in MODEL_SEARCH_TYPES)
 
 @app.route('/add', methods=['POST'])
 def add():
@@ -38,47 +177,88 @@ def add():
         flash('참조와 내용을 모두 입력하세요.', 'danger')
         if from_semantic:
             # Re-render index with previous context
-            verses = load_verses()
             results = []
             if search_type and keyword:
-                if search_type == 'keyword':
-                    results = search_verses(verses, keyword)
-                else:
-                    results = semantic_search_verses(verses, keyword)
+                results = run_search(search_type, keyword)
             return render_template('bible_search_index.html', results=results, keyword=keyword or '', search_type=search_type or 'keyword')
         return redirect(url_for('index'))
     try:
-        with sqlite3.connect('bible_verses.db', timeout=10) as conn:
-            c = conn.cursor()
-            c.execute('INSERT INTO bible_verses (reference, content) VALUES (?, ?)', (reference, content))
-            conn.commit()
+        verse_store.add(reference, content)
         flash(f'구절이 추가되었습니다: {reference}', 'success')
     except sqlite3.IntegrityError:
         flash(f'[중복] 이미 존재하는 구절: {reference}', 'warning')
         if from_semantic:
-            verses = load_verses()
             results = []
             if search_type and keyword:
-                if search_type == 'keyword':
-                    results = search_verses(verses, keyword)
-                else:
-                    results = semantic_search_verses(verses, keyword)
+                results = run_search(search_type, keyword)
             return render_template('bible_search_index.html', results=results, keyword=keyword or '', search_type=search_type or 'keyword')
     if from_semantic:
-        verses = load_verses()
         results = []
         if search_type and keyword:
-            if search_type == 'keyword':
-                results = search_verses(verses, keyword)
-            else:
-                results = semantic_search_verses(verses, keyword)
+            results = run_search(search_type, keyword)
         return render_template('bible_search_index.html', results=results, keyword=keyword or '', search_type=search_type or 'keyword')
     return redirect(url_for('index'))
 
 @app.route('/all')
 def show_all():
-    verses = load_verses()
-    return render_template('bible_search_all.html', verses=verses)
+    """저장 순서로 한 쪽씩 보여 주는 목록 (?after=앞 쪽 마지막 구절의 id&size=쪽 크기)"""
+    after = request.args.get('after', type=int)
+    size = min(max(request.args.get('size', ALL_PAGE_SIZE, type=int), 1), MAX_ALL_PAGE_SIZE)
+
+    def render():
+        verses, next_cursor = verse_store.page_by_id(after, size)
+        return render_template('bible_search_all.html', verses=verses, after=after, next_cursor=next_cursor,
+                               size=size)
+
+    return cached_page(f'all\0{after or ""}\0{size}', render)
+
+@app.route('/all/export')
+def export_all():
+    """모든 구절을 CSV(기본) 또는 JSONL(?format=jsonl)로 스트리밍하는 함수 (첫 바이트가 바로 나간다)"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ROW_FORMATS:
+        return jsonify({'error': f'format은 {", ".join(ROW_FORMATS)} 중 하나여야 합니다.'}), 400
+    etag, last_modified = validators(f'export\0{fmt}')
+    if not_modified(etag, last_modified):
+        return with_validators(Response(status=304), etag, last_modified)
+    mimetype = 'application/x-ndjson' if fmt == 'jsonl' else 'text/csv'
+    return with_validators(
+        Response(stream_with_context(verse_store.export(fmt, EXPORT_BATCH_SIZE)), mimetype=mimetype,
+                 headers={'Content-Disposition': f'attachment; filename=bible_verses.{fmt}'}),
+        etag, last_modified)
+
+@app.route('/import', methods=['POST'])
+def import_verses():
+    """CSV 또는 JSONL 파일(폼 필드 'file' 또는 요청 본문)의 구절을 한 트랜잭션으로 가져오는 API
+
+    형식은 ?format=, 없으면 업로드한 파일 이름의 확장자로 정한다. 결과로 추가·중복·건너뛴 개수를 돌려준다.
+    """
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    fmt = request.args.get('format') or (format_for_path(upload.filename or '') if upload else 'csv')
+    if fmt not in ROW_FORMATS:
+        return jsonify({'error': f'format은 {", ".join(ROW_FORMATS)} 중 하나여야 합니다.'}), 400
+    batch_size = request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int)
+    try:
+        report = verse_store.bulk_import(iter_rows(io.TextIOWrapper(stream, encoding='utf-8', newline=''), fmt),
+                                         batch_size)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({'error': f'가져오기를 취소했습니다: {str(e)}'}), 400
+    return jsonify(report)
+
+@app.route('/api/semantic_batch', methods=['POST'])
+def semantic_batch():
+    """{"queries": [...], "local": false}를 받아 질문별 의미론적 검색 결과를 돌려주는 API"""
+    payload = request.get_json(silent=True) or {}
+    queries = payload.get('queries')
+    if not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({'error': 'queries는 비어 있지 않은 문자열 목록이어야 합니다.'}), 400
+    verses = verse_cache.get()
+    results = semantic_search_batch(verses, [q.strip() for q in queries], vector_index=verse_cache.vector_index(),
+                                    local_only=bool(payload.get('local')), cache=semantic_cache,
+                                    corpus_version=verse_cache.fingerprint(),
+                                    reference_matcher=verse_cache.reference_matcher())
+    return jsonify({'results': [{'query': q, 'verses': [dict(v) for v in r]} for q, r in zip(queries, results)]})
 
 @app.route('/edit/<reference>', methods=['GET', 'POST'])
 def edit_verse(reference):
@@ -87,27 +267,18 @@ def edit_verse(reference):
         if not new_content:
             flash('내용을 입력하세요.', 'danger')
             return redirect(url_for('edit_verse', reference=reference))
-        with sqlite3.connect('bible_verses.db', timeout=10) as conn:
-            c = conn.cursor()
-            c.execute('UPDATE bible_verses SET content = ? WHERE reference = ?', (new_content, reference))
-            conn.commit()
+        verse_store.update(reference, new_content)
         flash(f'{reference} 내용이 수정되었습니다.', 'success')
         return redirect(url_for('show_all'))
-    with sqlite3.connect('bible_verses.db', timeout=10) as conn:
-        c = conn.cursor()
-        c.execute('SELECT reference, content FROM bible_verses WHERE reference = ?', (reference,))
-        verse = c.fetchone()
+    verse = verse_store.get(reference)
     if not verse:
         flash('구절을 찾을 수 없습니다.', 'danger')
         return redirect(url_for('show_all'))
-    return render_template('bible_search_edit.html', verse={'reference': verse[0], 'content': verse[1]})
+    return render_template('bible_search_edit.html', verse=verse)
 
 @app.route('/delete/<reference>', methods=['POST'])
 def delete_verse(reference):
-    with sqlite3.connect('bible_verses.db', timeout=10) as conn:
-        c = conn.cursor()
-        c.execute('DELETE FROM bible_verses WHERE reference = ?', (reference,))
-        conn.commit()
+    verse_store.delete(reference)
     flash(f'{reference} 구절이 삭제되었습니다.', 'success')
     return redirect(url_for('show_all'))
 
@@ -0,0 +1,90 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Callable
+
+from bible_tokens import estimate_tokens
+from bible_index import build_vector_index
+from bible_reference import ReferenceMatcher, build_reference_matcher
+
+# 샤드 하나의 프롬프트에 넣을 구절의 대략적인 토큰 예산과 동시에 질의할 샤드 수
+SHARD_TOKEN_BUDGET = int(os.getenv('SHARD_TOKEN_BUDGET', '6000'))
+SHARD_PARALLELISM = int(os.getenv('SHARD_PARALLELISM', '4'))
+# 샤드마다 고를 후보 수와 최종 결과 수
+SHARD_CANDIDATES = int(os.getenv('SHARD_CANDIDATES', '5'))
+SHARD_RESULTS = 3
+
+# (질의, 구절 목록, 고를 개수)를 받아 참조를 나열한 모델 응답 텍스트를 돌려주는 함수
+RankBackend = Callable[[str, List[Dict], int], str]
+
+
+def verse_line(verse: Dict) -> str:
+    return f"{verse['reference']}: {verse['content']}"
+
+
+def shard_verses(verses: List[Dict], token_budget: int = SHARD_TOKEN_BUDGET) -> List[List[Dict]]:
+    """구절을 순서대로 묶어 샤드마다 추정 토큰 수가 token_budget을 넘지 않게 나누는 함수
+
+    구절 하나가 예산보다 크면 그 구절만으로 샤드를 만든다.
+    """
+    shards: List[List[Dict]] = []
+    shard: List[Dict] = []
+    used = 0
+    for verse in verses:
+        tokens = estimate_tokens(verse_line(verse)) + 1
+        if shard and used + tokens > token_budget:
+            shards.append(shard)
+            shard, used = [], 0
+        shard.append(verse)
+        used += tokens
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def local_rank(query: str, verses: List[Dict], limit: int) -> str:
+    """모델 없이 TF-IDF 유사도로 고른 참조를 모델 응답 형식으로 돌려주는 백엔드 (테스트·오프라인용)"""
+    return "\n".join(v['reference'] for v in build_vector_index(verses).top(query, limit))
+
+
+def map_reduce_search(verses: List[Dict], query: str, backend: RankBackend,
+                      token_budget: int = SHARD_TOKEN_BUDGET, parallelism: int = SHARD_PARALLELISM,
+                      per_shard: int = SHARD_CANDIDATES, limit: int = SHARD_RESULTS,
+                      reference_matcher: Optional[ReferenceMatcher] = None) -> List[Dict]:
+    """코퍼스를 샤드로 나눠 의미론적 검색을 하는 함수
+
+    map 단계에서 샤드마다 per_shard개의 후보를 parallelism개까지 동시에 고르고,
+    reduce 단계에서 모은 후보만 다시 backend에 보내 limit개로 추린다.
+    실패한 샤드는 건너뛰고, 모든 샤드가 실패하면 마지막 예외를 다시 낸다.
+    reduce 응답에서 참조를 찾지 못하면 map 단계의 순서대로 limit개를 반환한다.
+    """
+    if reference_matcher is None:
+        reference_matcher = build_reference_matcher(verses)
+    shards = shard_verses(verses, token_budget)
+    if not shards:
+        return []
+
+    def map_shard(shard: List[Dict]):
+        try:
+            return reference_matcher.match(backend(query, shard, per_shard)), None
+        except Exception as e:
+            print(f"샤드 검색 중 오류가 발생했습니다: {str(e)}")
+            return [], e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(shards)))) as executor:
+        mapped = list(executor.map(map_shard, shards))
+    errors = [error for _, error in mapped if error is not None]
+    if len(errors) == len(shards):
+        raise errors[-1]
+
+    candidates: List[Dict] = []
+    seen = set()
+    for matching, _ in mapped:
+        for verse in matching:
+            if verse['reference'] not in seen:
+                seen.add(verse['reference'])
+                candidates.append(verse)
+    if len(candidates) <= limit:
+        return candidates
+
+    reduced = reference_matcher.match(backend(query, candidates, limit))
+    return reduced[:limit] if reduced else candidates[:limit]
@@ -0,0 +1,409 @@
+import itertools
+import os
+import sqlite3
+import sys
+import threading
+import weakref
+from typing import List, Dict, Optional, Iterator, Iterable, Tuple, Any, Set
+
+from bible_corpus import read_csv_rows, iter_rows, format_rows, format_for_path
+
+DB_PATH = 'bible_verses.db'
+
+# bible_verses는 실제 데이터를 담고, bible_verses_fts는 trigram 토크나이저를 쓰는
+# 외부 콘텐츠 FTS5 색인이다. 트리거가 두 테이블과 변경 카운터(bible_meta)를 맞추고,
+# 메모리 색인이 따라갈 수 있도록 바뀐 구절 id를 변경 기록(bible_changes)에 남긴다.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS bible_verses (
+    id INTEGER PRIMARY KEY,
+    reference TEXT NOT NULL UNIQUE,
+    content TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS bible_verses_fts USING fts5(
+    reference, content, content='bible_verses', content_rowid='id', tokenize='trigram'
+);
+CREATE TABLE IF NOT EXISTS bible_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO bible_meta (key, value) VALUES ('version', 0);
+CREATE TRIGGER IF NOT EXISTS bible_verses_ai AFTER INSERT ON bible_verses BEGIN
+    INSERT INTO bible_verses_fts (rowid, reference, content) VALUES (new.id, new.reference, new.content);
+    UPDATE bible_meta SET value = value + 1 WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS bible_verses_ad AFTER DELETE ON bible_verses BEGIN
+    INSERT INTO bible_verses_fts (bible_verses_fts, rowid, reference, content)
+        VALUES ('delete', old.id, old.reference, old.content);
+    UPDATE bible_meta SET value = value + 1 WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS bible_verses_au AFTER UPDATE ON bible_verses BEGIN
+    INSERT INTO bible_verses_fts (bible_verses_fts, rowid, reference, content)
+        VALUES ('delete', old.id, old.reference, old.content);
+    INSERT INTO bible_verses_fts (rowid, reference, content) VALUES (new.id, new.reference, new.content);
+    UPDATE bible_meta SET value = value + 1 WHERE key = 'version';
+END;
+CREATE TABLE IF NOT EXISTS bible_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    verse_id INTEGER NOT NULL,
+    changed_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+);
+CREATE TRIGGER IF NOT EXISTS bible_changes_ai AFTER INSERT ON bible_verses BEGIN
+    INSERT INTO bible_changes (op, verse_id) VALUES ('insert', new.id);
+END;
+CREATE TRIGGER IF NOT EXISTS bible_changes_ad AFTER DELETE ON bible_verses BEGIN
+    INSERT INTO bible_changes (op, verse_id) VALUES ('delete', old.id);
+END;
+CREATE TRIGGER IF NOT EXISTS bible_changes_au AFTER UPDATE ON bible_verses BEGIN
+    INSERT INTO bible_changes (op, verse_id) VALUES ('update', new.id);
+END;
+'''
+
+# trigram 색인은 세 글자 미만의 검색어를 찾지 못하므로 그때는 테이블을 직접 훑는다
+MIN_FTS_QUERY = 3
+
+
+# 연결마다 적용하는 PRAGMA. WAL 모드에서는 쓰기 중에도 읽기가 막히지 않는다.
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+)
+
+
+# 변경 기록을 정리할 때 남겨 둘 최근 항목 수 (이보다 뒤처진 캐시는 전체를 다시 읽는다)
+CHANGE_LOG_RETENTION = int(os.getenv('CHANGE_LOG_RETENTION', '50000'))
+# 대량 가져오기에서 executemany 한 번에 넣을 행 수와 보고서에 남길 중복 참조 예시 수
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '500'))
+DUPLICATE_EXAMPLES = 20
+# 이미 있는 참조를 한 번에 확인할 개수 (SQLite 바인드 변수 제한보다 작게)
+_LOOKUP_CHUNK = 500
+
+
+def _batches(rows: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class _ThreadConnection:
+    """스레드 하나의 연결을 담는 상자 (스레드가 끝나 상자가 사라지면 연결을 닫는다)"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+
+class ConnectionPool:
+    """스레드마다 SQLite 연결 하나를 만들어 재사용하는 풀
+
+    WSGI 워커 스레드는 요청마다 같은 연결을 쓰므로 연결 비용과 PRAGMA 설정을
+    한 번만 치르고, sqlite3의 문장 캐시(cached_statements)로 준비된 문장도 재사용한다.
+    요청마다 새 스레드를 띄우는 서버나 백그라운드 스레드가 끝나면 그 스레드의 연결도 닫으므로
+    열린 연결 수는 살아 있는 스레드 수를 넘지 않는다.
+    """
+
+    def __init__(self, path: str, timeout: float = 10, cached_statements: int = 128):
+        self.path = path
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Set[sqlite3.Connection] = set()
+
+    def get(self) -> sqlite3.Connection:
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                                   cached_statements=self.cached_statements)
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            holder = self._local.holder = _ThreadConnection(conn)
+            with self._lock:
+                self._connections.add(conn)
+            # threading.local은 스레드가 끝날 때 값을 버리므로 그때 연결을 닫는다
+            weakref.finalize(holder, self._release, conn)
+        return holder.conn
+
+    def _release(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._connections.discard(conn)
+        conn.close()
+
+    def __len__(self) -> int:
+        """지금 열려 있는 연결 수"""
+        return len(self._connections)
+
+    def close(self):
+        """풀이 만든 모든 연결을 닫는 함수"""
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+def _fts_phrase(keyword: str) -> str:
+    """검색어를 FTS5 구문(phrase) 질의로 감싸는 함수"""
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+class VerseStore:
+    """bible_verses.db에 대한 저장소 계층
+
+    검색 결과는 search_verses와 같은 {'reference', 'content'} 딕셔너리 목록이다.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self.pool = ConnectionPool(path)
+
+    def connect(self) -> sqlite3.Connection:
+        """현재 스레드의 풀 연결을 반환하는 함수 (with 블록이 트랜잭션 단위)"""
+        return self.pool.get()
+
+    def close(self):
+        self.pool.close()
+
+    def _migrate_legacy_table(self, conn: sqlite3.Connection):
+        """id 열이 없는 예전 bible_verses 테이블을 새 스키마로 옮기는 함수"""
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(bible_verses)')]
+        if not columns or 'id' in columns:
+            return
+        conn.execute('ALTER TABLE bible_verses RENAME TO bible_verses_legacy')
+        conn.executescript(SCHEMA)
+        conn.execute('INSERT OR IGNORE INTO bible_verses (reference, content) '
+                     'SELECT reference, content FROM bible_verses_legacy')
+        conn.execute('DROP TABLE bible_verses_legacy')
+
+    def init(self, csv_path: Optional[str] = None):
+        """스키마를 만들고, 비어 있으면 CSV를 한 번에 가져오는 함수"""
+        with self.connect() as conn:
+            self._migrate_legacy_table(conn)
+            conn.executescript(SCHEMA)
+            empty = conn.execute('SELECT NOT EXISTS (SELECT 1 FROM bible_verses)').fetchone()[0]
+        if empty and csv_path:
+            self.import_csv(csv_path)
+
+    def import_csv(self, path: str) -> int:
+        """CSV의 구절을 한 트랜잭션으로 가져오고 새로 추가된 개수를 반환하는 함수"""
+        return self.bulk_import(read_csv_rows(path))['inserted']
+
+    def bulk_import(self, rows: Iterable[Tuple[str, str]], batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, Any]:
+        """(reference, content) 행을 스트리밍으로 읽어 한 트랜잭션 안에서 batch_size개씩 추가하는 함수
+
+        이미 있거나 입력 안에서 반복된 참조는 건너뛰고 개수와 앞쪽 예시만 모아 보고한다.
+        참조나 내용이 비어 있는 행은 skipped로 센다. 읽는 도중 오류가 나면 전부 되돌린다.
+        FTS5 색인과 변경 카운터는 트리거가 같은 트랜잭션 안에서 함께 갱신한다.
+        """
+        report = {'inserted': 0, 'duplicates': 0, 'skipped': 0, 'duplicate_references': []}
+
+        def duplicate(reference: str):
+            report['duplicates'] += 1
+            if len(report['duplicate_references']) < DUPLICATE_EXAMPLES:
+                report['duplicate_references'].append(reference)
+
+        seen = set()
+        with self.connect() as conn:
+            for batch in _batches(rows, max(batch_size, 1)):
+                fresh = []
+                for reference, content in batch:
+                    reference, content = reference.strip(), content.strip()
+                    if not reference or not content:
+                        report['skipped'] += 1
+                    elif reference in seen:
+                        duplicate(reference)
+                    else:
+                        seen.add(reference)
+                        fresh.append((reference, content))
+
+                existing = set()
+                for chunk in _batches([r for r, _ in fresh], _LOOKUP_CHUNK):
+                    existing.update(r[0] for r in conn.execute(
+                        f"SELECT reference FROM bible_verses WHERE reference IN ({','.join('?' * len(chunk))})", chunk))
+                new = []
+                for row in fresh:
+                    if row[0] in existing:
+                        duplicate(row[0])
+                    else:
+                        new.append(row)
+
+                # rowcount는 트리거가 바꾼 행(FTS5, 변경 카운터)을 세지 않는다
+                inserted = conn.executemany('INSERT OR IGNORE INTO bible_verses (reference, content) VALUES (?, ?)',
+                                            new).rowcount if new else 0
+                # 확인한 뒤 다른 연결이 같은 참조를 넣은 경우
+                report['duplicates'] += len(new) - inserted
+                report['inserted'] += inserted
+        return report
+
+    def export(self, fmt: str = 'csv', batch_size: int = 1000) -> Iterator[str]:
+        """모든 구절을 저장 순서로 CSV 또는 JSONL 줄 단위로 돌려주는 함수"""
+        return format_rows(self.iter_by_id(batch_size), fmt)
+
+    def data_version(self) -> int:
+        """쓰기가 일어날 때마다 증가하는 변경 카운터"""
+        with self.connect() as conn:
+            return conn.execute("SELECT value FROM bible_meta WHERE key = 'version'").fetchone()[0]
+
+    def change_position(self) -> int:
+        """마지막 변경 기록 번호 (기록이 없으면 0)"""
+        row = self.connect().execute("SELECT seq FROM sqlite_sequence WHERE name = 'bible_changes'").fetchone()
+        return row[0] if row else 0
+
+    def change_stamp(self) -> Tuple[int, Optional[int]]:
+        """(마지막 변경 기록 번호, 그 변경의 유닉스 시각)을 반환하는 함수 (HTTP 검증자용)
+
+        기록이 정리되어 시각을 알 수 없으면 시각은 None이다.
+        """
+        conn = self.connect()
+        row = conn.execute('SELECT seq, changed_at FROM bible_changes ORDER BY seq DESC LIMIT 1').fetchone()
+        position = self.change_position()
+        return position, row[1] if row and row[0] == position else None
+
+    def changes_since(self, position: int, limit: int = -1) -> Optional[List[Tuple[int, str, int, Optional[Dict]]]]:
+        """position 뒤의 변경을 (번호, 'insert'|'update'|'delete', 구절 id, 현재 구절)로 반환하는 함수
+
+        현재 구절은 지금 DB에 있는 내용이며 그 사이 지워졌으면 None이다.
+        필요한 기록이 이미 정리되어 따라갈 수 없으면 None을 반환한다.
+        """
+        conn = self.connect()
+        oldest = conn.execute('SELECT MIN(seq) FROM bible_changes').fetchone()[0]
+        if (oldest is None and self.change_position() > position) or (oldest is not None and oldest > position + 1):
+            return None
+        rows = conn.execute(
+            'SELECT c.seq, c.op, c.verse_id, v.reference, v.content FROM bible_changes c '
+            'LEFT JOIN bible_verses v ON v.id = c.verse_id WHERE c.seq > ? ORDER BY c.seq LIMIT ?',
+            (position, limit)).fetchall()
+        return [(seq, op, verse_id, {'reference': ref, 'content': content} if ref is not None else None)
+                for seq, op, verse_id, ref, content in rows]
+
+    def snapshot(self) -> Tuple[int, List[int], List[Tuple[str, str]]]:
+        """같은 시점의 (마지막 변경 기록 번호, 구절 id 목록, (reference, content) 목록)을 읽는 함수"""
+        conn = self.connect()
+        conn.execute('BEGIN')
+        try:
+            position = self.change_position()
+            rows = conn.execute('SELECT id, reference, content FROM bible_verses ORDER BY id').fetchall()
+        finally:
+            conn.execute('COMMIT')
+        return position, [r[0] for r in rows], [(r[1], r[2]) for r in rows]
+
+    def prune_changes(self, keep: int = CHANGE_LOG_RETENTION) -> int:
+        """최근 keep개만 남기고 변경 기록을 지우는 함수 (지운 개수 반환)"""
+        with self.connect() as conn:
+            return conn.execute('DELETE FROM bible_changes WHERE seq <= ?',
+                                (self.change_position() - keep,)).rowcount
+
+    def iter_rows(self) -> Iterator[Tuple[str, str]]:
+        """(reference, content)를 저장 순서대로 하나씩 돌려주는 함수 (VerseCorpus.from_rows용)"""
+        yield from self.connect().execute('SELECT reference, content FROM bible_verses ORDER BY id')
+
+    def all_verses(self) -> List[Dict]:
+        with self.connect() as conn:
+            rows = conn.execute('SELECT reference, content FROM bible_verses ORDER BY id').fetchall()
+        return [{'reference': r[0], 'content': r[1]} for r in rows]
+
+    def page_by_id(self, after: Optional[int] = None, limit: int = 100) -> Tuple[List[Dict], Optional[int]]:
+        """저장 순서(CSV·추가 순)로 id가 after 다음인 구절 limit개와 다음 쪽 커서를 반환하는 함수 (키셋 페이지네이션)
+
+        OFFSET 대신 마지막 구절의 id를 커서로 쓰므로 기본 키에서 바로 시작 위치를 찾고,
+        앞쪽 구절이 지워지거나 새 구절이 추가되어도 이미 본 구절이 다시 나오거나 빠지지 않는다.
+        다음 쪽이 없으면 커서는 None이다.
+        """
+        with self.connect() as conn:
+            rows = conn.execute('SELECT id, reference, content FROM bible_verses WHERE id > ? ORDER BY id LIMIT ?',
+                                (after or 0, limit + 1)).fetchall()
+        verses = [{'reference': r[1], 'content': r[2]} for r in rows[:limit]]
+        return verses, rows[limit - 1][0] if len(rows) > limit else None
+
+    def iter_by_id(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """모든 구절을 저장 순서로 하나씩 돌려주는 함수
+
+        batch_size개씩 키셋 페이지로 나눠 읽으므로 긴 내보내기 중에도 읽기 트랜잭션을 오래 잡지 않는다.
+        """
+        cursor = None
+        while True:
+            verses, cursor = self.page_by_id(cursor, batch_size)
+            yield from verses
+            if cursor is None:
+                return
+
+    def search(self, keyword: str, limit: int = -1, offset: int = 0) -> List[Dict]:
+        """키워드를 내용이나 참조에 포함하는 구절을 저장 순서대로 찾는 함수 (limit -1이면 전부)"""
+        with self.connect() as conn:
+            if len(keyword) >= MIN_FTS_QUERY:
+                rows = conn.execute(
+                    'SELECT v.reference, v.content FROM bible_verses_fts f '
+                    'JOIN bible_verses v ON v.id = f.rowid '
+                    'WHERE bible_verses_fts MATCH ? ORDER BY v.id LIMIT ? OFFSET ?',
+                    (_fts_phrase(keyword), limit, offset)).fetchall()
+            else:
+                keyword = keyword.lower()
+                rows = conn.execute(
+                    'SELECT reference, content FROM bible_verses '
+                    'WHERE instr(lower(content), ?) OR instr(lower(reference), ?) ORDER BY id LIMIT ? OFFSET ?',
+                    (keyword, keyword, limit, offset)).fetchall()
+        return [{'reference': r[0], 'content': r[1]} for r in rows]
+
+    def get(self, reference: str) -> Optional[Dict]:
+        with self.connect() as conn:
+            row = conn.execute('SELECT reference, content FROM bible_verses WHERE reference = ?',
+                               (reference,)).fetchone()
+        return {'reference': row[0], 'content': row[1]} if row else None
+
+    def add(self, reference: str, content: str):
+        """구절을 추가하는 함수 (이미 있으면 sqlite3.IntegrityError)"""
+        with self.connect() as conn:
+            conn.execute('INSERT INTO bible_verses (reference, content) VALUES (?, ?)', (reference, content))
+
+    def update(self, reference: str, content: str):
+        with self.connect() as conn:
+            conn.execute('UPDATE bible_verses SET content = ? WHERE reference = ?', (content, reference))
+
+    def delete(self, reference: str):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM bible_verses WHERE reference = ?', (reference,))
+
+
+def main():
+    """python bible_store.py import|export <파일 또는 -> [DB 경로]
+
+    형식은 확장자로 정한다(.jsonl이면 JSONL, 그 밖은 CSV). '-'이면 표준 입출력을 CSV로 쓴다.
+    """
+    args = sys.argv[1:]
+    if len(args) not in (2, 3) or args[0] not in ('import', 'export'):
+        print("사용법: python bible_store.py import|export <bible_verses.csv|verses.jsonl|-> [bible_verses.db]")
+        sys.exit(1)
+    command, path = args[0], args[1]
+    fmt = 'csv' if path == '-' else format_for_path(path)
+    store = VerseStore(args[2] if len(args) > 2 else DB_PATH)
+    store.init()
+
+    if command == 'export':
+        file = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+        try:
+            file.writelines(store.export(fmt))
+        finally:
+            if file is not sys.stdout:
+                file.close()
+        return
+
+    file = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8', newline='')
+    try:
+        report = store.bulk_import(iter_rows(file, fmt))
+    except ValueError as e:
+        print(f"가져오기를 취소했습니다: {str(e)}")
+        sys.exit(1)
+    finally:
+        if file is not sys.stdin:
+            file.close()
+    print(f"추가 {report['inserted']}개, 중복 {report['duplicates']}개, 건너뜀 {report['skipped']}개")
+    if report['duplicate_references']:
+        print("중복 예시: " + ', '.join(report['duplicate_references']))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+def estimate_tokens(text: str) -> int:
+    """토큰 수를 대략 추정하는 함수 (UTF-8 4바이트당 1토큰, 한글은 글자당 약 0.75토큰)
+
+    대화 기록 예산(bible.py)과 샤드 크기(bible_shards.py)가 같은 추정을 쓴다.
+    """
+    return len(text.encode('utf-8')) // 4 + 1
@@ -1,6 +1,33 @@
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
-from bible_search import load_verses, semantic_search_verses
+import bible_search
+import bible_search_web
+import bible_search_asgi
+from bible_search import (load_verses, search_verses, ranked_search_verses, semantic_search_verses, semantic_search_batch,
+                          lookup_reference, sharded_semantic_search, fuzzy_search_verses, VerseCache, GeminiClient)
+from bible_index import (build_search_index, build_vector_index, build_bm25_index, build_jamo_index, to_jamo,
+                         to_choseong, is_choseong_query, build_fuzzy_index, bounded_levenshtein)
+from bible_cache import SemanticResultCache, FragmentCache, cache_key
+from bible_reference import VerseRef, parse_reference, build_reference_index, build_reference_matcher
+from bible_store import VerseStore
+from bible_live import LiveVerseCache
+from bible_corpus import iter_rows, format_rows, VerseCorpus, compile_corpus, compiled_path_for, is_compiled_fresh, load_compiled_corpus
+from bible_shards import shard_verses, local_rank, map_reduce_search, verse_line
+from bible import trim_history, stream_reply
+from bible_tokens import estimate_tokens
+from app import load_recipes, build_ingredient_index, find_recipes_by_ingredient, find_recipes_by_pantry
+from bible_concurrency import SingleFlight, CallLimiter, ModelBusyError
 
 class TestBibleSearch(unittest.TestCase):
     def setUp(self):
@@ -13,6 +40,8 @@ class TestBibleSearch(unittest.TestCase):
             {'reference': '요한복음 20:24', 'content': '열두 제자 중의 하나인 디두모라 하는 도마는 예수께서 오셨을 때에 함께 있지 아니한지라'}
         ]
 
+    @patch.dict(os.environ, {'GOOGLE_API_KEY': 'test-key', 'GEMINI_MODEL': 'models/gemini-1.5-pro'})
+    @patch('bible_search.gemini', GeminiClient(cache_path=None))
     @patch('bible_search.genai.GenerativeModel')
     def test_semantic_search_disciples(self, mock_model):
         """예수님의 제자 수에 대한 의미론적 검색 테스트"""
@@ -37,6 +66,60 @@ class TestBibleSearch(unittest.TestCase):
         self.assertTrue(any('6:67' in ref for ref in references))  # 열두 제자 언급
         self.assertTrue(any('20:24' in ref for ref in references))  # 열두 제자 언급
 
+    @patch.dict(os.environ, {'GOOGLE_API_KEY': 'test-key', 'GEMINI_MODEL': 'models/gemini-1.5-pro'})
+    @patch('bible_search.gemini', GeminiClient(cache_path=None))
+    @patch('bible_search.genai.GenerativeModel')
+    def test_semantic_search_batch_uses_one_call(self, mock_model):
+        """여러 질문을 모델 호출 한 번으로 처리하는지 테스트"""
+        mock_response = MagicMock()
+        mock_response.text = '```json\n{"1": ["요한복음 6:67-71", "요한복음 20:24"], "2": ["요한복음 1:43-51"]}\n```'
+        mock_model.return_value.generate_content.return_value = mock_response
+
+        result = semantic_search_batch(self.test_verses, ["열두 제자", "빌립을 부르심"])
+
+        self.assertEqual(mock_model.return_value.generate_content.call_count, 1)
+        self.assertEqual([[v['reference'] for v in r] for r in result],
+                         [['요한복음 6:67-71', '요한복음 20:24'], ['요한복음 1:43-51']])
+
+    @patch.dict(os.environ, {'GOOGLE_API_KEY': 'test-key', 'GEMINI_MODEL': 'models/gemini-1.5-pro'})
+    @patch('bible_search.gemini', GeminiClient(cache_path=None))
+    @patch('bible_search.genai.GenerativeModel')
+    def test_semantic_search_batch_falls_back_to_single_calls(self, mock_model):
+        """배치 답에 빠진 질문은 개별 호출로 채우는지 테스트"""
+        batch_response, single_response = MagicMock(), MagicMock()
+        batch_response.text = '{"1": ["요한복음 20:24"]}'
+        single_response.text = '요한복음 13:1-17'
+        mock_model.return_value.generate_content.side_effect = [batch_response, single_response]
+
+        result = semantic_search_batch(self.test_verses, ["도마", "유월절"])
+
+        self.assertEqual([[v['reference'] for v in r] for r in result], [['요한복음 20:24'], ['요한복음 13:1-17']])
+
+    def test_semantic_search_batch_keeps_going_after_failed_batch(self):
+        """가운데 묶음이 실패해도 다음 묶음은 계속 보내고 실패한 묶음만 개별 호출하는지 테스트"""
+        queries = [f'질문 {i}' for i in range(6)]
+        batches = []
+
+        def batch_call(context, batch, reference_matcher):
+            batches.append(batch)
+            if len(batches) == 2:
+                raise RuntimeError('일시적 오류')
+            return [[{'reference': q, 'content': '묶음'}] for q in batch]
+
+        def single_call(verses, query, *args, **kwargs):
+            return [{'reference': query, 'content': '개별'}]
+
+        with patch.object(bible_search.gemini, 'available', return_value=True), \
+                patch('bible_search._semantic_batch_call', side_effect=batch_call), \
+                patch('bible_search.semantic_search_verses', side_effect=single_call) as single, \
+                patch('builtins.print'):
+            result = semantic_search_batch(self.test_verses, queries, batch_size=2)
+
+        self.assertEqual(batches, [queries[0:2], queries[2:4], queries[4:6]])
+        self.assertEqual(sorted(c.args[1] for c in single.call_args_list), queries[2:4])
+        self.assertEqual([r[0]['content'] for r in result], ['묶음', '묶음', '개별', '개별', '묶음', '묶음'])
+        self.assertEqual([r[0]['reference'] for r in result], queries)
+
     def test_load_verses(self):
         """성경 구절 로드 테스트"""
         verses = load_verses()
@@ -45,5 +128,1206 @@ class TestBibleSearch(unittest.TestCase):
         self.assertTrue(all('reference' in verse for verse in verses))
         self.assertTrue(all('content' in verse for verse in verses))
 
+class TestGeminiClient(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @patch.dict(os.environ, {'GOOGLE_API_KEY': ''})
+    def test_import_and_keyword_search_work_offline(self):
+        """API 키가 없어도 키워드 검색과 로컬 의미론적 검색이 동작하는지 테스트"""
+        verses = load_verses()
+        self.assertTrue(search_verses(verses, '하나님'))
+        with patch('bible_search.gemini', GeminiClient(cache_path=None)), \
+                patch('bible_search.genai.list_models') as mock_list:
+            self.assertTrue(semantic_search_verses(verses, '태초에 말씀'))
+        mock_list.assert_not_called()
+
+    @patch.dict(os.environ, {'GOOGLE_API_KEY': 'test-key', 'GEMINI_MODEL': ''})
+    @patch('bible_search.genai.list_models')
+    def test_model_name_is_discovered_once_and_cached_on_disk(self, mock_list):
+        """모델 이름을 한 번만 조회하고 디스크 캐시를 재사용하는지 테스트"""
+        available = MagicMock()
+        available.name = 'models/gemini-1.5-pro'
+        mock_list.return_value = [available]
+
+        client = GeminiClient(cache_path=self.path)
+        self.assertEqual(client.model_name(), 'models/gemini-1.5-pro')
+        self.assertEqual(client.model_name(), 'models/gemini-1.5-pro')
+        self.assertEqual(GeminiClient(cache_path=self.path).model_name(), 'models/gemini-1.5-pro')
+        self.assertEqual(mock_list.call_count, 1)
+
+        self.assertEqual(GeminiClient(cache_path=self.path, ttl=-1).model_name(), 'models/gemini-1.5-pro')
+        self.assertEqual(mock_list.call_count, 2)
+
+class TestNgramIndex(unittest.TestCase):
+    def setUp(self):
+        self.verses = load_verses()
+        self.index = build_search_index(self.verses)
+
+    def test_index_matches_linear_search(self):
+        """색인 검색 결과가 전체 순회 검색과 같은지 테스트"""
+        for keyword in ['하나님', '빛', '사랑하', '요한복음 1:1', '태초에 말씀이', 'JOHN', '', '없는검색어입니다']:
+            self.assertEqual(search_verses(self.verses, keyword, self.index),
+                             search_verses(self.verses, keyword), keyword)
+
+    def test_index_does_not_match_across_fields(self):
+        """참조와 내용을 이어 붙인 문자열에서만 나오는 검색어는 찾지 않는지 테스트"""
+        verses = [{'reference': '요한복음 1:1', 'content': '태초에'}]
+        index = build_search_index(verses)
+        self.assertEqual(index.search('1:1태초'), [])
+        self.assertEqual(index.search('1태'), [])
+        self.assertEqual(index.search('1:1'), verses)
+
+class TestJamoIndex(unittest.TestCase):
+    def setUp(self):
+        self.verses = load_verses()
+        self.index = build_jamo_index(self.verses)
+
+    def test_decomposition(self):
+        """음절을 초성과 자모로 바꾸고 겹받침·겹모음을 나누는지 테스트"""
+        self.assertEqual(to_choseong('하나님 3:16'), 'ㅎㄴㄴ 3:16')
+        self.assertEqual(to_jamo('하나님'), 'ㅎㅏㄴㅏㄴㅣㅁ')
+        self.assertEqual(to_jamo('닭과'), 'ㄷㅏㄹㄱㄱㅗㅏ')
+        self.assertTrue(is_choseong_query('ㅇㅎㅂㅇ 3:16'))
+        self.assertFalse(is_choseong_query('하ㄴ'))
+
+    def test_choseong_matches_linear_scan(self):
+        """초성 검색 결과가 모든 구절의 초성을 확인한 결과와 같은지 테스트"""
+        for query in ['ㅎㄴㄴ', 'ㅅㄹ', 'ㅇㅅ', 'ㅇㅎㅂㅇ 3:16']:
+            expected = [v for v in self.verses
+                        if query in to_choseong(v['content']) or query in to_choseong(v['reference'])]
+            self.assertEqual(self.index.search(query), expected, query)
+
+    def test_partial_syllables(self):
+        """입력 중인 부분 음절로 완성된 단어를 찾는지 테스트"""
+        for partial, word in [('하나니', '하나님'), ('사라', '사랑'), ('하ㄴ', '한')]:
+            found = self.index.search(partial)
+            self.assertTrue(all(v in found for v in search_verses(self.verses, word)), partial)
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+class TestFuzzyIndex(unittest.TestCase):
+    def setUp(self):
+        self.verses = load_verses()
+        self.index = build_fuzzy_index(self.verses)
+
+    def test_bounded_levenshtein(self):
+        """띠 모양 계산이 전체 편집 거리와 같고 k를 넘으면 None인지 테스트"""
+        for a, b in [('하나님', '하나닙'), ('사랑하사', '사랑'), ('kitten', 'sitting'), ('', 'abc'), ('독생자', '독생자')]:
+            for k in range(4):
+                distance = levenshtein(a, b)
+                self.assertEqual(bounded_levenshtein(a, b, k), distance if distance <= k else None, (a, b, k))
+
+    def test_candidate_filter_matches_brute_force(self):
+        """bigram 필터로 거른 결과가 어휘 전체를 계산한 결과와 같은지 테스트"""
+        for term in ['하나님', '사랑하사', '독생자를', '셰상', '빛']:
+            for k in [0, 1, 2]:
+                expected = {w: levenshtein(term, w) for w in self.index.words if levenshtein(term, w) <= k}
+                self.assertEqual(self.index.similar_words(term, k), expected, (term, k))
+
+    def test_misspelled_query_finds_verse(self):
+        """오타가 있는 검색어로도 구절을 찾는지 테스트"""
+        self.assertEqual(search_verses(self.verses, '사랑하샤 독생자룰'), [])
+        result = fuzzy_search_verses(self.verses, '사랑하샤 독생자룰', index=self.index)
+        self.assertEqual(result[0]['reference'], '요한복음 3:16')
+
+class TestVectorIndex(unittest.TestCase):
+    def setUp(self):
+        self.verses = load_verses()
+        self.index = build_vector_index(self.verses)
+
+    def test_top_candidates_share_terms(self):
+        """상위 후보가 질의와 겹치는 표현을 포함하는지 테스트"""
+        top = self.index.top('서로 사랑하라', 5)
+        self.assertEqual(len(top), 5)
+        self.assertTrue(all('사랑' in verse['content'] for verse in top))
+
+    def test_unrelated_query_returns_nothing(self):
+        """겹치는 표현이 없는 질의는 후보가 없는지 테스트"""
+        self.assertEqual(self.index.top('zzzz', 5), [])
+
+    def test_scores_while_add_registers_new_terms(self):
+        """질의 용어를 찾는 도중 add()가 새 용어를 등록해도 scores()가 실패하지 않는지 테스트"""
+        index = build_vector_index(list(self.verses))
+        verse = {'reference': '테스트 1:1', 'content': '쀍쀎 뾳뾷 새 용어'}
+
+        class AddOnFirstLookup(dict):
+            def __contains__(self, term):
+                if index.verses[-1] is not verse:
+                    index.verses.append(verse)
+                    index.add(verse)
+                return super().__contains__(term)
+
+        index._term_ids = AddOnFirstLookup(index._term_ids)
+        index.scores(verse['content'])
+        self.assertEqual(index.top(verse['content'], 1), [verse])
+
+    def test_local_only_skips_model(self):
+        """local_only 모드는 모델 없이 로컬 결과를 반환하는지 테스트"""
+        with patch('bible_search.genai.GenerativeModel') as mock_model:
+            result = semantic_search_verses(self.verses, '태초에 말씀', vector_index=self.index, local_only=True)
+        mock_model.assert_not_called()
+        self.assertEqual(result[0]['reference'], '요한복음 1:1')
+
+class TestBM25Index(unittest.TestCase):
+    def setUp(self):
+        self.verses = load_verses()
+        self.index = build_bm25_index(self.verses)
+
+    def test_top_k_is_ranked_and_paginated(self):
+        """상위 k개가 점수 순이고 쪽 나눔이 이어지는지 테스트"""
+        scored = self.index.scored('예수', 30)
+        scores = [score for _, score in scored]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        first, has_next = ranked_search_verses(self.verses, '예수', 1, 10, self.index)
+        second, _ = ranked_search_verses(self.verses, '예수', 2, 10, self.index)
+        self.assertTrue(has_next)
+        self.assertEqual(first + second, [self.verses[doc_id] for doc_id, _ in scored[:20]])
+
+    def test_pruning_matches_exhaustive_scoring(self):
+        """가지치기한 결과가 모든 후보를 채점한 결과와 같은지 테스트"""
+        for query in ['예수께서 제자들에게', '하나님의 사랑', '빛 생명', '요한복음 3:16']:
+            full = self.index.scored(query, len(self.verses))
+            self.assertEqual(self.index.scored(query, 5), full[:5], query)
+            self.assertEqual(self.index.scored(query, 5, 5), full[5:10], query)
+
+    def test_relevant_verse_ranks_first(self):
+        """질의와 가장 잘 맞는 구절이 맨 앞에 오는지 테스트"""
+        self.assertEqual(self.index.search('독생자를 주셨으니', 1)[0]['reference'], '요한복음 3:16')
+
+class TestReferenceIndex(unittest.TestCase):
+    def setUp(self):
+        self.verses = load_verses()
+        self.index = build_reference_index(self.verses)
+
+    def test_parse_reference(self):
+        """여러 형식의 참조를 (책, 장, 시작 절, 끝 절)로 읽는지 테스트"""
+        self.assertEqual(parse_reference('요한복음 1:35-42'), VerseRef('요한복음', 1, 35, 42))
+        self.assertEqual(parse_reference('요한복음 3장'), VerseRef('요한복음', 3, None, None))
+        self.assertEqual(parse_reference('요한복음 3장 16절'), VerseRef('요한복음', 3, 16, 16))
+        self.assertEqual(parse_reference('John 1:1-14'), VerseRef('요한복음', 1, 1, 14))
+        self.assertEqual(parse_reference('1 John 1:9'), VerseRef('요한일서', 1, 9, 9))
+        self.assertIsNone(parse_reference('하나님의 사랑'))
+
+    def test_range_lookup_matches_linear_scan(self):
+        """장·절 범위 조회가 모든 구절을 확인한 결과와 같은지 테스트"""
+        for query in ['요한복음 3장', 'John 1:1-14', '요한복음 1:1', '요한복음 6:60-70', '요한복음 21장']:
+            ref = parse_reference(query)
+            expected = []
+            for verse in self.verses:
+                other = parse_reference(verse['reference'])
+                if other.book == ref.book and other.chapter == ref.chapter and (
+                        ref.verse_start is None or
+                        (other.verse_start <= ref.verse_end and other.verse_end >= ref.verse_start)):
+                    expected.append(verse)
+            # 결과는 파일 순서가 아니라 장·절 순서다
+            expected.sort(key=lambda v: parse_reference(v['reference']))
+            self.assertEqual(lookup_reference(self.verses, query, self.index), expected, query)
+
+    def test_non_reference_falls_through(self):
+        """참조가 아니거나 없는 책이면 None을 반환하는지 테스트"""
+        self.assertIsNone(self.index.lookup('사랑'))
+        self.assertIsNone(self.index.lookup('사랑 3'))
+
+class TestReferenceMatcher(unittest.TestCase):
+    def setUp(self):
+        self.verses = load_verses()
+        self.matcher = build_reference_matcher(self.verses)
+
+    def test_matches_are_exact_ordered_and_unique(self):
+        """응답 순서대로, 중복 없이, 더 긴 참조의 일부는 잡지 않는지 테스트"""
+        matched = self.matcher.match('1. 요한복음 1:12 - 영접하는 자\n2. John 3:16\n3. 요한복음 1:12')
+        self.assertEqual([v['reference'] for v in matched], ['요한복음 1:12', '요한복음 3:16'])
+
+    def test_token_boundaries(self):
+        """참조 앞뒤에 다른 글자나 절 범위가 붙으면 일치로 보지 않는지 테스트"""
+        self.assertEqual(self.matcher.match('요한복음 1:1-3, 1 John 1:1, xJohn 1:1'), [])
+        self.assertEqual([v['reference'] for v in self.matcher.match('(요한복음 1:1).')], ['요한복음 1:1'])
+
+    def test_agrees_with_substring_loop_on_whole_references(self):
+        """경계가 분명한 응답에서는 기존 부분 문자열 방식과 같은 구절을 찾는지 테스트"""
+        response = '\n'.join(v['reference'] for v in self.verses[::7])
+        expected = [v for v in self.verses if v['reference'] in response.split('\n')]
+        self.assertEqual(sorted(v['reference'] for v in self.matcher.match(response)),
+                         sorted(v['reference'] for v in expected))
+
+class TestShardedSearch(unittest.TestCase):
+    def setUp(self):
+        self.verses = load_verses()
+
+    def test_shards_respect_token_budget(self):
+        """샤드가 순서를 지키며 모든 구절을 나누고 예산을 넘지 않는지 테스트"""
+        shards = shard_verses(self.verses, 300)
+        self.assertGreater(len(shards), 1)
+        self.assertEqual([v for shard in shards for v in shard], self.verses)
+        for shard in shards:
+            self.assertLessEqual(sum(estimate_tokens(verse_line(v)) + 1 for v in shard), 300)
+
+    def test_map_reduce_with_local_backend(self):
+        """샤드마다 한 번, reduce에 한 번 호출하고 동시 호출 수를 지키는지 테스트"""
+        lock = threading.Lock()
+        calls, active, peak = [], [0], [0]
+
+        def backend(query, verses, limit):
+            with lock:
+                calls.append(len(verses))
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+            return local_rank(query, verses, limit)
+
+        shards = shard_verses(self.verses, 300)
+        result = map_reduce_search(self.verses, '독생자를 주셨으니', backend, token_budget=300, parallelism=2)
+        self.assertEqual(len(calls), len(shards) + 1)
+        self.assertLessEqual(peak[0], 2)
+        self.assertEqual(result[0]['reference'], '요한복음 3:16')
+        self.assertLessEqual(len(result), 3)
+
+    def test_failed_shard_is_skipped(self):
+        """실패한 샤드는 건너뛰고 나머지 샤드 결과로 답하는지 테스트"""
+        first_shard = shard_verses(self.verses, 300)[0]
+
+        def backend(query, verses, limit):
+            if verses == first_shard:
+                raise RuntimeError('shard failed')
+            return local_rank(query, verses, limit)
+
+        result = sharded_semantic_search(self.verses, '독생자를 주셨으니', backend=backend, token_budget=300)
+        self.assertEqual(result[0]['reference'], '요한복음 3:16')
+        self.assertFalse(any(v in first_shard for v in result))
+
+    def test_local_fallback_reuses_vector_index(self):
+        """모델을 쓸 수 없을 때 주어진 벡터 색인으로 로컬 검색하는지 테스트 (색인을 다시 만들지 않음)"""
+        vector_index = build_vector_index(self.verses)
+
+        def busy(query, verses, limit):
+            raise ModelBusyError('busy')
+
+        with patch('bible_search.build_vector_index', side_effect=AssertionError('rebuilt')):
+            with patch.object(bible_search.gemini, 'available', return_value=False):
+                result = sharded_semantic_search(self.verses, '독생자를 주셨으니', vector_index=vector_index)
+            self.assertEqual(result[0]['reference'], '요한복음 3:16')
+            result = sharded_semantic_search(self.verses, '독생자를 주셨으니', backend=busy, token_budget=300,
+                                             vector_index=vector_index)
+            self.assertEqual(result[0]['reference'], '요한복음 3:16')
+
+class TestVerseCorpus(unittest.TestCase):
+    def setUp(self):
+        self.verses = load_verses()
+        self.corpus = VerseCorpus.from_verses(self.verses)
+
+    def test_rows_behave_like_verse_dicts(self):
+        """구절 뷰가 기존 딕셔너리와 같게 동작하는지 테스트"""
+        self.assertEqual(len(self.corpus), len(self.verses))
+        self.assertEqual(list(self.corpus), self.verses)
+        self.assertEqual(self.corpus[-1], self.verses[-1])
+        self.assertEqual(dict(self.corpus[0]), self.verses[0])
+        self.assertEqual(self.corpus.books, ['요한복음'])
+        for reference in ['John 1:1', '요한 일서 1:1', '1:1', ' 1:1', '시편  23:1']:
+            corpus = VerseCorpus.from_rows([(reference, '내용')])
+            self.assertEqual(corpus[0]['reference'], reference)
+
+    def test_search_on_corpus(self):
+        """코퍼스 위에서도 색인 검색 결과가 같은지 테스트"""
+        index = build_search_index(self.corpus)
+        for keyword in ['하나님', '빛', '요한복음 3:16']:
+            self.assertEqual(index.search(keyword), search_verses(self.verses, keyword))
+
+    def test_uses_less_memory_than_dicts(self):
+        """버퍼가 구절별 딕셔너리보다 작은지 테스트"""
+        dict_bytes = sum(sys.getsizeof(v) + sys.getsizeof(v['reference']) + sys.getsizeof(v['content'])
+                         for v in self.verses)
+        self.assertLess(self.corpus.nbytes() * 2, dict_bytes)
+
+class TestCompiledCorpus(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.dir.name, 'verses.csv')
+        self.compiled_path = compiled_path_for(self.csv_path)
+        with open('bible_verses.csv', 'r', encoding='utf-8') as src, open(self.csv_path, 'w', encoding='utf-8') as dst:
+            dst.write(src.read())
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_compiled_corpus_matches_csv(self):
+        """컴파일된 파일을 mmap으로 연 코퍼스가 CSV와 같은지 테스트"""
+        compile_corpus(self.csv_path)
+        corpus = load_compiled_corpus(self.csv_path)
+        self.assertEqual(list(corpus), load_verses(self.csv_path))
+        self.assertIsInstance(corpus._contents, memoryview)
+
+    def test_recompiles_when_csv_changes(self):
+        """CSV가 바뀌면 다시 컴파일하는지 테스트"""
+        load_compiled_corpus(self.csv_path)
+        self.assertTrue(is_compiled_fresh(self.csv_path, self.compiled_path))
+        with open(self.csv_path, 'a', encoding='utf-8') as file:
+            file.write('\n시편 23:1,여호와는 나의 목자시니\n')
+        self.assertFalse(is_compiled_fresh(self.csv_path, self.compiled_path))
+        corpus = load_compiled_corpus(self.csv_path)
+        self.assertEqual(corpus[-1]['reference'], '시편 23:1')
+
+class TestVerseCache(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        self._write(['요한복음 1:1,태초에 말씀이 계시니라'])
+
+    def tearDown(self):
+        os.remove(self.path)
+        if os.path.exists(compiled_path_for(self.path)):
+            os.remove(compiled_path_for(self.path))
+
+    def _write(self, rows):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write('reference,content\n' + '\n'.join(rows) + '\n')
+
+    def test_loads_once_until_file_changes(self):
+        """파일이 바뀔 때만 다시 읽고 버전을 올리는지 테스트"""
+        cache = VerseCache(self.path)
+        verses = cache.get()
+        self.assertIs(cache.get(), verses)
+        self.assertEqual(cache.version, 1)
+        self.assertIs(cache.search_index(), cache.search_index())
+
+        self._write(['요한복음 1:1,태초에 말씀이 계시니라', '요한복음 3:16,하나님이 세상을 이처럼 사랑하사'])
+        self.assertEqual(len(cache.get()), 2)
+        self.assertEqual(cache.version, 2)
+        self.assertEqual(len(cache.search_index().search('사랑')), 1)
+
+    def test_cli_builds_indexes_on_first_use(self):
+        """CLI가 시작할 때 색인을 만들지 않고 선택한 모드의 색인만 만드는지 테스트"""
+        cache = VerseCache(self.path)
+        built = []
+
+        def tracking(name, build):
+            return lambda verses: built.append(name) or build(verses)
+
+        with patch('bible_search.verse_cache', cache), \
+                patch('bible_search.build_jamo_index', tracking('jamo', build_jamo_index)), \
+                patch('bible_search.build_fuzzy_index', tracking('fuzzy', build_fuzzy_index)), \
+                patch('bible_search.build_vector_index', tracking('vectors', build_vector_index)), \
+                patch('bible_search.build_bm25_index', tracking('bm25', build_bm25_index)), \
+                patch('builtins.input', side_effect=['6', 'ㅌㅊ', '6', '태초', 'q']), \
+                patch('builtins.print'):
+            bible_search.main()
+        self.assertEqual(built, ['jamo'])
+
+    def test_derived_values_build_outside_the_lock(self):
+        """느린 파생 값을 만드는 동안 다른 파생 값은 기다리지 않고, 같은 값은 한 번만 만드는지 테스트"""
+        cache = VerseCache(self.path)
+        started, release, calls = threading.Event(), threading.Event(), []
+
+        def slow(verses):
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return len(verses)
+
+        results = []
+        builders = [threading.Thread(target=lambda: results.append(cache.derived('slow', slow))) for _ in range(2)]
+        for thread in builders:
+            thread.start()
+        self.assertTrue(started.wait(5))
+        try:
+            self.assertEqual(len(cache.search_index().search('태초')), 1)
+        finally:
+            release.set()
+            for thread in builders:
+                thread.join()
+        self.assertEqual((results, len(calls)), ([1, 1], 1))
+        self.assertEqual(cache.derived('slow', slow), 1)
+        self.assertEqual(len(calls), 1)
+
+    def test_invalidate_forces_reload(self):
+        """invalidate() 후 다시 읽는지 테스트"""
+        cache = VerseCache(self.path)
+        verses = cache.get()
+        cache.invalidate()
+        self.assertIsNot(cache.get(), verses)
+        self.assertEqual(cache.version, 2)
+
+class TestSemanticResultCache(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.result = [{'reference': '요한복음 6:67-71', 'content': '예수께서 열두 제자에게 이르시되 너희도 가려느냐'}]
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_normalized_queries_share_key(self):
+        """공백만 다른 질의가 같은 키를 갖는지 테스트"""
+        key = cache_key("예수님의 제자는 몇 명인가요?", 'v1', 'model', {'temperature': 0.7})
+        self.assertEqual(key, cache_key("  예수님의  제자는 몇 명인가요? ", 'v1', 'model', {'temperature': 0.7}))
+        self.assertNotEqual(key, cache_key("예수님의 제자는 몇 명인가요?", 'v2', 'model', {'temperature': 0.7}))
+
+    def test_results_survive_restart(self):
+        """디스크 계층의 결과를 새 캐시 인스턴스가 읽는지 테스트"""
+        SemanticResultCache(self.path).put('key', self.result)
+        cache = SemanticResultCache(self.path)
+        self.assertEqual(cache.get('key'), self.result)
+        self.assertEqual(cache.get('key'), self.result)
+        self.assertIsNone(cache.get('other'))
+        self.assertEqual((cache.disk_hits, cache.memory_hits, cache.misses), (1, 1, 1))
+
+    def test_ttl_and_size_eviction(self):
+        """TTL이 지난 항목과 최대 개수를 넘는 항목이 지워지는지 테스트"""
+        cache = SemanticResultCache(self.path, memory_size=0, max_entries=2)
+        for key in ['a', 'b', 'c']:
+            cache.put(key, self.result)
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+        expired = SemanticResultCache(self.path, memory_size=0, ttl=-1)
+        self.assertIsNone(expired.get('c'))
+
+    def test_fragment_cache_evicts_least_recently_used(self):
+        """렌더링 조각 캐시가 가장 오래 쓰이지 않은 조각부터 버리는지 테스트"""
+        cache = FragmentCache(max_entries=2)
+        cache.put('a', '<p>a</p>')
+        cache.put('b', '<p>b</p>')
+        self.assertEqual(cache.get('a'), '<p>a</p>')
+        cache.put('c', '<p>c</p>')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'entries': 2})
+
+class StoreTestCase(unittest.TestCase):
+    """bible_verses.csv를 가져온 임시 VerseStore(self.store)를 테스트마다 새로 만드는 기반 클래스"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        os.remove(self.path)
+        self.store = VerseStore(self.path)
+        self.store.init('bible_verses.csv')
+
+    def tearDown(self):
+        self.store.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def start_patches(self, *patches):
+        """patch들을 시작하고 테스트가 끝나면 되돌리는 함수"""
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+class TestVerseStore(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.verses = load_verses()
+
+    def test_bulk_import_and_fts_search_match_linear_search(self):
+        """CSV 가져오기와 FTS5 검색 결과가 전체 순회 검색과 같은지 테스트"""
+        self.assertEqual(self.store.all_verses(), self.verses)
+        for keyword in ['하나님', '빛', '사랑하', '요한복음 1:1', '태초에 말씀이', 'JOHN', '"따옴표"']:
+            self.assertEqual(self.store.search(keyword), search_verses(self.verses, keyword), keyword)
+
+    def test_thread_connections_close_when_threads_end(self):
+        """요청마다 새 스레드가 검색해도 열린 연결 수가 늘어나지 않는지 테스트"""
+        self.store.search('태초에')
+        results = []
+        for _ in range(50):
+            thread = threading.Thread(target=lambda: results.append(len(self.store.search('태초에'))))
+            thread.start()
+            thread.join()
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(len(self.store.pool), 1)
+        self.assertEqual(self.store.search('태초에'), self.store.search('태초에'))
+
+    def test_keyset_pages_cover_corpus_in_stored_order(self):
+        """키셋 페이지를 이어 붙이면 CSV(저장) 순서의 전체 목록이 되는지 테스트"""
+        pages, cursor = [], None
+        while True:
+            verses, cursor = self.store.page_by_id(cursor, 25)
+            pages.append(verses)
+            if cursor is None:
+                break
+        self.assertTrue(all(len(page) == 25 for page in pages[:-1]))
+        self.assertEqual([v for page in pages for v in page], self.verses)
+        self.assertEqual(list(self.store.iter_by_id(7)), self.verses)
+        self.assertEqual(self.store.page_by_id(None, len(self.verses)), (self.verses, None))
+
+    def test_keyset_cursor_is_stable_across_writes(self):
+        """앞쪽 구절이 지워지거나 새 구절이 추가되어도 다음 쪽이 커서 다음부터 이어지는지 테스트"""
+        first, cursor = self.store.page_by_id(None, 10)
+        self.store.delete(first[0]['reference'])
+        self.store.add('가나다 1:1', '맨 뒤에 붙는 구절')
+        second, _ = self.store.page_by_id(cursor, 10)
+        self.assertEqual(first + second, self.verses[:20])
+        *_, last = self.store.iter_by_id()
+        self.assertEqual(last['reference'], '가나다 1:1')
+
+    def test_bulk_import_reports_duplicates(self):
+        """대량 가져오기가 새 구절만 추가하고 중복과 빈 행을 모아 보고하는지 테스트"""
+        rows = [('시편 23:1', '여호와는 나의 목자시니'), ('요한복음 3:16', '중복'), ('', '빈 참조'),
+                ('시편 23:2', '그가 나를 푸른 풀밭에 누이시며'), ('시편 23:1', '입력 안의 중복')]
+        report = self.store.bulk_import(iter(rows), batch_size=2)
+        self.assertEqual(report, {'inserted': 2, 'duplicates': 2, 'skipped': 1,
+                                  'duplicate_references': ['요한복음 3:16', '시편 23:1']})
+        self.assertEqual([v['reference'] for v in self.store.search('목자시니')], ['시편 23:1'])
+        self.assertNotEqual(self.store.get('요한복음 3:16')['content'], '중복')
+
+    def test_bulk_import_is_atomic(self):
+        """읽는 도중 오류가 나면 앞 배치까지 모두 되돌리는지 테스트"""
+        lines = io.StringIO('{"reference": "시편 23:1", "content": "목자"}\n잘못된 줄\n')
+        with self.assertRaises(ValueError):
+            self.store.bulk_import(iter_rows(lines, 'jsonl'), batch_size=1)
+        self.assertIsNone(self.store.get('시편 23:1'))
+
+    def test_export_round_trip(self):
+        """CSV·JSONL로 내보낸 것을 다시 가져오면 같은 구절이 같은 순서로 나오는지 테스트"""
+        expected = self.verses
+        for fmt in ['csv', 'jsonl']:
+            exported = ''.join(self.store.export(fmt, batch_size=10))
+            rows = list(iter_rows(io.StringIO(exported), fmt))
+            self.assertEqual([{'reference': r, 'content': c} for r, c in rows], expected, fmt)
+        self.assertEqual(''.join(format_rows([], 'csv')), 'reference,content\n')
+
+    def test_change_stamp_advances_on_write(self):
+        """쓰기마다 변경 기록 위치가 오르고 시각이 기록되는지 테스트"""
+        position, changed_at = self.store.change_stamp()
+        self.assertIsNotNone(changed_at)
+        self.assertLessEqual(abs(changed_at - time.time()), 5)
+        self.store.update('요한복음 3:16', '수정된 내용')
+        self.assertEqual(self.store.change_stamp()[0], position + 1)
+        self.store.prune_changes(0)
+        self.assertEqual(self.store.change_stamp(), (position + 1, None))
+
+    def test_triggers_keep_index_in_sync(self):
+        """추가·수정·삭제 후 색인과 변경 카운터가 맞춰지는지 테스트"""
+        version = self.store.data_version()
+        self.store.add('시편 23:1', '여호와는 나의 목자시니 내게 부족함이 없으리로다')
+        self.assertEqual([v['reference'] for v in self.store.search('목자시니')], ['시편 23:1'])
+        self.store.update('시편 23:1', '여호와는 나의 목자시니')
+        self.assertEqual(self.store.search('부족함이'), [])
+        self.store.delete('시편 23:1')
+        self.assertEqual(self.store.search('목자시니'), [])
+        self.assertEqual(self.store.data_version(), version + 3)
+
+    def test_legacy_table_is_migrated(self):
+        """id 열이 없는 예전 테이블을 새 스키마로 옮기는지 테스트"""
+        self.store.close()
+        os.remove(self.path)
+        with sqlite3.connect(self.path) as conn:
+            conn.execute('CREATE TABLE bible_verses (reference TEXT PRIMARY KEY, content TEXT)')
+            conn.execute("INSERT INTO bible_verses VALUES ('시편 23:1', '여호와는 나의 목자시니')")
+        self.store.init('bible_verses.csv')
+        self.assertEqual(self.store.search('목자시니'), [{'reference': '시편 23:1', 'content': '여호와는 나의 목자시니'}])
+        self.assertEqual(len(self.store.all_verses()), 1)
+
+    def test_reads_continue_during_writes(self):
+        """WAL 모드에서 쓰기 트랜잭션이 열려 있어도 다른 스레드의 읽기가 계속되는지 테스트"""
+        writer = self.store.connect()
+        self.assertEqual(writer.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        writer.execute('BEGIN IMMEDIATE')
+        writer.execute("INSERT INTO bible_verses (reference, content) VALUES ('시편 23:1', '여호와는 나의 목자시니')")
+
+        results = []
+        reader = threading.Thread(target=lambda: results.append(self.store.search('하나님')))
+        reader.start()
+        reader.join(timeout=5)
+        writer.commit()
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(results[0]), len(search_verses(self.verses, '하나님')))
+        self.assertEqual(self.store.search('목자시니')[0]['reference'], '시편 23:1')
+
+    def test_concurrent_load(self):
+        """여러 스레드가 읽는 동안 쓰기가 이어져도 오류 없이 처리되는지 테스트"""
+        errors, reads = [], []
+        stop = threading.Event()
+
+        def read():
+            try:
+                while not stop.is_set():
+                    reads.append(len(self.store.search('사랑')))
+            except sqlite3.Error as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        try:
+            for i in range(50):
+                self.store.add(f'테스트 {i}:1', f'사랑 테스트 구절 {i}')
+        finally:
+            stop.set()
+            for thread in readers:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(reads)
+        self.assertEqual(len(self.store.search('테스트 구절')), 50)
+
+class TestLiveVerseCache(StoreTestCase):
+    def _edit(self):
+        self.store.add('테스트 1:1', '반딧불 같은 새 구절 하나님의 사랑')
+        self.store.update('요한복음 3:16', '반딧불 수정된 구절 하나님이 세상을 사랑하사')
+        self.store.delete('요한복음 1:1')
+
+    def _assert_matches_fresh(self, cache):
+        verses = self.store.all_verses()
+        self.assertEqual(sorted(v['reference'] for v in cache.get()), sorted(v['reference'] for v in verses))
+        fresh_ngram, fresh_bm25 = build_search_index(verses), build_bm25_index(verses)
+        for keyword in ['반딧불', '태초에', '하나님', '사랑하사']:
+            self.assertEqual(sorted(v['reference'] for v in cache.search_index().search(keyword)),
+                             sorted(v['reference'] for v in fresh_ngram.search(keyword)), keyword)
+            expected = fresh_bm25.scored(keyword, len(verses))
+            scored = cache.bm25_index().scored(keyword, len(verses))
+            self.assertEqual([round(score, 9) for _, score in scored],
+                             [round(score, 9) for _, score in expected], keyword)
+
+    def test_changes_update_indexes_in_place(self):
+        """추가·수정·삭제가 색인을 다시 만들지 않고 반영되는지 테스트"""
+        cache = LiveVerseCache(self.store, compact_ratio=1.0, background=False)
+        ngram, bm25, vectors = cache.search_index(), cache.bm25_index(), cache.vector_index()
+        self._edit()
+        self._assert_matches_fresh(cache)
+        self.assertIs(cache.search_index(), ngram)
+        self.assertIs(cache.bm25_index(), bm25)
+        self.assertIs(cache.vector_index(), vectors)
+        top = [v['reference'] for v in vectors.top('반딧불 새 구절', 2)]
+        self.assertIn('테스트 1:1', top)
+        self.assertNotIn('요한복음 1:1', [v['reference'] for v in vectors.top('태초에 말씀이 계시니라', 5)])
+        self.assertEqual(cache.reference_index().lookup('요한복음 1:1'), [])
+
+    def test_reference_index_updates_in_place(self):
+        """참조 색인도 다시 만들지 않고 추가·수정·삭제를 반영하는지 테스트"""
+        cache = LiveVerseCache(self.store, compact_ratio=1.0, background=False)
+        references = cache.reference_index()
+        self._edit()
+        fresh = build_reference_index(self.store.all_verses())
+        for text in ['요한복음 1:1', '요한복음 1:1-3', '요한복음 1', '요한복음 3:16', '테스트 1:1', '테스트 1']:
+            self.assertEqual([v['content'] for v in cache.reference_index().lookup(text)],
+                             [v['content'] for v in fresh.lookup(text)], text)
+        self.assertIs(cache.reference_index(), references)
+        self.assertEqual(len(references), len(fresh))
+
+    def test_first_index_build_does_not_block_changes(self):
+        """증분 색인을 처음 만드는 동안에도 변경을 적용하고, 다 만든 색인이 그 변경을 따라잡는지 테스트"""
+        cache = LiveVerseCache(self.store, compact_ratio=1.0, background=False)
+        cache.get()
+        started, release, built = threading.Event(), threading.Event(), []
+
+        def slow_build(verses):
+            started.set()
+            release.wait(5)
+            return build_bm25_index(verses)
+
+        builder = threading.Thread(target=lambda: built.append(cache.derived('bm25', slow_build)))
+        builder.start()
+        try:
+            self.assertTrue(started.wait(5))
+            self._edit()
+            start = time.monotonic()
+            self.assertIn('테스트 1:1', [v['reference'] for v in cache.get()])
+            self.assertLess(time.monotonic() - start, 2)
+        finally:
+            release.set()
+            builder.join()
+        self.assertIs(cache.bm25_index(), built[0])
+        self._assert_matches_fresh(cache)
+        self.store.add('테스트 2:1', '반딧불 다음 구절')
+        self._assert_matches_fresh(cache)
+
+    def test_reload_keeps_serving_the_old_corpus(self):
+        """기록이 정리되어 다시 읽는 동안 잠금을 잡지 않고 이전 코퍼스를 돌려주는지 테스트"""
+        cache = LiveVerseCache(self.store, compact_ratio=1.0, background=True)
+        before = cache.get()
+        self._edit()
+        self.store.prune_changes(0)
+        load, release = cache._load, threading.Event()
+
+        def slow_load(names=()):
+            release.wait(5)
+            return load(names)
+
+        with patch.object(cache, '_load', slow_load):
+            self.assertIs(cache.get(), before)
+            self.assertIs(cache.get(), before)
+            self.assertTrue(cache._lock.acquire(timeout=1))
+            cache._lock.release()
+            release.set()
+            deadline = time.monotonic() + 5
+            while cache.get() is before and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self._assert_matches_fresh(cache)
+
+    def test_readers_run_while_changes_are_applied(self):
+        """색인을 증분 갱신하는 동안 잠금 없이 검색하는 스레드가 오류 없이 도는지 테스트"""
+        cache = LiveVerseCache(self.store, compact_ratio=1e9, background=False)
+        ngram, bm25, vectors = cache.search_index(), cache.bm25_index(), cache.vector_index()
+        references = cache.reference_index()
+        stop = threading.Event()
+        errors, reads = [], [0]
+
+        def read():
+            try:
+                while not stop.is_set():
+                    ngram.search('새 구절')
+                    ngram.search('')
+                    bm25.search('새로운 구절 사랑', 10)
+                    vectors.top(f'새 구절 단어{reads[0] % 50}', 5)
+                    references.lookup('테스트 1')
+                    reads[0] += 1
+            except Exception as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        try:
+            for i in range(500):
+                self.store.add(f'테스트 {i}:1', f'새로운 구절 단어{i} 사랑 {i}')
+                if i % 3 == 0:
+                    self.store.delete(f'테스트 {i // 2}:1')
+                cache.get()
+        finally:
+            stop.set()
+            for thread in readers:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(reads[0])
+        self.assertIs(cache.bm25_index(), bm25)
+        self._assert_matches_fresh(cache)
+
+    def test_compaction_swaps_in_rebuilt_indexes(self):
+        """변경이 쌓이면 새로 만든 색인으로 바꿔 끼우는지 테스트"""
+        cache = LiveVerseCache(self.store, compact_ratio=0.0, background=False)
+        ngram = cache.search_index()
+        self._edit()
+        cache.get()
+        self.assertIsNot(cache.search_index(), ngram)
+        self._assert_matches_fresh(cache)
+
+    def test_reloads_when_change_log_was_pruned(self):
+        """따라잡을 변경 기록이 지워졌으면 전체를 다시 읽는지 테스트"""
+        cache = LiveVerseCache(self.store, compact_ratio=1.0, background=False)
+        cache.search_index()
+        self._edit()
+        self.store.prune_changes(0)
+        self._assert_matches_fresh(cache)
+
+class TestChatHistory(unittest.TestCase):
+    def _message(self, role, text):
+        return {'role': role, 'parts': [text]}
+
+    def test_trim_drops_oldest_pairs_first(self):
+        """예산을 넘으면 가장 오래된 (사용자, 모델) 쌍부터 버리는지 테스트"""
+        history = [self._message(role, f'{i}' + 'x' * 39) for i, role in
+                   enumerate(['user', 'model', 'user', 'model', 'user'])]
+        self.assertEqual(estimate_tokens(history[0]['parts'][0]), 11)
+        trimmed = trim_history(list(history), budget=33)
+        self.assertEqual(trimmed, history[2:])
+        self.assertEqual(trim_history(list(history), budget=55), history)
+
+    def test_trim_keeps_last_user_message(self):
+        """예산보다 큰 마지막 사용자 메시지는 남기는지 테스트"""
+        history = [self._message('user', '짧은 질문'), self._message('model', '짧은 답'),
+                   self._message('user', '긴 질문' * 200)]
+        self.assertEqual(trim_history(history, budget=10), [history[-1]])
+        self.assertEqual(trim_history([history[-1]], budget=1), [history[-1]])
+
+class FakeStreamingModel:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.calls = []
+
+    def generate_content(self, history, stream=False):
+        self.calls.append((history, stream))
+        for text in self.chunks:
+            yield MagicMock(text=text)
+
+class TestStreamReply(unittest.TestCase):
+    @patch('builtins.print')
+    @patch('bible.time.perf_counter', side_effect=[10.0, 11.5, 14.0])
+    def test_joins_chunks_and_times_first_token(self, _clock, _print):
+        """조각을 이어 붙이고 첫 토큰 시간과 전체 시간을 재는지 테스트 (빈 조각은 건너뜀)"""
+        model = FakeStreamingModel(['', '태초에 ', '말씀이 ', '계시니라'])
+        history = [{'role': 'user', 'parts': ['안녕']}]
+        reply, first_token, total = stream_reply(model, history)
+        self.assertEqual(reply, '태초에 말씀이 계시니라')
+        self.assertEqual((first_token, total), (1.5, 4.0))
+        self.assertEqual(model.calls, [(history, True)])
+
+    @patch('builtins.print')
+    @patch('bible.time.perf_counter', side_effect=[10.0, 12.0])
+    def test_empty_stream_reports_total_as_first_token(self, _clock, _print):
+        """조각이 없으면 첫 토큰 시간 대신 전체 시간을 돌려주는지 테스트"""
+        self.assertEqual(stream_reply(FakeStreamingModel(['']), []), ('', 2.0, 2.0))
+
+def original_find_recipes(recipes, ingredient):
+    """색인 도입 전 find_recipes_by_ingredient와 같은 방식 (일치하는 요리 중 재료 구성이 처음인 것만)"""
+    matching, seen = [], set()
+    ingredient = ingredient.lower()
+    for recipe in recipes:
+        key = tuple(sorted(ing.lower() for ing in recipe['ingredients'] if ing))
+        if any(ingredient in ing.lower() for ing in recipe['ingredients'] if ing) and key not in seen:
+            matching.append(recipe)
+            seen.add(key)
+    return matching
+
+def brute_force_pantry(recipes, pantry, exclude=(), require=(), max_missing=0):
+    """요리마다 부족한 재료를 세어 (부족한 수, 재료가 많은 순, 요리 순서)로 정렬하는 방식"""
+    def has(recipe, term):
+        return any(term.lower() in ing for ing in recipe['normalized'])
+
+    ranked = []
+    for recipe_id, recipe in enumerate(recipes):
+        if recipe['duplicate'] or not all(has(recipe, t) for t in require) or any(has(recipe, t) for t in exclude):
+            continue
+        distinct = set(recipe['normalized'])
+        missing = sum(1 for ing in distinct if not any(t.lower() in ing for t in pantry))
+        if missing <= max_missing:
+            ranked.append((missing, -len(distinct), recipe_id))
+    return [recipes[recipe_id] for _, _, recipe_id in sorted(ranked)]
+
+class TestIngredientIndex(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write('요리명,종류,재료1,재료2,재료3,재료4,재료5,재료6\n'
+                       '토마토 파스타,양식,Tomato,파스타면,마늘,올리브유,,\n'
+                       '파스타 변형,양식,마늘,tomato,올리브유,파스타면,,\n'
+                       '마늘빵,양식,식빵,마늘,버터,,,\n'
+                       '김치찌개,한식,돼지고기,김치,두부,대파,양파,고춧가루\n'
+                       '두부조림,한식,두부,간장,대파,,,\n'
+                       '맹물,기타,,,,,,\n')
+        self.recipes = load_recipes(self.path)
+        self.index = build_ingredient_index(self.recipes)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_duplicates_are_skipped(self):
+        """대소문자·순서만 다른 재료 구성은 처음 요리만 나오는지 테스트"""
+        self.assertEqual([r['duplicate'] for r in self.recipes], [False, True, False, False, False, False])
+        names = [r['name'] for r in find_recipes_by_ingredient(self.recipes, 'TOMATO', self.index)]
+        self.assertEqual(names, ['토마토 파스타'])
+        self.assertEqual([r['name'] for r in find_recipes_by_ingredient(self.recipes, '마늘', self.index)],
+                         ['토마토 파스타', '마늘빵'])
+
+    def test_index_matches_linear_and_original_search(self):
+        """모든 재료 부분 문자열과 빈 검색어에서 색인·순회·기존 방식 결과가 같은지 테스트"""
+        for recipes in [self.recipes, load_recipes()]:
+            index = build_ingredient_index(recipes)
+            terms = {''}
+            for recipe in recipes:
+                for ing in recipe['ingredients']:
+                    terms.update(ing[i:j] for i in range(len(ing)) for j in range(i + 1, len(ing) + 1))
+            terms.update(['없는재료', 'TOMATO'])
+            for term in terms:
+                expected = original_find_recipes(recipes, term)
+                self.assertEqual(find_recipes_by_ingredient(recipes, term), expected, term)
+                self.assertEqual(find_recipes_by_ingredient(recipes, term, index), expected, term)
+
+    def test_pantry_ranks_by_missing_count(self):
+        """부족한 재료가 적은 순, 같으면 재료가 많은 순·요리 순서로 나오고 부족한 재료를 알려 주는지 테스트"""
+        results = find_recipes_by_pantry(self.recipes, ['두부', '대파', '마늘', '식빵'], max_missing=1)
+        self.assertEqual([(r['name'], missing) for r, missing in results],
+                         [('맹물', []), ('마늘빵', ['버터']), ('두부조림', ['간장'])])
+        self.assertEqual(find_recipes_by_pantry(self.recipes, ['두부', '대파', '간장']),
+                         [(self.recipes[4], []), (self.recipes[5], [])])
+        names = [r['name'] for r, _ in find_recipes_by_pantry(self.recipes, ['마늘'], max_missing=3)]
+        self.assertEqual(names, ['맹물', '마늘빵', '토마토 파스타', '두부조림'])
+
+    def test_pantry_require_and_exclude(self):
+        """require(AND)와 exclude(NOT) 조건이 적용되는지 테스트"""
+        pantry = ['마늘', '두부', '대파']
+        names = lambda **kw: [r['name'] for r, _ in find_recipes_by_pantry(self.recipes, pantry, max_missing=6, **kw)]
+        self.assertEqual(names(require=['마늘', '올리브']), ['토마토 파스타'])
+        self.assertEqual(names(exclude=['마늘', '두']), ['맹물'])
+        self.assertEqual(names(require=['김치'], exclude=['김치']), [])
+
+    def test_pantry_matches_brute_force(self):
+        """무작위 재료·조건 조합에서 비트셋 계수 결과가 요리별로 세는 결과와 같은지 테스트"""
+        rng = random.Random(7)
+        for recipes in [self.recipes, load_recipes()]:
+            index = build_ingredient_index(recipes)
+            vocabulary = sorted({ing for r in recipes for ing in r['normalized']})
+            terms = vocabulary + [ing[:2] for ing in vocabulary] + ['없는재료']
+            for _ in range(300):
+                pantry = rng.sample(terms, rng.randint(0, 8))
+                require = rng.sample(terms, rng.randint(0, 1))
+                exclude = rng.sample(terms, rng.randint(0, 1))
+                max_missing = rng.randint(0, 4)
+                self.assertEqual(index.pantry(pantry, exclude, require, max_missing),
+                                 brute_force_pantry(recipes, pantry, exclude, require, max_missing),
+                                 (pantry, exclude, require, max_missing))
+
+class TestConcurrency(unittest.TestCase):
+    def test_single_flight_shares_one_call(self):
+        """동시에 들어온 같은 키의 호출이 한 번만 실행되는지 테스트"""
+        flights = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return ['결과']
+
+        leader = threading.Thread(target=lambda: results.append(flights.do('q', slow)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flights.do('q', slow))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [['결과']] * 4)
+
+    def test_limiter_retries_rate_limits_with_backoff(self):
+        """속도 제한 오류를 재시도하고 대기 시간이 상한을 넘지 않는지 테스트"""
+        sleeps = []
+        limiter = CallLimiter(retries=3, base_backoff=1, max_backoff=2,
+                              is_retryable=lambda e: isinstance(e, TimeoutError), sleep=sleeps.append)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise TimeoutError()
+            return 'ok'
+
+        self.assertEqual(limiter.call(flaky), 'ok')
+        self.assertEqual(len(sleeps), 2)
+        self.assertTrue(all(0 <= delay <= 2 for delay in sleeps))
+        with self.assertRaises(ValueError):
+            limiter.call(lambda: (_ for _ in ()).throw(ValueError()))
+
+    def test_limiter_rejects_when_queue_is_full(self):
+        """동시 호출 한도와 대기열이 가득 차면 ModelBusyError를 내는지 테스트"""
+        limiter = CallLimiter(max_concurrent=1, max_queue=0, queue_timeout=0.01)
+        release = threading.Event()
+        holder = threading.Thread(target=lambda: limiter.call(lambda: release.wait(5)))
+        holder.start()
+        time.sleep(0.05)
+        with self.assertRaises(ModelBusyError):
+            limiter.call(lambda: None)
+        release.set()
+        holder.join(5)
+        self.assertIsNone(limiter.call(lambda: None))
+
+def render_stub(template, **context):
+    """render_template 대신 템플릿 이름, 검색어, 결과 참조만 돌려주는 함수"""
+    results = context.get('results') or context.get('verses') or []
+    return f"{template}|{context.get('keyword', '')}|" + ','.join(v['reference'] for v in results)
+
+class TestSearchWeb(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store.add('테스트 1:1', '태초에 말씀이 계시니라 반딧불')
+        self.render = MagicMock(side_effect=render_stub)
+        self.start_patches(patch('bible_search_web.verse_store', self.store),
+                           patch('bible_search_web.verse_cache', LiveVerseCache(self.store, background=False)),
+                           patch('bible_search_web.page_cache', FragmentCache()),
+                           patch('bible_search_web.render_template', self.render))
+        self.client = bible_search_web.app.test_client()
+
+    def test_post_redirects_to_search(self):
+        """POST / 검색이 303으로 GET /search에 넘어가는지 테스트"""
+        response = self.client.post('/', data={'keyword': ' 반딧불 ', 'search_type': 'ranked', 'page': '2'})
+        self.assertEqual(response.status_code, 303)
+        self.assertEqual(response.headers['Location'], '/search?q=%EB%B0%98%EB%94%A7%EB%B6%88&type=ranked&page=2')
+        self.assertEqual(self.client.post('/', data={'keyword': ' '}).status_code, 200)
+
+    def test_search_sends_validators(self):
+        """검색 결과에 ETag, Last-Modified, Cache-Control이 붙는지 테스트"""
+        response = self.client.get('/search?q=반딧불')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('테스트 1:1', response.get_data(as_text=True))
+        self.assertTrue(response.headers['ETag'])
+        self.assertIsNotNone(response.last_modified)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        with patch('bible_search_web.SEARCH_MAX_AGE', 60):
+            response = self.client.get('/search?q=반딧불')
+        self.assertEqual(response.cache_control.max_age, 60)
+        self.assertTrue(response.cache_control.public)
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_conditional_get_returns_304(self):
+        """If-None-Match나 If-Modified-Since가 최신이면 렌더링 없이 304를 돌려주는지 테스트"""
+        first = self.client.get('/search?q=반딧불')
+        etag = first.headers['ETag']
+        response = self.client.get('/search?q=반딧불', headers={'If-None-Match': etag})
+        self.assertEqual((response.status_code, response.get_data()), (304, b''))
+        self.assertEqual(response.headers['ETag'], etag)
+        response = self.client.get('/search?q=반딧불', headers={'If-Modified-Since': first.headers['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.render.call_count, 1)
+
+    def test_write_changes_etag(self):
+        """구절이 바뀌면 ETag가 바뀌어 새 결과를 돌려주는지 테스트"""
+        etag = self.client.get('/search?q=반딧불').headers['ETag']
+        self.store.add('테스트 2:1', '두 번째 반딧불')
+        response = self.client.get('/search?q=반딧불', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('테스트 2:1', response.get_data(as_text=True))
+
+    def test_whitespace_in_query_is_part_of_the_key(self):
+        """공백만 다른 검색어가 같은 캐시 쪽을 쓰지 않는지 테스트"""
+        one = self.client.get('/search?q=태초에 말씀')
+        two = self.client.get('/search?q=태초에  말씀', headers={'If-None-Match': one.headers['ETag']})
+        self.assertEqual(two.status_code, 200)
+        self.assertNotEqual(two.headers['ETag'], one.headers['ETag'])
+        self.assertIn('|태초에  말씀|', two.get_data(as_text=True))
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_flash_and_model_pages_are_not_cached(self):
+        """flash 메시지가 있거나 모델 검색이면 캐시하지 않는지 테스트"""
+        with self.client.session_transaction() as session:
+            session['_flashes'] = [('success', '구절이 추가되었습니다')]
+        response = self.client.get('/search?q=반딧불')
+        self.assertTrue(response.cache_control.no_store)
+        self.assertNotIn('ETag', response.headers)
+        with patch('bible_search_web.search_page', return_value=([], False)):
+            for _ in range(2):
+                response = self.client.get('/search?q=반딧불&type=semantic')
+                self.assertTrue(response.cache_control.no_store)
+                self.assertNotIn('ETag', response.headers)
+        self.assertEqual(self.render.call_count, 3)
+
+    def test_bad_requests(self):
+        """잘못된 검색 종류는 400, 빈 검색어는 첫 화면으로 보내는지 테스트"""
+        self.assertEqual(self.client.get('/search?q=반딧불&type=nope').status_code, 400)
+        response = self.client.get('/search?q=%20')
+        self.assertEqual((response.status_code, response.headers['Location']), (302, '/'))
+
+class FakeAsgiClient:
+    """ASGI 앱에 요청 하나를 보내고 응답을 모으는 도우미 (hang_up()을 부르면 연결을 끊는다)"""
+
+    def __init__(self, method, path, query='', body=b''):
+        self.scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode('utf-8')}
+        self.messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        self.disconnected = asyncio.Event()
+        self.sent = []
+
+    async def receive(self):
+        if self.messages:
+            return self.messages.pop(0)
+        await self.disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    def hang_up(self):
+        self.disconnected.set()
+
+    def request(self):
+        return bible_search_asgi.app(self.scope, self.receive, self.send)
+
+    def response(self):
+        return self.sent[0]['status'], json.loads(self.sent[1]['body'])
+
+class TestSearchAsgi(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store.add('테스트 1:1', '태초에 말씀이 계시니라 반딧불')
+        cache = LiveVerseCache(self.store, background=False)
+        self.model_pool = ThreadPoolExecutor(max_workers=1)
+        self.release, self.started, self.calls = threading.Event(), threading.Event(), []
+        self.start_patches(patch('bible_search_web.verse_store', self.store),
+                           patch('bible_search_web.verse_cache', cache),
+                           patch('bible_search_asgi.verse_cache', cache),
+                           patch('bible_search_asgi.model_pool', self.model_pool),
+                           patch('bible_search_asgi.run_search', self.slow_model_search))
+
+    def tearDown(self):
+        self.release.set()
+        self.model_pool.shutdown(wait=True)
+        super().tearDown()
+
+    def slow_model_search(self, search_type, keyword):
+        self.calls.append(keyword)
+        self.started.set()
+        self.release.wait(5)
+        return [{'reference': '모델 1:1', 'content': keyword}]
+
+    def fetch(self, method, path, query='', body=b''):
+        client = FakeAsgiClient(method, path, query, body)
+        asyncio.run(client.request())
+        return client.response()
+
+    def test_routes_and_bad_requests(self):
+        """없는 경로는 404, 잘못된 검색 종류·빈 검색어·잘못된 본문은 400인지 테스트"""
+        self.assertEqual(self.fetch('GET', '/api/nope')[0], 404)
+        self.assertEqual(self.fetch('POST', '/api/search', 'q=반딧불')[0], 404)
+        self.assertEqual(self.fetch('GET', '/api/search', 'q=반딧불&type=nope')[0], 400)
+        self.assertEqual(self.fetch('GET', '/api/search', 'q=%20')[0], 400)
+        self.assertEqual(self.fetch('POST', '/api/semantic_batch', body=b'not json')[0], 400)
+        self.assertEqual(self.fetch('POST', '/api/semantic_batch', body=b'{"queries": ["", "a"]}')[0], 400)
+        self.assertEqual(self.calls, [])
+
+    def test_keyword_search(self):
+        """키워드 검색 결과를 JSON으로 돌려주는지 테스트"""
+        status, payload = self.fetch('GET', '/api/search', 'q=반딧불&page=0')
+        self.assertEqual(status, 200)
+        self.assertEqual((payload['type'], payload['page'], payload['has_next']), ('keyword', 1, False))
+        self.assertEqual([v['reference'] for v in payload['verses']], ['테스트 1:1'])
+
+    def test_slow_model_call_does_not_block_keyword_search(self):
+        """모델 호출이 걸려 있는 동안에도 키워드 검색이 끝나는지 테스트"""
+        async def scenario():
+            model = FakeAsgiClient('GET', '/api/search', 'q=느린 질문&type=semantic')
+            pending = asyncio.ensure_future(model.request())
+            self.assertTrue(await asyncio.to_thread(self.started.wait, 5))
+            keyword = FakeAsgiClient('GET', '/api/search', 'q=반딧불')
+            await asyncio.wait_for(keyword.request(), 5)
+            self.assertFalse(pending.done())
+            self.release.set()
+            await pending
+            return keyword.response(), model.response()
+
+        (status, payload), (model_status, model_payload) = asyncio.run(scenario())
+        self.assertEqual((status, model_status), (200, 200))
+        self.assertEqual([v['reference'] for v in payload['verses']], ['테스트 1:1'])
+        self.assertEqual(model_payload['verses'], [{'reference': '모델 1:1', 'content': '느린 질문'}])
+
+    def test_disconnect_cancels_queued_call(self):
+        """대기열에서 기다리던 요청의 연결이 끊기면 모델을 부르지 않고 응답도 보내지 않는지 테스트"""
+        async def scenario():
+            first = FakeAsgiClient('GET', '/api/search', 'q=첫 질문&type=semantic')
+            second = FakeAsgiClient('GET', '/api/search', 'q=둘째 질문&type=sharded')
+            running = asyncio.ensure_future(first.request())
+            self.assertTrue(await asyncio.to_thread(self.started.wait, 5))
+            queued = asyncio.ensure_future(second.request())
+            await asyncio.sleep(0.05)
+            second.hang_up()
+            await asyncio.wait_for(queued, 5)
+            self.release.set()
+            await running
+            return first, second
+
+        first, second = asyncio.run(scenario())
+        self.model_pool.shutdown(wait=True)
+        self.assertEqual(first.response()[0], 200)
+        self.assertEqual(second.sent, [])
+        self.assertEqual(self.calls, ['첫 질문'])
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file